@@ -0,0 +1,141 @@
+#######################
+# Sidebar index for the Activity -> Action Data -> Wand cascade
+#
+# The event log is sorted once by (activity_id, action_data descending) and
+# by wand_identifier. Every selection then resolves to a contiguous slice of
+# those permutation arrays, so the sidebar never scans the whole frame.
+# When a newer version of the log only appends rows (as the ingest store
+# does), extended() merges the sorted new rows into the permutations
+# instead of sorting the whole log again.
+
+import numpy as np
+import pandas as pd
+
+
+def _codes(series):
+    """Returns (integer codes, sorted values) for a column; missing is -1."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), np.asarray(series.cat.categories)
+    codes, uniques = pd.factorize(series, sort=True)
+    return codes, np.asarray(uniques)
+
+
+def _merge(order, new_order, keys):
+    """Returns the rows of two permutations sorted by keys merged into one; new rows go after equal old ones."""
+    positions = np.searchsorted(keys[order], keys[new_order], side='right')
+    merged = np.insert(order, positions, new_order)
+    merged.flags.writeable = False
+    return merged
+
+
+def _runs(keys):
+    """Returns the start offsets of runs of equal values in a sorted array."""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+
+
+class ActivityIndex:
+    """Row positions of the event log grouped by activity, action data and wand.
+
+    All ``*_rows`` methods return read-only views of row positions, ready to
+    be passed to ``DataFrame.take``.
+    """
+
+    def __init__(self, df, activity='activity_id', action='action_data', wand='wand_identifier', key='event_id'):
+        self._columns = (activity, action, wand)
+        self._key = key
+        self._keys = df[key].to_numpy() if key in df.columns else None
+        (a, activity_values), (b, action_values), (w, wand_values) = (_codes(df[c]) for c in self._columns)
+
+        # Activity ascending, action data descending, original order within.
+        order = np.lexsort((-b, a))
+        order = order[a[order] >= 0]
+        order.flags.writeable = False
+        wand_order = np.argsort(w, kind='stable')
+        wand_order = wand_order[w[wand_order] >= 0]
+        wand_order.flags.writeable = False
+        self._index(order, a, activity_values, b, action_values, wand_order, w, wand_values)
+
+    def extended(self, df):
+        """Returns the index of df, reusing this one when df is its frame with rows appended.
+
+        The first rows of df must be the ones this index was built on, as
+        told by their key column; otherwise df is indexed from scratch.
+        """
+        rows = 0 if self._keys is None else len(self._keys)
+        keys = df[self._key].to_numpy() if self._key in df.columns else None
+        if keys is None or self._keys is None or len(keys) < rows or not np.array_equal(keys[:rows], self._keys):
+            return ActivityIndex(df, *self._columns, key=self._key)
+        extended = ActivityIndex.__new__(ActivityIndex)
+        extended._columns = self._columns
+        extended._key = self._key
+        extended._keys = keys
+        # Codes follow the sorted values, so the old permutations stay sorted.
+        (a, activity_values), (b, action_values), (w, wand_values) = (_codes(df[c]) for c in self._columns)
+        new = np.arange(rows, len(df))
+        new_order = new[np.lexsort((-b[new], a[new]))]
+        new_order = new_order[a[new_order] >= 0]
+        order = _merge(self._order, new_order, a.astype(np.int64) * (len(action_values) + 2) + (len(action_values) - b))
+        new_wand_order = new[np.argsort(w[new], kind='stable')]
+        wand_order = _merge(self._wand_order, new_wand_order[w[new_wand_order] >= 0], w)
+        extended._index(order, a, activity_values, b, action_values, wand_order, w, wand_values)
+        return extended
+
+    def _index(self, order, a, activity_values, b, action_values, wand_order, w, wand_values):
+        """Sets the slices of every activity, action data and wand from the sorted permutations."""
+        self._wand_codes = w
+        self._wand_values = wand_values
+        self._order = order
+        a_sorted = a[order]
+        b_sorted = b[order]
+        self._activities = {}
+        self._actions = {}
+        starts = _runs(a_sorted)
+        stops = np.append(starts[1:], len(order))
+        for start, stop in zip(starts, stops):
+            value = activity_values[a_sorted[start]]
+            self._activities[value] = (start, stop)
+            actions = {}
+            group = b_sorted[start:stop]
+            sub_starts = _runs(group)
+            sub_stops = np.append(sub_starts[1:], len(group))
+            for sub_start, sub_stop in zip(sub_starts, sub_stops):
+                code = group[sub_start]
+                if code >= 0:
+                    actions[action_values[code]] = (start + sub_start, start + sub_stop)
+            self._actions[value] = actions
+
+        self._wand_order = wand_order
+        w_sorted = w[wand_order]
+        starts = _runs(w_sorted)
+        stops = np.append(starts[1:], len(wand_order))
+        self._wands = {wand_values[w_sorted[start]]: (start, stop) for start, stop in zip(starts, stops)}
+
+    def activities(self):
+        """Returns the activity ids in ascending order."""
+        return list(self._activities)
+
+    def actions(self, activity):
+        """Returns the action data values of an activity in descending order."""
+        return list(self._actions.get(activity, ()))
+
+    def wands(self, activity, action):
+        """Returns the wands seen for an activity/action in order of appearance."""
+        rows = self.action_rows(activity, action)
+        return list(self._wand_values[pd.unique(self._wand_codes[rows])])
+
+    def activity_rows(self, activity):
+        """Returns the rows of an activity, sorted by action data descending."""
+        start, stop = self._activities.get(activity, (0, 0))
+        return self._order[start:stop]
+
+    def action_rows(self, activity, action):
+        """Returns the rows of an activity/action data pair."""
+        start, stop = self._actions.get(activity, {}).get(action, (0, 0))
+        return self._order[start:stop]
+
+    def wand_rows(self, wand):
+        """Returns every row of a wand across all activities."""
+        start, stop = self._wands.get(wand, (0, 0))
+        return self._wand_order[start:stop]
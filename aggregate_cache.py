@@ -0,0 +1,78 @@
+#######################
+# Bounded LRU cache for per-selection aggregate frames
+#
+# One instance lives in each browser session (st.session_state), so theme
+# changes and other reruns that keep the same selection reuse the frames
+# computed for it instead of running the groupby again.
+
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def frame_nbytes(value):
+    """Returns the deep memory usage of a DataFrame or Series in bytes."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    return 0
+
+
+class AggregateCache:
+    """LRU mapping of selection keys to aggregate frames within a byte budget."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, computing and storing it on a miss."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        value = compute()
+        size = frame_nbytes(value)
+        if size <= self.max_bytes:
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+        return value
+
+    def resize(self, max_bytes):
+        """Changes the budget, evicting least recently used entries as needed."""
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """Returns the counters shown in the debug panel."""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
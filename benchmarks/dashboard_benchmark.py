@@ -0,0 +1,198 @@
+#######################
+# Timings of the dashboard data paths on synthetic logs
+#
+# For each log size the stages the apps run are timed on a synthetic event
+# log and its action_inference aggregate (see synthetic_logs.py): cold and
+# warm loads, sidebar index and filtering, distinct-count aggregates, the
+# summary cube, journeys and transitions, SVG recolouring and chart spec
+# construction. Results go to a JSON file; --compare prints the ratio to an
+# earlier run, e.g. one made on another commit.
+#
+# Usage (from the repo root):
+#   python benchmarks/dashboard_benchmark.py --sizes 10k 1m 10m
+#   python benchmarks/dashboard_benchmark.py --sizes 10k 1m --compare benchmarks/results/abc1234.json
+
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_loader  # noqa: E402
+import downsample  # noqa: E402
+import svg_assets  # noqa: E402
+import svg_heatmap  # noqa: E402
+import synthetic_logs  # noqa: E402
+from activity_index import ActivityIndex  # noqa: E402
+from distinct_counts import grouped_nunique  # noqa: E402
+from journeys import JourneyIndex  # noqa: E402
+from summary_cube import SummaryCube  # noqa: E402
+from transitions import TransitionMatrix  # noqa: E402
+
+RESULTS_DIR = os.path.join('benchmarks', 'results')
+SELECTIONS = 20
+SVG_PAGES = 20
+
+
+def timed(function, repeat=3):
+    """Returns (result, best seconds) over repeat calls."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def selections(index, count=SELECTIONS):
+    """Returns up to count (activity, action data, wand) selections spread over the index."""
+    picked = []
+    for activity in index.activities():
+        for action in index.actions(activity)[:3]:
+            wands = index.wands(activity, action)
+            if wands:
+                picked.append((activity, action, wands[0]))
+    step = max(1, len(picked) // count)
+    return picked[::step][:count]
+
+
+def run_size(rows, work_dir, repeat):
+    """Times every stage on a log of rows events; returns {stage: seconds}."""
+    stages = {}
+    events_path, summary_path = synthetic_logs.write_logs(rows, work_dir)
+    cache_dir = os.path.join(work_dir, 'cache')
+
+    def cold_load():
+        for path in glob.glob(os.path.join(cache_dir, '*')):
+            os.remove(path)
+        return data_loader.load_csv_cached(events_path, cache_dir=cache_dir)
+
+    _, stages['load_csv_cold'] = timed(cold_load, 1)
+    df, stages['load_cached_warm'] = timed(lambda: data_loader.load_csv_cached(events_path, cache_dir=cache_dir), repeat)
+    _, stages['load_csv_pandas'] = timed(lambda: pd.read_csv(events_path), 1)
+
+    index, stages['sidebar_index_build'] = timed(lambda: ActivityIndex(df), 1)
+    picked = selections(index)
+
+    def sidebar():
+        for activity, action, wand in picked:
+            index.actions(activity)
+            index.wands(activity, action)
+            df.take(index.activity_rows(activity))
+            df.take(index.wand_rows(wand))
+
+    _, seconds = timed(sidebar, repeat)
+    stages['sidebar_filter'] = seconds / max(len(picked), 1)
+
+    def sidebar_pandas():
+        for activity, action, wand in picked:
+            selected = df[df.activity_id == activity]
+            list(selected.action_data.unique())
+            list(selected[selected.action_data == action].wand_identifier.unique())
+            df[df.wand_identifier == wand]
+
+    _, seconds = timed(sidebar_pandas, 1)
+    stages['sidebar_filter_pandas'] = seconds / max(len(picked), 1)
+
+    activity_frames = [df.take(index.activity_rows(activity)) for activity, _, _ in picked]
+    _, seconds = timed(lambda: [grouped_nunique(frame, 'action_data') for frame in activity_frames], repeat)
+    stages['nunique'] = seconds / max(len(picked), 1)
+    _, seconds = timed(lambda: [frame.groupby('action_data', observed=True).nunique() for frame in activity_frames], 1)
+    stages['nunique_pandas'] = seconds / max(len(picked), 1)
+
+    cube, stages['cube_build'] = timed(lambda: SummaryCube.from_events(df), 1)
+    unmemoized = SummaryCube(cube.cells, cube.sketches, max_rollups=0)
+    _, seconds = timed(lambda: [unmemoized.rollup(['action_data'], activity_id=activity) for activity, _, _ in picked], repeat)
+    stages['cube_rollup'] = seconds / max(len(picked), 1)
+
+    journeys, stages['journey_index_build'] = timed(lambda: JourneyIndex(df), 1)
+    _, seconds = timed(lambda: [journeys.steps(wand) for _, _, wand in picked], repeat)
+    stages['journey_steps'] = seconds / max(len(picked), 1)
+    _, stages['transitions_build'] = timed(lambda: TransitionMatrix().update_from(df), 1)
+
+    label_index, stages['svg_label_index'] = timed(lambda: svg_assets.load_label_index(summary_path), 1)
+    pages = sorted(glob.glob(os.path.join(svg_heatmap.SVG_DIR, '*.svg')))[:SVG_PAGES]
+    if pages:
+        _, seconds = timed(lambda: [svg_assets.render_themed(page, 'viridis', label_index) for page in pages], repeat)
+        stages['svg_recolour_page'] = seconds / len(pages)
+
+    chart_frame = grouped_nunique(df, 'action_data')
+
+    def chart_spec():
+        points = downsample.downsample(df[['event_id', 'session_id']].set_index('event_id'), y='session_id')
+        scatter = alt.Chart(points.reset_index()).mark_circle().encode(x='event_id:Q', y='session_id:Q')
+        bars = alt.Chart(downsample.downsample(chart_frame).reset_index()).mark_bar().encode(x='action_data:N', y='activity_id:Q')
+        return alt.vconcat(scatter, bars).to_json()
+
+    _, stages['chart_spec'] = timed(chart_spec, repeat)
+    return stages
+
+
+def compare(results, baseline_path):
+    """Prints the ratio of every stage to the same stage in an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = {(r['rows'], r['stage']): r['seconds'] for r in json.load(f)['results']}
+    print(f'\ncompared with {baseline_path} (ratio > 1 is slower)')
+    for result in results:
+        before = baseline.get((result['rows'], result['stage']))
+        if before:
+            print(f"{result['rows']:>10} {result['stage']:<24}{result['seconds'] / before:>8.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the dashboard data paths on synthetic logs.')
+    parser.add_argument('--sizes', nargs='+', default=['10k', '1m', '10m'], help='log sizes, e.g. 10k 1m 10m')
+    parser.add_argument('--repeat', type=int, default=3, help='repeats of the fast stages (best is kept)')
+    parser.add_argument('--out', default=None, help=f'results file (default: {RESULTS_DIR}/<commit>.json)')
+    parser.add_argument('--compare', default=None, help='earlier results file to compare with')
+    parser.add_argument('--work-dir', default=None, help='directory for the generated logs (default: a temp dir)')
+    args = parser.parse_args(argv)
+
+    commit = git_commit()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            rows = synthetic_logs.parse_rows(size)
+            stages = run_size(rows, os.path.join(args.work_dir or tmp, str(rows)), args.repeat)
+            for stage, seconds in stages.items():
+                results.append({'rows': rows, 'stage': stage, 'seconds': seconds})
+                print(f'{rows:>10} {stage:<24}{seconds * 1000:>12.2f} ms')
+
+    out = args.out or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'cpus': os.cpu_count(),
+            'results': results,
+        }, f, indent=1)
+    print(f'results written to {out}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#######################
+# Exact vs HyperLogLog distinct wand counts
+#
+# Builds a synthetic event log (see synthetic_logs.py) and compares, per
+# (activity_id, action_data) group, the exact distinct wand count against
+# GroupedSketches at several error bounds: build latency, peak memory while
+# building, size of the retained structure and observed error. It then
+# rolls the counts up to activity_id: the exact path has to keep the log
+# and count it again, the sketches merge without it.
+#
+# Usage (from the repo root):
+#   python benchmarks/hll_benchmark.py --rows 1000000 --wands 50000
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hll  # noqa: E402
+import synthetic_logs  # noqa: E402
+
+KEYS = ['activity_id', 'action_data']
+
+
+def measure(build):
+    """Returns (result, seconds, peak bytes); the time is taken without tracemalloc."""
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def exact_sets(events):
+    """Per-group Python sets, the memory model of an exact distinct count."""
+    return {key: set(group) for key, group in events.groupby(KEYS, observed=True)['wand_identifier']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--wands', type=int, default=50_000)
+    parser.add_argument('--errors', type=float, nargs='+', default=[0.02, 0.05, 0.1])
+    args = parser.parse_args(argv)
+
+    events = synthetic_logs.event_log(args.rows, args.wands)
+    print(f'{args.rows} rows, {args.wands} wands')
+    print(f'{"method":<22}{"build s":>10}{"peak MB":>10}{"kept MB":>10}{"max err":>10}{"mean err":>10}')
+
+    exact, elapsed, peak = measure(lambda: events.groupby(KEYS, observed=True)['wand_identifier'].nunique())
+    print(f'{"groupby.nunique":<22}{elapsed:>10.3f}{peak / 2**20:>10.1f}{exact.memory_usage(deep=True) / 2**20:>10.2f}{0:>10.2%}{0:>10.2%}')
+
+    sets, elapsed, peak = measure(lambda: exact_sets(events))
+    kept = sum(sys.getsizeof(s) for s in sets.values())
+    print(f'{"exact hash sets":<22}{elapsed:>10.3f}{peak / 2**20:>10.1f}{kept / 2**20:>10.2f}{0:>10.2%}{0:>10.2%}')
+    del sets
+
+    for error in args.errors:
+        precision = hll.precision_for_error(error)
+        sketches, elapsed, peak = measure(lambda: hll.GroupedSketches(events, KEYS, 'wand_identifier', precision))
+        observed = (sketches.counts().reindex(exact.index) - exact).abs() / exact
+        name = f'hll p={precision} ({error:.0%})'
+        print(f'{name:<22}{elapsed:>10.3f}{peak / 2**20:>10.1f}{sketches.nbytes / 2**20:>10.2f}{observed.max():>10.2%}{observed.mean():>10.2%}')
+
+    sketches.count(*exact.index[0])
+    start = time.perf_counter()
+    for key in exact.index[:1000]:
+        sketches.count(*key)
+    print(f'sketch lookup: {(time.perf_counter() - start) / min(1000, len(exact)) * 1e6:.1f} us per group')
+
+    # Rows without action_data are in no (activity_id, action_data) sketch.
+    log = events.loc[events['action_data'].notna(), KEYS + ['wand_identifier']]
+    exact, elapsed, peak = measure(lambda: log.groupby('activity_id', observed=True)['wand_identifier'].nunique())
+    print(f'\n{"rollup to activity_id":<22}{"s":>10}{"peak MB":>10}{"kept MB":>10}{"max err":>10}')
+    print(f'{"recount the log":<22}{elapsed:>10.3f}{peak / 2**20:>10.1f}{log.memory_usage(deep=True).sum() / 2**20:>10.2f}{0:>10.2%}')
+    rolled, elapsed, peak = measure(lambda: sketches.rollup('activity_id'))
+    observed = (rolled.counts().reindex(exact.index) - exact).abs() / exact
+    print(f'{f"merge p={precision} sketches":<22}{elapsed:>10.3f}{peak / 2**20:>10.1f}{sketches.nbytes / 2**20:>10.2f}{observed.max():>10.2%}')
+
+
+if __name__ == '__main__':
+    main()
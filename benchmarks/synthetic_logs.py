@@ -0,0 +1,163 @@
+#######################
+# Synthetic wand event logs
+#
+# Generates event logs in the nwu_inference_slim.csv layout and their
+# aggregate in the action_inference.csv layout. Action, activity and action
+# data frequencies follow data/action_inference.csv when it is available
+# (so activity_sequence and wand_sleep dominate as in production), and a
+# built-in skew otherwise. Every wand works through its own sessions in
+# order, and each session through runs of events in one activity.
+#
+# Usage (from the repo root):
+#   python benchmarks/synthetic_logs.py --rows 1000000 --out-dir /tmp/wand_logs
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+REFERENCE = os.path.join('data', 'action_inference.csv')
+
+# Fallback action weights when no reference aggregate is available
+ACTION_WEIGHTS = {
+    'activity_sequence': 40, 'wand_sleep': 20, 'activity_inference': 10, 'kc_file_dl_percent': 5,
+    'wifi_connect': 4, 'activity_back_button': 2, 'wand_activity_start': 2, 'wand_activity_end': 2,
+    'wifi_disconnect': 2, 'kc_file_dl_error': 1, 'kc_boot': 1, 'kc_ota_start': 0.5, 'kc_ota_error': 0.3,
+    'kc_ota_end': 0.2,
+}
+ACTIVITIES = ['ALZ_Story_Activity', 'ALZ_P0000', 'ALZ_P0001', 'ALZ_P0203', 'ALZ_P0405', 'GSG_P1011', 'AFG_P2223']
+
+# Mean events per session and per activity run, and mean seconds between events
+SESSION_EVENTS = 200
+ACTIVITY_EVENTS = 25
+EVENT_SECONDS = 5
+
+
+def parse_rows(text):
+    """Parses a row count such as 10k, 1m or 2500000."""
+    text = str(text).lower().replace('_', '')
+    scale = {'k': 10**3, 'm': 10**6}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def reference_weights(path=REFERENCE):
+    """Returns (action weights, activity weights, action data weights per action) from an aggregate."""
+    if not os.path.exists(path):
+        actions = pd.Series(ACTION_WEIGHTS, dtype=np.float64)
+        activities = pd.Series(1.0, index=ACTIVITIES)
+        labels = {action: pd.Series({f'{action}_{i}': 1.0 for i in range(8)}) for action in actions.index}
+        return actions, activities, labels
+    reference = pd.read_csv(path).dropna(subset=['action'])
+    actions = reference.groupby('action')['Event Count'].sum()
+    activities = reference.dropna(subset=['activity_id']).groupby('activity_id')['Event Count'].sum()
+    labels = {action: group.dropna(subset=['action_data']).groupby('action_data')['Event Count'].sum()
+              for action, group in reference.groupby('action')}
+    return actions, activities, labels
+
+
+def _sample(rng, weights, size):
+    weights = weights[weights > 0]
+    return rng.choice(len(weights), size=size, p=(weights / weights.sum()).to_numpy())
+
+
+def _run_lengths(starts):
+    """Returns the lengths of the runs that begin where starts is True."""
+    return np.diff(np.append(np.flatnonzero(starts), len(starts)))
+
+
+def event_log(rows, wands=None, days=30, seed=0, reference=REFERENCE):
+    """Returns a synthetic event log in the nwu_inference_slim.csv layout."""
+    rng = np.random.default_rng(seed)
+    wands = wands or max(50, rows // 3000)
+    actions, activities, labels = reference_weights(reference)
+
+    action_codes = _sample(rng, actions, rows)
+    action_names = actions[actions > 0].index
+    action_data = np.empty(rows, dtype=object)
+    for code, name in enumerate(action_names):
+        at = np.flatnonzero(action_codes == code)
+        values = labels.get(name)
+        if values is None or not len(values) or not len(at):
+            action_data[at] = None
+            continue
+        action_data[at] = np.asarray(values.index, dtype=object)[_sample(rng, values, len(at))]
+
+    # Each wand works through its sessions one after the other, and every
+    # session through runs of events in one activity. Wands are busy to
+    # different degrees.
+    busy = rng.lognormal(0, 1, wands)
+    wand = np.repeat(np.arange(wands), rng.multinomial(rows, busy / busy.sum()))
+    wand_start = np.diff(wand, prepend=-1) != 0
+    session_start = wand_start | (rng.random(rows) < 1 / SESSION_EVENTS)
+    session_lengths = _run_lengths(session_start)
+    run = np.cumsum(session_start)
+    session = run - np.maximum.accumulate(np.where(wand_start, run, 0)) + 1
+
+    activity_start = session_start | (rng.random(rows) < 1 / ACTIVITY_EVENTS)
+    activity_runs = _run_lengths(activity_start)
+    activity = np.repeat(_sample(rng, activities, len(activity_runs)), activity_runs)
+    activity_names = np.asarray(activities[activities > 0].index, dtype=object)
+
+    # A wand's events follow a few seconds apart within a session, and its
+    # sessions follow one another after idle gaps that spread them over the
+    # days. The log is in time order, as exported.
+    session_wand = wand[session_start]
+    gaps = rng.exponential(EVENT_SECONDS, rows)
+    gaps[session_start] = 0
+    idle = rng.exponential(1, len(session_lengths))
+    spare = np.maximum(days * 86400 - np.bincount(wand, weights=gaps, minlength=wands), 0)
+    idle_total = np.bincount(session_wand, weights=idle, minlength=wands) + rng.exponential(1, wands)
+    gaps[session_start] = idle * (spare / idle_total)[session_wand]
+    elapsed = np.cumsum(gaps)
+    elapsed -= np.repeat(elapsed[wand_start] - gaps[wand_start], _run_lengths(wand_start))
+    seconds = elapsed.astype(np.int64)
+    order = np.argsort(seconds, kind='stable')
+    return pd.DataFrame({
+        'event_id': np.arange(rows, dtype=np.int64),
+        'wand_identifier': pd.Categorical.from_codes(wand[order], [f'MW-{i:06d}' for i in range(wands)]),
+        'session_id': session[order],
+        'activity_id': pd.Categorical(activity_names[activity[order]]),
+        'action': pd.Categorical.from_codes(action_codes, action_names),
+        'action_data': pd.Categorical(action_data),
+        'headphone_state': rng.integers(0, 2, rows, dtype=np.int8),
+        'created_at': pd.Timestamp('2024-03-01') + pd.to_timedelta(seconds[order], unit='s'),
+    })
+
+
+def action_summary(events):
+    """Returns the action_inference.csv aggregate of an event log."""
+    keys = ['activity_id', 'action', 'action_data']
+    grouped = events.groupby(keys, observed=True, dropna=False)
+    summary = pd.DataFrame({
+        'Wand Count': grouped['wand_identifier'].nunique(),
+        'Event Count': grouped.size(),
+    }).reset_index()
+    summary['Events/Wand'] = (summary['Event Count'] / summary['Wand Count']).round(3)
+    return summary
+
+
+def write_logs(rows, out_dir, seed=0):
+    """Writes nwu_inference_slim.csv and action_inference.csv for rows events; returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    events = event_log(rows, seed=seed)
+    events_path = os.path.join(out_dir, 'nwu_inference_slim.csv')
+    summary_path = os.path.join(out_dir, 'action_inference.csv')
+    events.to_csv(events_path, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    action_summary(events).to_csv(summary_path, index=False)
+    return events_path, summary_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic wand event logs.')
+    parser.add_argument('--rows', default='1m', help='number of events, e.g. 10k, 1m, 10m')
+    parser.add_argument('--out-dir', required=True, help='directory for the two CSV files')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    for path in write_logs(parse_rows(args.rows), args.out_dir, args.seed):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#######################
+# Continuous colour scales for the SVG label heat maps
+#
+# Each scheme of the sidebar is sampled once into a lookup table of
+# LUT_SIZE fill styles. Colouring a page normalizes all of its label values
+# in one NumPy pass and indexes the table with the resulting levels, so no
+# colour is computed per element.
+
+import functools
+
+import numpy as np
+
+LUT_SIZE = 256
+
+# Vega scheme names used by the sidebar -> matplotlib colormaps
+COLORMAPS = {
+    'blues': 'Blues',
+    'cividis': 'cividis',
+    'greens': 'Greens',
+    'inferno': 'inferno',
+    'magma': 'magma',
+    'plasma': 'plasma',
+    'reds': 'Reds',
+    'rainbow': 'rainbow',
+    'turbo': 'turbo',
+    'viridis': 'viridis',
+}
+
+
+@functools.lru_cache(maxsize=None)
+def lookup_table(scheme, size=LUT_SIZE):
+    """Returns the fill styles of a scheme sampled at size evenly spaced levels."""
+    from matplotlib import colormaps
+
+    rgb = np.rint(colormaps[COLORMAPS.get(scheme, scheme)](np.linspace(0, 1, size))[:, :3] * 255).astype(np.uint8)
+    styles = np.array(['fill: #%02x%02x%02x' % tuple(c) for c in rgb], dtype=object)
+    styles.flags.writeable = False
+    return styles
+
+
+def levels(values, vmin=None, vmax=None, log=False, size=LUT_SIZE):
+    """Returns the lookup-table level of each value, or -1 where it is missing.
+
+    Values are scaled between vmin and vmax (default: their own finite min
+    and max), on a log1p scale when log is set, and clipped to that range.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if log:
+        values = np.log1p(np.maximum(values, 0))
+    present = np.isfinite(values)
+    out = np.full(values.shape, -1, dtype=np.intp)
+    if not present.any():
+        return out
+    lo = np.nanmin(values[present]) if vmin is None else (np.log1p(vmin) if log else vmin)
+    hi = np.nanmax(values[present]) if vmax is None else (np.log1p(vmax) if log else vmax)
+    span = hi - lo
+    scaled = (values[present] - lo) / span if span > 0 else np.ones(np.count_nonzero(present))
+    out[present] = np.rint(np.clip(scaled, 0, 1) * (size - 1)).astype(np.intp)
+    return out
+
+
+def fill_styles(values, scheme, vmin=None, vmax=None, log=False):
+    """Returns the fill style of every value (None where missing) for a scheme."""
+    table = lookup_table(scheme)
+    index = levels(values, vmin, vmax, log, len(table))
+    return np.where(index >= 0, table[np.maximum(index, 0)], None)
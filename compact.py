@@ -0,0 +1,155 @@
+#######################
+# Compact dtypes for the dashboard datasets
+#
+# pandas reads the exports with object strings and int64/float64 numbers.
+# Each known dataset has a schema here: low-cardinality strings become
+# categories, counts and ids get a fixed integer width (int32 or int64, so
+# they never overflow as the logs grow or when summed), label-like codes
+# are downcast to the smallest integer type that holds them, integers
+# become nullable when values are missing, and timestamps are parsed.
+# Columns a schema does not list are compacted by the same rules from their
+# values; their integers keep 64 bits.
+#
+# Usage:
+#   python compact.py data/action_inference.csv data/activity_durations_*.csv
+
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+# Object columns with fewer distinct values than this share of the rows
+# become categories when no schema names them.
+CATEGORY_MAX_RATIO = 0.5
+
+SCHEMAS = {
+    'action_inference': {
+        'activity_id': 'category',
+        'action': 'category',
+        'action_data': 'category',
+        'Wand Count': 'int64',
+        'Event Count': 'int64',
+        'Events/Wand': 'float32',
+    },
+    'activity_durations': {
+        'wand_identifier': 'category',
+        'session_id': 'int32',
+        'activity_session_id': 'int32',
+        'activity_id': 'category',
+        'seconds': 'int32',
+    },
+    'nwu_inference': {
+        'event_id': 'int64',
+        'wand_identifier': 'category',
+        'session_id': 'int32',
+        'activity_id': 'category',
+        'action': 'category',
+        'action_data': 'category',
+        'headphone_state': 'int',
+        'created_at': 'datetime',
+    },
+}
+
+
+def schema_for(path):
+    """Returns the schema of a dataset from its file name (None when unknown)."""
+    name = os.path.basename(path)
+    for prefix, schema in SCHEMAS.items():
+        if name.startswith(prefix):
+            return schema
+    return None
+
+
+def _integer(series, kind):
+    """Returns series as the smallest (nullable when needed) integer dtype."""
+    values = pd.to_numeric(series)
+    present = values.dropna()
+    if len(present) and not np.array_equal(present, present.round()):
+        return values
+    downcast = 'unsigned' if kind == 'uint' and (present >= 0).all() else 'integer'
+    if not values.isna().any():
+        return pd.to_numeric(values, downcast=downcast)
+    dtype = pd.to_numeric(present, downcast=downcast).dtype if len(present) else np.dtype('int8')
+    return values.astype({'i': 'Int', 'u': 'UInt'}[dtype.kind] + str(dtype.itemsize * 8))
+
+
+def _fixed_integer(series, kind):
+    """Returns series as the integer dtype kind (nullable when needed), or int64 when its values do not fit."""
+    values = pd.to_numeric(series)
+    present = values.dropna()
+    if len(present) and not np.array_equal(present, present.round()):
+        return values
+    dtype = np.dtype(kind)
+    if len(present) and (present.min() < np.iinfo(dtype).min or present.max() > np.iinfo(dtype).max):
+        dtype = np.dtype(np.int64)
+    if values.isna().any():
+        return values.astype(f'Int{dtype.itemsize * 8}')
+    return values.astype(dtype)
+
+
+def compact_column(series, kind=None):
+    """Returns a column in its compact dtype; kind comes from a schema or is inferred."""
+    if kind is None:
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series
+        if pd.api.types.is_integer_dtype(series.dtype):
+            kind = 'int64'
+        elif pd.api.types.is_float_dtype(series.dtype):
+            kind = 'float32'
+        elif pd.api.types.is_string_dtype(series.dtype) or series.dtype == object:
+            if series.nunique() > CATEGORY_MAX_RATIO * max(len(series), 1):
+                return series
+            kind = 'category'
+        else:
+            return series
+    if kind == 'category':
+        return series.astype('category')
+    if kind in ('int', 'uint'):
+        return _integer(series, kind)
+    if kind in ('int32', 'int64'):
+        return _fixed_integer(series, kind)
+    if kind == 'float32':
+        return series.astype('float32')
+    if kind == 'datetime':
+        return pd.to_datetime(series)
+    raise ValueError(f'unknown column kind {kind!r}')
+
+
+def compact(df, schema=None):
+    """Returns df with every column in its compact dtype."""
+    schema = schema or {}
+    return pd.DataFrame({column: compact_column(df[column], schema.get(column)) for column in df.columns})
+
+
+def memory_report(before, after):
+    """Returns the per-column dtype and memory of a frame before and after compaction."""
+    report = pd.DataFrame({
+        'dtype before': before.dtypes.astype(str),
+        'dtype after': after.dtypes.astype(str),
+        'bytes before': before.memory_usage(index=False, deep=True),
+        'bytes after': after.memory_usage(index=False, deep=True),
+    })
+    report['saved'] = report['bytes before'] - report['bytes after']
+    report['saved %'] = (100 * report['saved'] / report['bytes before']).round(1)
+    report.loc['total'] = ['', '', report['bytes before'].sum(), report['bytes after'].sum(),
+                           report['saved'].sum(), round(100 * report['saved'].sum() / report['bytes before'].sum(), 1)]
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report the memory saved by compacting the dashboard datasets.')
+    parser.add_argument('paths', nargs='*', help='CSV exports (default: every CSV under data/)')
+    args = parser.parse_args(argv)
+
+    for path in args.paths or sorted(glob.glob(os.path.join('data', '*.csv'))):
+        before = pd.read_csv(path)
+        after = compact(before, schema_for(path))
+        print(f'{path} ({len(before)} rows)')
+        print(memory_report(before, after).to_string())
+        print()
+
+
+if __name__ == '__main__':
+    main()
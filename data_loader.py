@@ -0,0 +1,165 @@
+#######################
+# Columnar cache for the wand event exports
+#
+# The raw CSV exports are parsed once and written next to the data as an
+# uncompressed Arrow IPC file, with the low-cardinality string columns
+# dictionary-encoded. Later loads memory-map that file: opening it costs
+# no parsing or copying, and only the pages a view actually touches become
+# resident. The loader goes back to the CSV only when the source changes.
+
+import hashlib
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+import compact
+import parallel_csv
+
+CACHE_DIR = os.path.join('data', '.cache')
+CATEGORY_COLUMNS = ['activity_id', 'action', 'action_data', 'wand_identifier']
+
+
+def file_hash(path, block_size=1 << 20):
+    """Returns the sha1 hex digest of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_version(path):
+    """Returns a cheap version key (mtime, size) for a source file."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _cache_paths(path, cache_dir):
+    """Returns the cache files of a source; exports with the same name in different directories get their own."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+    base = os.path.join(cache_dir, f'{name}-{digest}')
+    return base + '.arrow', base + '.json'
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_path, meta):
+    tmp = meta_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+
+def as_categories(df, categories=CATEGORY_COLUMNS):
+    """Casts the low-cardinality columns present in df to category in place."""
+    for column in categories:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def read_csv_columnar(path, categories=CATEGORY_COLUMNS, progress=None):
+    """Parses a CSV export into compact dtypes (see compact.SCHEMAS), in parallel chunks."""
+    return as_categories(parallel_csv.read_csv_parallel(path, compact.schema_for(path), progress=progress), categories)
+
+
+def write_table(table, path):
+    """Writes an uncompressed Arrow IPC file atomically, so it can be memory-mapped."""
+    tmp = path + '.tmp'
+    with ipc.new_file(tmp, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def map_table(path):
+    """Memory-maps an Arrow IPC file as a Table without reading it."""
+    return ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def table_to_frame(table):
+    """Returns a DataFrame over a Table's buffers, with dictionary columns as category.
+
+    Columns without missing values are not copied, so a frame over a
+    memory-mapped table stays backed by the file.
+    """
+    return table.to_pandas(split_blocks=True)
+
+
+def _equal_mask(column, value):
+    """Returns a boolean mask of column == value; dictionary columns compare codes."""
+    if not pa.types.is_dictionary(column.type):
+        return pc.fill_null(pc.equal(column, value), False)
+    masks = []
+    for chunk in column.chunks:
+        code = pc.index(chunk.dictionary, value).as_py()
+        if code < 0:
+            masks.append(pa.repeat(False, len(chunk)))
+        else:
+            masks.append(pc.fill_null(pc.equal(chunk.indices, pa.scalar(code, chunk.indices.type)), False))
+    return pa.chunked_array(masks, pa.bool_())
+
+
+def filter_rows(table, **equals):
+    """Returns the rows of a Table matching every column=value, as a DataFrame.
+
+    The filter runs in Arrow compute kernels on the (dictionary) columns and
+    only the matching rows are converted to pandas.
+    """
+    mask = None
+    for column, value in equals.items():
+        column_mask = _equal_mask(table[column], value)
+        mask = column_mask if mask is None else pc.and_(mask, column_mask)
+    return table_to_frame(table if mask is None else table.filter(mask))
+
+
+def load_table_cached(path, categories=CATEGORY_COLUMNS, cache_dir=CACHE_DIR, use_hash=True, progress=None):
+    """Returns a CSV export as a memory-mapped Arrow Table through the cache.
+
+    The cache is reused while the source mtime and size are unchanged. When
+    they differ and ``use_hash`` is set, the content hash decides whether
+    the CSV really changed (e.g. after a plain ``touch`` or a re-copy).
+    ``progress`` is called with (bytes parsed, total bytes) when the CSV
+    has to be parsed.
+    """
+    arrow_path, meta_path = _cache_paths(path, cache_dir)
+    mtime_ns, size = file_version(path)
+    meta = _read_meta(meta_path)
+    categories = list(categories)
+    schema = compact.schema_for(path)
+
+    if (meta is not None and os.path.exists(arrow_path) and meta.get('categories') == categories
+            and meta.get('schema') == schema):
+        if meta['mtime_ns'] == mtime_ns and meta['size'] == size:
+            return map_table(arrow_path)
+        if use_hash and meta.get('sha1') == file_hash(path):
+            meta.update(mtime_ns=mtime_ns, size=size)
+            _write_meta(meta_path, meta)
+            return map_table(arrow_path)
+
+    df = read_csv_columnar(path, categories, progress)
+    os.makedirs(cache_dir, exist_ok=True)
+    write_table(pa.Table.from_pandas(df, preserve_index=False), arrow_path)
+    _write_meta(meta_path, {
+        'source': path,
+        'mtime_ns': mtime_ns,
+        'size': size,
+        'sha1': file_hash(path) if use_hash else None,
+        'categories': categories,
+        'schema': schema,
+    })
+    return map_table(arrow_path)
+
+
+def load_csv_cached(path, categories=CATEGORY_COLUMNS, cache_dir=CACHE_DIR, use_hash=True, progress=None):
+    """Loads a CSV export as a DataFrame backed by the memory-mapped cache."""
+    return table_to_frame(load_table_cached(path, categories, cache_dir, use_hash, progress))
@@ -0,0 +1,167 @@
+#######################
+# Process-wide registry of read-only datasets
+#
+# Every browser session of a Streamlit server runs in the same process. The
+# registry loads each (dataset, version) once and hands all sessions the
+# same frame; sessions hold a reference-counted lease on the version they
+# are showing. When the source changes, the next acquire loads the new
+# version and makes it current, and an old version is dropped as soon as
+# its last lease is released.
+#
+# Sessions get shallow copies. With pandas Copy-on-Write (always on from
+# pandas 3, switched on here for older versions) a write through a copy
+# never reaches the shared buffers.
+
+import threading
+import weakref
+
+import pandas as pd
+
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+
+def _view(value):
+    """Returns a cheap per-session handle on a shared value."""
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=False)
+    return value
+
+
+def _nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    return int(getattr(value, 'nbytes', 0))
+
+
+class _Entry:
+    def __init__(self):
+        self.value = None
+        self.refs = 0
+        self.loaded = threading.Event()
+        self.error = None
+
+
+class Lease:
+    """A reference on one version of a dataset; release it when done."""
+
+    def __init__(self, registry, name, version, value):
+        self.name = name
+        self.version = version
+        self._value = value
+        self._registry = registry
+        self._released = False
+
+    @property
+    def value(self):
+        return _view(self._value)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._registry._release(self.name, self.version)
+
+    def __enter__(self):
+        return self.value
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class DatasetRegistry:
+    """Loads each (name, version) once and shares it between sessions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._current = {}
+
+    def acquire(self, name, version, loader):
+        """Returns a Lease on the dataset, calling loader() only on first use.
+
+        Concurrent first acquires of the same version wait for a single load.
+        """
+        key = (name, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _Entry()
+            entry.refs += 1
+
+        if owner:
+            try:
+                entry.value = loader()
+            except BaseException as e:
+                entry.error = e
+                with self._lock:
+                    del self._entries[key]
+                raise
+            finally:
+                entry.loaded.set()
+        else:
+            entry.loaded.wait()
+            if entry.error is not None:
+                raise entry.error
+
+        with self._lock:
+            previous = self._current.get(name)
+            self._current[name] = version
+            if previous is not None and previous != version:
+                self._drop_if_unused(name, previous)
+        return Lease(self, name, version, entry.value)
+
+    def _release(self, name, version):
+        with self._lock:
+            entry = self._entries.get((name, version))
+            if entry is None:
+                return
+            entry.refs -= 1
+            if self._current.get(name) != version:
+                self._drop_if_unused(name, version)
+
+    def _drop_if_unused(self, name, version):
+        entry = self._entries.get((name, version))
+        if entry is not None and entry.refs <= 0 and entry.loaded.is_set():
+            del self._entries[(name, version)]
+
+    def stats(self):
+        """Returns one row per loaded version: name, version, refs, bytes, current."""
+        with self._lock:
+            return [
+                {'name': name, 'version': version, 'refs': entry.refs,
+                 'bytes': _nbytes(entry.value), 'current': self._current.get(name) == version}
+                for (name, version), entry in self._entries.items()
+            ]
+
+
+REGISTRY = DatasetRegistry()
+
+
+def _release_all(leases):
+    for lease in leases.values():
+        lease.release()
+    leases.clear()
+
+
+class SessionLeases:
+    """The leases held by one browser session, released when it goes away.
+
+    Keep one instance in st.session_state; when the session ends and its
+    state is garbage collected, every lease it still holds is released.
+    """
+
+    def __init__(self, registry=REGISTRY):
+        self._registry = registry
+        self._leases = {}
+        weakref.finalize(self, _release_all, self._leases)
+
+    def get(self, name, version, loader):
+        """Returns the session's view of the dataset, swapping leases on a new version."""
+        lease = self._leases.get(name)
+        if lease is None or lease.version != version:
+            new_lease = self._registry.acquire(name, version, loader)
+            if lease is not None:
+                lease.release()
+            self._leases[name] = lease = new_lease
+        return lease.value
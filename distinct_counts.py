@@ -0,0 +1,89 @@
+#######################
+# Vectorized distinct counts per group
+#
+# Drop-in replacement for ``df.groupby(by, observed=True).nunique()``. The
+# group column and every value column are factorized once into integer
+# codes; each (group, value) pair is then a single integer, and the number
+# of distinct pairs per group is counted with NumPy instead of per-group
+# hash tables.
+
+import numpy as np
+import pandas as pd
+
+# Above this many (group, value) cells the pairs are deduplicated by sorting
+# instead of through a dense bitmap.
+BITMAP_MAX_CELLS = 1 << 24
+
+
+def _value_codes(series):
+    """Returns (int64 codes, cardinality) for a column; missing is -1."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy().astype(np.int64), len(series.cat.categories)
+    codes, uniques = pd.factorize(series)
+    return codes.astype(np.int64), len(uniques)
+
+
+def factorize_groups(df, by):
+    """Returns (int64 group codes, sorted group Index) for one or more key columns.
+
+    Rows with a missing key get code -1. Multiple keys are combined into one
+    mixed-radix integer per row before factorizing, which is much cheaper
+    than factorizing tuples.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    combined = None
+    levels = []
+    for column in by:
+        codes, uniques = pd.factorize(df[column], sort=True)
+        codes = codes.astype(np.int64)
+        levels.append(uniques)
+        if combined is None:
+            combined = codes
+        else:
+            combined = np.where((combined >= 0) & (codes >= 0), combined * len(uniques) + codes, -1)
+    valid = combined >= 0
+    group_codes = np.full(len(combined), -1, dtype=np.int64)
+    valid_codes, keys = pd.factorize(combined[valid], sort=True)
+    group_codes[valid] = valid_codes
+    arrays = []
+    for level in reversed(levels):
+        arrays.append(level.take(keys % len(level)) if len(level) else level)
+        keys = keys // max(len(level), 1)
+    arrays.reverse()
+    if len(by) == 1:
+        return group_codes, arrays[0].rename(by[0])
+    return group_codes, pd.MultiIndex.from_arrays(arrays, names=by)
+
+
+def _count_distinct(group_codes, n_groups, codes, n_values):
+    keep = (group_codes >= 0) & (codes >= 0)
+    n_values = max(n_values, 1)
+    pairs = group_codes[keep] * n_values + codes[keep]
+    cells = n_groups * n_values
+    if cells <= max(BITMAP_MAX_CELLS, 4 * len(pairs)):
+        seen = np.zeros(cells, dtype=bool)
+        seen[pairs] = True
+        return seen.reshape(n_groups, n_values).sum(axis=1)
+    pairs = np.sort(pairs)
+    first = np.ones(len(pairs), dtype=bool)
+    np.not_equal(pairs[1:], pairs[:-1], out=first[1:])
+    return np.bincount(pairs[first] // n_values, minlength=n_groups)
+
+
+def grouped_nunique(df, by):
+    """Returns the distinct non-null count of every other column per value of by.
+
+    The result matches ``df.groupby(by=by, observed=True).nunique()``: one
+    row per non-null group in sorted order, one int64 column per remaining
+    column of ``df``.
+    """
+    group_codes, groups = pd.factorize(df[by], sort=True)
+    group_codes = group_codes.astype(np.int64)
+    n_groups = len(groups)
+    counts = {}
+    for column in df.columns:
+        if column == by:
+            continue
+        codes, n_values = _value_codes(df[column])
+        counts[column] = _count_distinct(group_codes, n_groups, codes, n_values).astype(np.int64)
+    return pd.DataFrame(counts, index=pd.Index(groups, name=by), columns=[c for c in df.columns if c != by])
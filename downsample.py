@@ -0,0 +1,85 @@
+#######################
+# Point reduction for the dashboard charts
+#
+# Charts get at most max_points rows. Ordered numeric axes are reduced with
+# Largest-Triangle-Three-Buckets, which keeps the visual shape and peaks of
+# a series; unordered data is sampled per quantile stratum of a value
+# column so the density is preserved, and the rows holding each column's
+# minimum and maximum are always kept.
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MAX_POINTS = 2000
+
+
+def lttb(x, y, threshold):
+    """Returns the positions kept by Largest-Triangle-Three-Buckets."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    kept = np.empty(threshold, dtype=np.intp)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[stop:next_stop].mean()
+        next_y = y[stop:next_stop].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        kept[i + 1] = previous
+    return kept
+
+
+def extreme_positions(df):
+    """Returns the positions of the min and max of every numeric column."""
+    positions = set()
+    for column in df.select_dtypes('number').columns:
+        values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        if np.isfinite(values).any():
+            positions.update((int(np.nanargmin(values)), int(np.nanargmax(values))))
+    return positions
+
+
+def stratified_positions(values, n, strata=10, seed=0):
+    """Returns n positions sampled proportionally from quantile strata of values."""
+    values = pd.Series(values).reset_index(drop=True)
+    bins = pd.qcut(values.rank(method='first'), q=min(strata, len(values)), labels=False)
+    rng = np.random.default_rng(seed)
+    kept = []
+    for _, group in values.groupby(bins):
+        take = max(1, round(n * len(group) / len(values)))
+        kept.append(rng.choice(group.index.to_numpy(), size=min(take, len(group)), replace=False))
+    return np.concatenate(kept)
+
+
+def downsample(df, max_points=DEFAULT_MAX_POINTS, x=None, y=None):
+    """Returns at most about max_points rows of df, in their original order.
+
+    With an ordered numeric x (a column, or the index when x is None and the
+    index is numeric and sorted) and a y column, LTTB is used. Otherwise
+    rows are sampled per stratum of y (default: the first numeric column)
+    and the extremes of every numeric column are kept.
+    """
+    if len(df) <= max_points:
+        return df
+    numeric = df.select_dtypes('number').columns
+    y = y if y is not None else (numeric[0] if len(numeric) else None)
+
+    x_values = df[x] if x is not None else df.index.to_series()
+    if y is not None and pd.api.types.is_numeric_dtype(x_values) and x_values.is_monotonic_increasing:
+        return df.iloc[lttb(x_values.to_numpy(), df[y].to_numpy(), max_points)]
+
+    extremes = extreme_positions(df)
+    if y is None:
+        rng = np.random.default_rng(0)
+        sampled = rng.choice(len(df), size=max_points - len(extremes), replace=False)
+    else:
+        sampled = stratified_positions(df[y].to_numpy(), max(max_points - len(extremes), 1))
+    positions = np.union1d(sampled, np.fromiter(extremes, dtype=np.intp, count=len(extremes)))
+    return df.iloc[positions]
@@ -0,0 +1,219 @@
+#######################
+# Activity session durations
+#
+# The activity_durations_*.csv exports have one row per activity session
+# (wand_identifier, session_id, activity_session_id, activity_id, seconds).
+# DurationStats keeps the seconds of every activity and every wand sorted
+# by (group, seconds) and reads each group's percentiles, histogram and
+# totals off the sorted arrays, so the cost does not depend on the number
+# of activities or wands. New sessions (the rows an ingest store took from
+# a newer export, see ingest.py) are merged into the sorted arrays rather
+# than sorting everything again. Readers take the same lock as updates;
+# snapshot() hands out a copy that later updates leave alone.
+
+import glob
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+DURATIONS_GLOB = os.path.join('data', 'activity_durations_*.csv')
+PERCENTILES = (0.5, 0.9, 0.99)
+HISTOGRAM_BINS = 40
+
+
+def latest_export(pattern=DURATIONS_GLOB):
+    """Returns the newest durations export (names carry a timestamp), or None."""
+    paths = sorted(glob.glob(pattern))
+    return paths[-1] if paths else None
+
+
+def grouped_quantiles(codes, values, n_groups, quantiles=PERCENTILES):
+    """Returns an (n_groups, len(quantiles)) array of per-group quantiles.
+
+    Uses linear interpolation like ``Series.quantile``; groups without values
+    get NaN. Rows with a negative code or a missing value are ignored.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes, sorted_values = _sort_groups(codes[keep], values[keep])
+    counts = np.bincount(codes, minlength=n_groups)
+    return _sorted_quantiles(sorted_values, np.cumsum(counts) - counts, counts, quantiles)
+
+
+def _sort_groups(codes, values):
+    """Returns codes and values sorted by (code, value)."""
+    # Sorting one int64 key (group, rank of value) is much faster than a
+    # two-key lexsort.
+    n = len(values)
+    order = np.argsort(values)
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    key = codes.astype(np.int64) * n + rank
+    key.sort()
+    return key // max(n, 1), values[order][key % max(n, 1)]
+
+
+def _sorted_quantiles(sorted_values, starts, counts, quantiles=PERCENTILES):
+    """Returns the quantiles of groups held as slices [start, start + count) of sorted values."""
+    has = counts > 0
+    out = np.full((len(counts), len(quantiles)), np.nan)
+    for j, q in enumerate(quantiles):
+        position = starts[has] + q * (counts[has] - 1)
+        lo = np.floor(position).astype(np.intp)
+        hi = np.minimum(lo + 1, starts[has] + counts[has] - 1)
+        fraction = position - lo
+        out[has, j] = sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * fraction
+    return out
+
+
+def _search_groups(values, offsets, groups, targets):
+    """Returns per target the position of the first value >= target in its group's slice of values.
+
+    Every slice values[offsets[g]:offsets[g + 1]] is sorted; all targets are
+    binary searched together, one halving step at a time.
+    """
+    lo = offsets[groups]
+    hi = offsets[groups + 1]
+    while True:
+        active = np.flatnonzero(lo < hi)
+        if not len(active):
+            return lo
+        mid = (lo[active] + hi[active]) // 2
+        below = values[mid] < targets[active]
+        lo[active] = np.where(below, mid + 1, lo[active])
+        hi[active] = np.where(below, hi[active], mid)
+
+
+def _column_name(q):
+    return f'p{q * 100:g}'
+
+
+class SortedSeconds:
+    """Seconds of every group of one key, sorted by (group, seconds), with session counts and totals.
+
+    Groups are numbered in order of appearance (order sorts them) and the
+    arrays are never changed in place: merged() returns a new instance.
+    """
+
+    def __init__(self):
+        self.labels = pd.Index([], dtype=object)
+        self.order = np.zeros(0, dtype=np.intp)
+        self.values = np.zeros(0)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.sessions = np.zeros(0, dtype=np.int64)
+        self.total = np.zeros(0)
+
+    def merged(self, keys, seconds):
+        """Returns these sessions plus one per (key, seconds) pair; rows with a missing key are left out."""
+        merged = SortedSeconds()
+        inverse, uniques = pd.factorize(keys)
+        uniques = np.asarray(uniques, dtype=object)
+        ids = np.append(self.labels.get_indexer(uniques), -1)
+        new = np.flatnonzero(ids[:-1] < 0)
+        ids[new] = len(self.labels) + np.arange(len(new))
+        merged.labels = self.labels.append(pd.Index(uniques[new], dtype=object))
+        merged.order = merged.labels.argsort() if len(new) else self.order
+        codes = ids[inverse]
+        n_groups, grown = len(merged.labels), len(new)
+
+        keep = codes >= 0
+        sessions = np.concatenate((self.sessions, np.zeros(grown, dtype=np.int64)))
+        merged.sessions = sessions + np.bincount(codes[keep], minlength=n_groups)
+        total = np.concatenate((self.total, np.zeros(grown)))
+        merged.total = total + np.bincount(codes[keep], weights=np.nan_to_num(seconds[keep]), minlength=n_groups)
+
+        present = keep & ~np.isnan(seconds)
+        new_codes, new_values = _sort_groups(codes[present], seconds[present])
+        offsets = np.concatenate((self.offsets, np.full(grown, self.offsets[-1])))
+        positions = _search_groups(self.values, offsets, new_codes, new_values)
+        merged.values = np.insert(self.values, positions, new_values)
+        merged.offsets = offsets + np.concatenate(([0], np.cumsum(np.bincount(new_codes, minlength=n_groups))))
+        return merged
+
+    def summary(self, name):
+        """Returns per group, in sorted order, its sessions, total and mean seconds and percentiles."""
+        summary = pd.DataFrame(_sorted_quantiles(self.values, self.offsets[:-1], np.diff(self.offsets)),
+                               index=self.labels.rename(name), columns=[_column_name(q) for q in PERCENTILES])
+        summary.insert(0, 'Sessions', self.sessions)
+        summary.insert(1, 'Total seconds', self.total)
+        mean = np.divide(self.total, self.sessions, out=np.full(len(self.labels), np.nan), where=self.sessions > 0)
+        summary.insert(2, 'Mean seconds', mean)
+        return summary.take(self.order)
+
+    def histograms(self, name, edges):
+        """Returns per group, in sorted order, its sessions in every bin of edges; the outer bins are open."""
+        n_groups, bins = len(self.labels), len(edges) - 1
+        groups = np.repeat(np.arange(n_groups), bins - 1)
+        below = _search_groups(self.values, self.offsets, groups, np.tile(edges[1:-1], n_groups))
+        cumulative = np.column_stack((self.offsets[:-1], below.reshape(n_groups, bins - 1), self.offsets[1:]))
+        return pd.DataFrame({
+            name: np.repeat(self.labels.to_numpy()[self.order], bins),
+            'seconds': np.tile(edges[:-1], n_groups),
+            'Sessions': np.diff(cumulative, axis=1)[self.order].ravel(),
+        })
+
+
+class DurationStats:
+    """Percentiles, histograms and per-wand dwell times of activity sessions."""
+
+    def __init__(self, df=None, bins=HISTOGRAM_BINS):
+        self.bins = bins
+        self._lock = threading.RLock()
+        self._reset()
+        if df is not None:
+            self.update(df)
+
+    def _reset(self):
+        self.rows = 0
+        self.parts = []
+        self._seconds = {key: SortedSeconds() for key in ('activity_id', 'wand_identifier', None)}
+        self._refresh()
+
+    def _refresh(self):
+        self.activities = self._seconds['activity_id'].summary('activity_id')
+        self.wands = self._seconds['wand_identifier'].summary('wand_identifier')
+
+        # One set of bin edges for every activity, up to the fleet-wide p99;
+        # longer sessions fall in the last bin.
+        fleet = self._seconds[None]
+        top = _sorted_quantiles(fleet.values, np.zeros(1, dtype=np.int64), np.array([len(fleet.values)]), (0.99,))[0, 0]
+        self.edges = np.linspace(0, max(top, 1.0) if len(fleet.values) else 1.0, self.bins + 1)
+        self.histograms = self._seconds['activity_id'].histograms('activity_id', self.edges)
+
+    def update(self, df):
+        """Adds a batch of activity sessions."""
+        seconds = df['seconds'].to_numpy(dtype=np.float64, na_value=np.nan)
+        with self._lock:
+            for key, sorted_seconds in self._seconds.items():
+                keys = df[key] if key is not None else np.zeros(len(df), dtype=np.int64)
+                self._seconds[key] = sorted_seconds.merged(keys, seconds)
+            self.rows += len(df)
+            self._refresh()
+        return self
+
+    def update_from(self, store):
+        """Adds the durations parts an ingest store committed since the last call; starts over if they changed."""
+        with self._lock:
+            parts = store.durations_parts()
+            if parts[:len(self.parts)] != self.parts:
+                self._reset()
+            if len(parts) > len(self.parts):
+                self.update(store.load_durations(parts[len(self.parts):]))
+                self.parts = parts
+        return self
+
+    def snapshot(self, store):
+        """Adds the store's new durations parts and returns a copy of the result."""
+        with self._lock:
+            self.update_from(store)
+            clone = DurationStats.__new__(DurationStats)
+            clone.__dict__.update({name: value for name, value in vars(self).items() if name != '_lock'})
+            clone._seconds = dict(self._seconds)
+            clone._lock = threading.RLock()
+            return clone
+
+    def histogram(self, activity):
+        """Returns the session count per duration bin of one activity."""
+        return self.histograms[self.histograms['activity_id'] == activity].set_index('seconds')['Sessions']
@@ -0,0 +1,160 @@
+#######################
+# Event-rate pyramid
+#
+# Event counts per action are kept at minute, hour and day resolution. A
+# time-series query picks the finest level whose buckets over the requested
+# range still fit in max_points, so a chart stays the same size whether it
+# spans months or minutes. Counts are kept per value of the dimensions the
+# pyramid is keyed by (e.g. the sidebar's activity, action data and wand),
+# so one pyramid answers every selection by filtering its cells. New rows
+# (past an event_id watermark) are bucketed and added to every level, so
+# the pyramid never rescans the rows it has already counted. Readers take
+# the same lock as updates; snapshot() hands out a copy that later updates
+# leave alone.
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+KEY_COLUMN = 'event_id'
+TIMESTAMP_COLUMN = 'created_at'
+LEVELS = {'minute': 'min', 'hour': 'h', 'day': 'D'}
+MAX_POINTS = 1500
+
+
+def _seconds(freq):
+    return pd.Timedelta(1, unit=freq) // pd.Timedelta(1, unit='s')
+
+
+class RatePyramid:
+    """Incrementally maintained minute, hour and day event counts per action and per value of dimensions.
+
+    Every level is a frame of cells (bucket start in seconds, one code per
+    dimension, action code, Events) sorted by bucket; codes index the
+    values in order of appearance, -1 is a missing value.
+    """
+
+    def __init__(self, dimensions=()):
+        self.dimensions = list(dimensions)
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._keys = ['time'] + self.dimensions + ['action']
+        empty = pd.DataFrame({name: np.zeros(0, dtype=np.int32) for name in self._keys}).astype({'time': np.int64})
+        empty['Events'] = np.zeros(0, dtype=np.int64)
+        self.levels = {level: empty for level in LEVELS}
+        self._tables = {name: {} for name in self.dimensions + ['action']}
+        self.watermark = None
+
+    def _codes(self, values, name):
+        """Maps values to stable integer ids, adding new ones to the column's table; missing values get -1."""
+        inverse, uniques = pd.factorize(values)
+        table = self._tables[name]
+        ids = np.array([table.setdefault(value, len(table)) for value in uniques] + [-1], dtype=np.int32)
+        return ids[inverse]
+
+    def _merged(self, cells, batch):
+        """Returns cells with the counts of batch cells added, sorted by (time, codes)."""
+        # Only cells from the batch's first bucket on can meet a batch cell.
+        split = np.searchsorted(cells['time'].to_numpy(), batch['time'].min()) if len(batch) else len(cells)
+        tail = pd.concat([cells.iloc[split:], batch], ignore_index=True)
+        tail = tail.groupby(self._keys, sort=True)['Events'].sum().reset_index()
+        return pd.concat([cells.iloc[:split], tail], ignore_index=True)
+
+    def update(self, events):
+        """Adds a batch of events that were not counted yet."""
+        if not len(events):
+            return
+        times = pd.to_datetime(events[TIMESTAMP_COLUMN]).to_numpy()
+        with self._lock:
+            codes = {name: self._codes(events[name], name) for name in self.dimensions + ['action']}
+            valid = ~pd.isna(times) & (codes['action'] >= 0)
+            rows = pd.DataFrame({name: column[valid] for name, column in codes.items()})
+            unit = _seconds(LEVELS['minute'])
+            rows.insert(0, 'time', times[valid].astype('datetime64[s]').astype(np.int64) // unit * unit)
+            minutes = rows.groupby(self._keys, sort=True).size().rename('Events').reset_index()
+            for level, freq in LEVELS.items():
+                # Coarser levels roll up the batch's minute counts, not its rows.
+                batch = minutes
+                if level != 'minute':
+                    unit = _seconds(freq)
+                    batch = minutes.assign(time=minutes['time'] // unit * unit)
+                    batch = batch.groupby(self._keys, sort=True)['Events'].sum().reset_index()
+                self.levels[level] = self._merged(self.levels[level], batch)
+            batch_max = int(events[KEY_COLUMN].max())
+            self.watermark = batch_max if self.watermark is None else max(self.watermark, batch_max)
+
+    def update_from(self, df):
+        """Counts the rows of df past the watermark; starts over when df no longer extends it."""
+        with self._lock:
+            if self.watermark is not None and len(df) and int(df[KEY_COLUMN].max()) < self.watermark:
+                self._reset()
+            if self.watermark is None:
+                self.update(df)
+            else:
+                self.update(df[df[KEY_COLUMN] > self.watermark])
+        return self
+
+    def snapshot(self, df):
+        """Counts the rows of df past the watermark and returns a copy of the result."""
+        with self._lock:
+            self.update_from(df)
+            clone = RatePyramid(self.dimensions)
+            # Updates replace the level frames rather than changing them
+            clone.levels = dict(self.levels)
+            clone._tables = {name: dict(table) for name, table in self._tables.items()}
+            clone.watermark = self.watermark
+            return clone
+
+    def _matching(self, cells, filters):
+        """Returns the cells whose dimensions have the values of filters ({dimension: value})."""
+        mask = np.ones(len(cells), dtype=bool)
+        for name, value in filters.items():
+            code = -1 if pd.isna(value) else self._tables[name].get(value)
+            if code is None:
+                return cells.iloc[:0]
+            mask &= cells[name].to_numpy() == code
+        return cells if mask.all() else cells[mask]
+
+    def span(self, **filters):
+        """Returns the first and last minute with events of the selection, or (None, None)."""
+        with self._lock:
+            minutes = self._matching(self.levels['minute'], filters)
+        if not len(minutes):
+            return None, None
+        times = minutes['time'].to_numpy()
+        return pd.Timestamp(times[0], unit='s'), pd.Timestamp(times[-1], unit='s')
+
+    def level_for(self, start, end, max_points=MAX_POINTS):
+        """Returns the finest level with at most max_points buckets in [start, end]."""
+        for level, freq in LEVELS.items():
+            if (pd.Timestamp(end) - pd.Timestamp(start)) / pd.Timedelta(1, unit=freq) < max_points:
+                return level
+        return 'day'
+
+    def series(self, start=None, end=None, max_points=MAX_POINTS, level=None, **filters):
+        """Returns (level, bucket x action counts over [start, end]) of the selection, with empty buckets as zeros.
+
+        Keyword arguments select dimension values, e.g.
+        ``pyramid.series(activity_id='ALZ_P0405')``.
+        """
+        with self._lock:
+            first, last = self.span(**filters)
+            if first is None:
+                return level or 'day', pd.DataFrame(dtype=np.int64)
+            start = first if start is None else pd.Timestamp(start)
+            end = last if end is None else pd.Timestamp(end)
+            level = level or self.level_for(start, end, max_points)
+            cells = self.levels[level]
+            actions = np.asarray(list(self._tables['action']), dtype=object).astype(str)
+        freq = LEVELS[level]
+        buckets = pd.date_range(start.floor(freq), end.floor(freq), freq=freq, name='time')
+        bounds = buckets[[0, -1]].to_numpy().astype('datetime64[s]').astype(np.int64) if len(buckets) else [0, -1]
+        times = cells['time'].to_numpy()
+        cells = self._matching(cells.iloc[np.searchsorted(times, bounds[0]):np.searchsorted(times, bounds[1], side='right')], filters)
+        counts = cells.groupby(['time', 'action'])['Events'].sum().unstack(fill_value=0)
+        counts.index = pd.DatetimeIndex(counts.index.to_numpy().astype('datetime64[s]'), name='time')
+        counts.columns = pd.Index(actions[counts.columns.to_numpy()], name='action')
+        return level, counts.reindex(buckets, fill_value=0).astype(np.int64)
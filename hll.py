@@ -0,0 +1,273 @@
+#######################
+# HyperLogLog sketches for approximate distinct counts
+#
+# A sketch keeps 2**precision one-byte registers, whatever the number of
+# distinct values, and two sketches of the same precision merge with an
+# element-wise max. GroupedSketches holds one sketch per group (e.g. per
+# activity or per activity/action data pair), built from a column in one
+# vectorized pass. As in HLL++, a group starts sparse: it keeps only the
+# registers it has set, at SPARSE_PRECISION, and is counted exactly enough
+# by linear counting over those. Only groups whose sparse list would be
+# larger than the dense registers get a row of the dense register matrix,
+# so memory follows the number of distinct (group, value) pairs, not the
+# number of groups times 2**precision.
+
+import math
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from distinct_counts import factorize_groups
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+SPARSE_PRECISION = 25
+# A sparse entry packs its register index and rank into a uint32
+SPARSE_ENTRY_BYTES = 4
+_RANK_BITS = 6
+
+
+def precision_for_error(error):
+    """Returns the smallest precision whose standard error is at most error."""
+    precision = math.ceil(math.log2((1.04 / error) ** 2))
+    return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+
+def standard_error(precision):
+    return 1.04 / math.sqrt(1 << precision)
+
+
+def hash_values(values):
+    """Returns 64-bit hashes of a column's values and a mask of the non-missing ones."""
+    series = pd.Series(values)
+    hashes = pd.util.hash_pandas_object(series, index=False).to_numpy()
+    return hashes, series.notna().to_numpy()
+
+
+def _registers_and_ranks(hashes, precision):
+    """Splits hashes into a register index and a rank (trailing zeros + 1)."""
+    registers = (hashes & np.uint64((1 << precision) - 1)).astype(np.intp)
+    rest = hashes >> np.uint64(precision)
+    lowest_bit = rest & (~rest + np.uint64(1))
+    with np.errstate(divide='ignore'):
+        ranks = np.log2(lowest_bit.astype(np.float64)) + 1
+    ranks[rest == 0] = 64 - precision + 1
+    return registers, ranks.astype(np.uint8)
+
+
+def _pack(fine, ranks):
+    return (fine.astype(np.uint32) << np.uint32(_RANK_BITS)) | ranks.astype(np.uint32)
+
+
+def _fold(packed, precision):
+    """Maps packed sparse (SPARSE_PRECISION) entries to the registers and ranks of precision."""
+    fine = packed >> np.uint32(_RANK_BITS)
+    registers = (fine & np.uint32((1 << precision) - 1)).astype(np.intp)
+    high = (fine >> np.uint32(precision)).astype(np.uint64)
+    lowest_bit = high & (~high + np.uint64(1))
+    with np.errstate(divide='ignore'):
+        high_ranks = np.log2(lowest_bit.astype(np.float64)) + 1
+    ranks = (packed & np.uint32((1 << _RANK_BITS) - 1)).astype(np.float64) + (SPARSE_PRECISION - precision)
+    return registers, np.where(high != 0, high_ranks, ranks).astype(np.uint8)
+
+
+def _linear_count(entries):
+    """Returns the linear counting estimate for a number of set sparse registers."""
+    m = float(1 << SPARSE_PRECISION)
+    return m * np.log(m / (m - np.asarray(entries, dtype=np.float64)))
+
+
+_INVERSE_POWERS = np.ldexp(1.0, -np.arange(256))
+_ESTIMATE_CHUNK = 1 << 22
+
+
+def _estimate(registers):
+    """Returns the cardinality estimate for each row of a register matrix."""
+    m = registers.shape[-1]
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    rows = registers.reshape(-1, m)
+    step = max(1, _ESTIMATE_CHUNK // m)
+    harmonic = np.concatenate([_INVERSE_POWERS[rows[i:i + step]].sum(axis=1) for i in range(0, len(rows), step)] or [np.zeros(0)])
+    zeros = np.count_nonzero(rows == 0, axis=1)
+    raw = alpha * m * m / harmonic
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    estimate = np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+    return estimate.reshape(registers.shape[:-1])
+
+
+class HyperLogLog:
+    """Mergeable approximate distinct counter."""
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    @property
+    def nbytes(self):
+        return self.registers.nbytes
+
+    def update(self, values):
+        hashes, present = hash_values(values)
+        index, ranks = _registers_and_ranks(hashes[present], self.precision)
+        np.maximum.at(self.registers, index, ranks)
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches of different precision')
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    def count(self):
+        return int(round(float(_estimate(self.registers))))
+
+
+class GroupedSketches:
+    """One HyperLogLog sketch of a column per value of one or more key columns.
+
+    Groups with few distinct values are sparse (see the module comment);
+    the others are rows of a dense register matrix. Groups merge into
+    coarser ones without the rows they were built from (see rollup).
+    """
+
+    def __init__(self, df, by, column, precision=12):
+        self.by = [by] if isinstance(by, str) else list(by)
+        self.column = column
+        self.precision = precision
+        group_codes, self._index = factorize_groups(df, self.by)
+        self._groups = None
+
+        hashes, present = hash_values(df[column])
+        keep = present & (group_codes >= 0)
+        fine, ranks = _registers_and_ranks(hashes[keep], SPARSE_PRECISION)
+        self._build(group_codes[keep], _pack(fine, ranks))
+
+    def _build(self, entry_group, packed, dense_group=None, dense_registers=None):
+        """Sets the sketches from (group, packed entry) pairs and optional dense register rows per group."""
+        n_groups = len(self._index)
+        m = 1 << self.precision
+        # Sorted by (group, register, rank): the last of each (group, register) has the highest rank.
+        entries = np.sort((entry_group.astype(np.uint64) << np.uint64(32)) | packed.astype(np.uint64))
+        keys = entries >> np.uint64(_RANK_BITS)
+        last = np.ones(len(entries), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        entries = entries[last]
+        entry_group = (entries >> np.uint64(32)).astype(np.int64)
+        packed = (entries & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+        per_group = np.bincount(entry_group, minlength=n_groups)
+        dense = per_group * SPARSE_ENTRY_BYTES > m
+        if dense_group is not None:
+            dense[dense_group] = True
+        self._dense_row = np.full(n_groups, -1, dtype=np.int64)
+        self._dense_row[dense] = np.arange(np.count_nonzero(dense))
+
+        sparse = ~dense[entry_group]
+        self._sparse = packed[sparse]
+        self._offsets = np.zeros(n_groups + 1, dtype=np.int64)
+        np.cumsum(np.where(dense, 0, per_group), out=self._offsets[1:])
+
+        self.registers = np.zeros((np.count_nonzero(dense), m), dtype=np.uint8)
+        index, ranks = _fold(packed[~sparse], self.precision)
+        np.maximum.at(self.registers.reshape(-1), self._dense_row[entry_group[~sparse]] * m + index, ranks)
+        if dense_group is not None and len(dense_group):
+            np.maximum.at(self.registers, self._dense_row[dense_group], dense_registers)
+
+        estimates = _linear_count(np.diff(self._offsets))
+        estimates[dense] = _estimate(self.registers)
+        self._counts = np.rint(estimates).astype(np.int64)
+
+    @property
+    def nbytes(self):
+        return self.registers.nbytes + self._sparse.nbytes + self._offsets.nbytes + self._dense_row.nbytes
+
+    def _row(self, key):
+        if self._groups is None:
+            self._groups = {group: i for i, group in enumerate(self._index)}
+        return self._groups.get(key[0] if len(key) == 1 else key)
+
+    def sketch(self, *key):
+        """Returns the sketch of one group (empty when the group is unknown)."""
+        row = self._row(key)
+        if row is None:
+            return HyperLogLog(self.precision)
+        if self._dense_row[row] >= 0:
+            return HyperLogLog(self.precision, self.registers[self._dense_row[row]].copy())
+        index, ranks = _fold(self._sparse[self._offsets[row]:self._offsets[row + 1]], self.precision)
+        registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        np.maximum.at(registers, index, ranks)
+        return HyperLogLog(self.precision, registers)
+
+    def count(self, *key):
+        """Returns the approximate distinct count of one group."""
+        row = self._row(key)
+        return 0 if row is None else int(self._counts[row])
+
+    def counts(self):
+        """Returns every group's approximate distinct count as a Series."""
+        return pd.Series(self._counts, index=self._index, name=self.column)
+
+    def merge_groups(self, codes, index, by=None, groups=None):
+        """Returns the sketches of index, where group groups[i] of self merges into codes[i].
+
+        groups defaults to every group; a code of -1 drops the group.
+        """
+        merged = GroupedSketches.__new__(GroupedSketches)
+        merged.by = self.by if by is None else list(by)
+        merged.column = self.column
+        merged.precision = self.precision
+        merged._index = index
+        merged._groups = None
+        codes = np.asarray(codes, dtype=np.int64)
+        groups = np.arange(len(self._index)) if groups is None else np.asarray(groups, dtype=np.int64)
+        keep = codes >= 0
+        codes, groups = codes[keep], groups[keep]
+
+        # Sparse entries of the groups, gathered slice by slice in one pass
+        starts = self._offsets[groups]
+        lengths = self._offsets[groups + 1] - starts
+        ends = np.cumsum(lengths)
+        positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - lengths), lengths)
+        dense = self._dense_row[groups] >= 0
+        merged._build(np.repeat(codes, lengths), self._sparse[positions], codes[dense],
+                      self.registers[self._dense_row[groups[dense]]])
+        return merged
+
+    def group_arrays(self):
+        """Returns per group its packed sparse entries (list<uint32>) and dense registers (binary, null when sparse)."""
+        entries = pa.LargeListArray.from_arrays(pa.array(self._offsets, pa.int64()), pa.array(self._sparse, pa.uint32()))
+        registers = pa.array([self.registers[row].tobytes() if row >= 0 else None for row in self._dense_row.tolist()], pa.binary())
+        return entries, registers
+
+    @classmethod
+    def from_group_arrays(cls, index, by, column, precision, entries, registers):
+        """Returns sketches from the arrays of group_arrays, one element per value of index."""
+        sketches = cls.__new__(cls)
+        sketches.by = [by] if isinstance(by, str) else list(by)
+        sketches.column = column
+        sketches.precision = precision
+        sketches._index = index
+        sketches._groups = None
+        if isinstance(entries, pa.ChunkedArray):
+            entries = entries.combine_chunks()
+        if isinstance(registers, pa.ChunkedArray):
+            registers = registers.combine_chunks()
+        dense = registers.is_valid().to_numpy(zero_copy_only=False)
+        sketches._dense_row = np.full(len(index), -1, dtype=np.int64)
+        sketches._dense_row[dense] = np.arange(np.count_nonzero(dense))
+        offsets = entries.offsets.to_numpy().astype(np.int64)
+        sketches._sparse = entries.values.to_numpy().astype(np.uint32)[offsets[0]:offsets[-1]]
+        sketches._offsets = offsets - offsets[0]
+        m = 1 << precision
+        sketches.registers = np.frombuffer(b''.join(registers.filter(registers.is_valid()).to_pylist()),
+                                           dtype=np.uint8).reshape(-1, m).copy()
+        estimates = _linear_count(np.diff(sketches._offsets))
+        estimates[dense] = _estimate(sketches.registers)
+        sketches._counts = np.rint(estimates).astype(np.int64)
+        return sketches
+
+    def rollup(self, by):
+        """Returns the sketches per value of a subset of the key columns, merged from these."""
+        by = [by] if isinstance(by, str) else list(by)
+        codes, index = factorize_groups(self._index.to_frame(index=False), by)
+        return self.merge_groups(codes, index, by)
@@ -7,6 +7,26 @@ import plotly.express as px
 import numpy as np
 import matplotlib.pyplot as plt
 import glob
+import base64
+import os
+
+import data_loader
+import dataset_registry
+import ingest
+import parallel_csv
+from activity_index import ActivityIndex
+from aggregate_cache import AggregateCache
+from distinct_counts import grouped_nunique
+import svg_assets
+import hll
+import downsample
+import durations
+import profiling
+from journeys import JourneyIndex
+from transitions import TransitionMatrix
+import telemetry
+from telemetry import TelemetryTiles
+from event_rates import RatePyramid
 
 #######################
 # Page configuration
@@ -19,44 +39,278 @@ st.set_page_config(
 alt.themes.enable("dark")
 
 
+# Timings of the named stages of this run, shown in the sidebar
+if 'memory_tracking' not in st.session_state:
+    st.session_state.memory_tracking = profiling.MemoryTracking()
+memory_tracking = st.session_state.memory_tracking.set(st.session_state.get('profile_memory', False))
+profile = profiling.RerunProfile('inference_streamlit_app', memory_tracking)
+
 #######################
-# Load data
-df = pd.read_csv('data/nwu_inference_slim.csv')
+# Load data (from the ingested store when there is one), shared by every
+# session through the dataset registry. The store's log stays in memory and
+# a new version only reads the parts committed since.
+@st.cache_resource
+def store_log(root):
+    return ingest.StoreLog(ingest.EventStore(root))
+
+def read_events(path):
+    if path == ingest.STORE_DIR:
+        return store_log(path).load()
+    progress_bar = st.empty()
+    df = data_loader.load_csv_cached(path, progress=parallel_csv.parse_progress(progress_bar, path))
+    progress_bar.empty()
+    return df
+
+profile.lap('Load events')
+store = ingest.EventStore()
+if store.has_events():
+    data_path = store.root
+    data_version = store.version()
+else:
+    data_path = 'data/nwu_inference_slim.csv'
+    data_version = data_loader.file_version(data_path)
+dataset_version = (data_path, data_version)
+
+if 'dataset_leases' not in st.session_state:
+    st.session_state.dataset_leases = dataset_registry.SessionLeases()
+df = st.session_state.dataset_leases.get('inference_events', dataset_version, lambda: read_events(data_path))
 #df = df_reshaped
 
+# Structures derived from the shared frame; a new version evicts the old one.
+# The store only appends rows, so the structures of its last version are
+# extended with the new rows rather than built again.
+@st.cache_resource
+def store_structures(name):
+    return {}
+
+def extend_or_build(kind, _df, version, build):
+    path, _ = version
+    if path != ingest.STORE_DIR:
+        return build(_df)
+    built = store_structures('inference_events')
+    previous = built.get(kind)
+    structure = previous.extended(_df) if previous is not None else build(_df)
+    built[kind] = structure
+    return structure
+
+@st.cache_resource(max_entries=2)
+def load_index(_df, version):
+    return extend_or_build('index', _df, version, ActivityIndex)
+
+profile.lap('Sidebar index')
+index = load_index(df, dataset_version)
+
+@st.cache_resource(max_entries=2)
+def load_journeys(_df, version):
+    return extend_or_build('journeys', _df, version, JourneyIndex)
+
+# The tiles file when it was built from this version of the data, otherwise
+# the store's tiles topped up with its new rows
+@st.cache_resource
+def telemetry_counts(name):
+    return telemetry.TelemetryCounts()
+
+@st.cache_resource(max_entries=2)
+def load_telemetry(_df, version):
+    path, _ = version
+    if telemetry.is_current(telemetry.TILES_PATH, path):
+        return TelemetryTiles.load()
+    if path == ingest.STORE_DIR:
+        return telemetry_counts('inference_events').snapshot(_df)
+    return TelemetryTiles.from_events(_df)
+
+# Topped up with the rows past its watermark whenever the data changes;
+# sessions read a snapshot of the version they show
+@st.cache_resource
+def transition_counts(name):
+    return TransitionMatrix()
+
+@st.cache_resource(max_entries=2)
+def load_transitions(_df, name, version):
+    return transition_counts(name).snapshot(_df)
+
+# One event-rate pyramid over the sidebar columns, topped up and read like
+# the transitions; the timeline filters it to the selection
+@st.cache_resource
+def rate_counts(name):
+    return RatePyramid(['activity_id', 'action_data', 'wand_identifier'])
+
+@st.cache_resource(max_entries=2)
+def load_rates(_df, name, version):
+    return rate_counts(name).snapshot(_df)
+
+if 'aggregate_cache' not in st.session_state:
+    st.session_state.aggregate_cache = AggregateCache()
+aggregate_cache = st.session_state.aggregate_cache
+
 #######################
 # Sidebar
+profile.lap('Sidebar')
 with st.sidebar:
     st.title('Wand Activities')
     
-    df_action_sorted = df.sort_values(by="action_data", ascending=False)
-    df_sorted = df.sort_values(by="activity_id", ascending=True)
-    
-    activity_list = list(df_sorted.activity_id.unique()) #[::-1]
+    activity_list = index.activities()
     selected_activity = st.selectbox('Select Activity', activity_list)
-    df_selected_activity = df[df.activity_id == selected_activity]
-    df_selected_activity_sorted = df_selected_activity.sort_values(by="action_data", ascending=False)
+    df_selected_activity = df.take(index.activity_rows(selected_activity))
+    df_selected_activity_sorted = df_selected_activity
 
-    action_list = list(df_selected_activity_sorted.action_data.unique())
+    action_list = index.actions(selected_activity)
     selected_action = st.selectbox('Select Action Data', action_list)
-    #df_selected_action = df[df.action_data == selected_action]
-    df_selected_action = df_selected_activity[df_selected_activity.action_data == selected_action]
+    df_selected_action = df.take(index.action_rows(selected_activity, selected_action))
 
-    wand_list = list(df_selected_action.wand_identifier.unique())
+    wand_list = index.wands(selected_activity, selected_action)
     selected_wand = st.selectbox('Select Wand', wand_list)
-    #df_selected_wand = df_selected_action[df_selected_action.wand_identifier == selected_wand]
-    df_selected_wand = df[df.wand_identifier == selected_wand]
+    df_selected_wand = df.take(index.wand_rows(selected_wand))
 
     # svg_list = glob.glob('data/*.svg')
     # selected_svg = st.selectbox('Select SVG file', svg_list)
     
-    color_theme_list = ['blues', 'cividis', 'greens', 'inferno', 'magma', 'plasma', 'reds', 'rainbow', 'turbo', 'viridis']
+    color_theme_list = svg_assets.COLOR_THEMES
     selected_color_theme = st.selectbox('Select a color theme', color_theme_list)
 
+    approximate_counts = st.toggle('Approximate distinct counts')
+    if approximate_counts:
+        sketch_error = st.select_slider('Sketch standard error', options=[0.005, 0.01, 0.02, 0.05, 0.1], value=0.02,
+                                        format_func=lambda e: f'{e:.1%}')
+        sketch_precision = hll.precision_for_error(sketch_error)
+    else:
+        sketch_precision = None
+
 
 #######################
 # Plots
 
+# HyperLogLog sketches of wands and sessions per activity / action data
+sketch_columns = ['wand_identifier', 'session_id']
+
+@st.cache_resource(max_entries=16)
+def load_sketches(_df, version, input_by, input_column, precision):
+    return hll.GroupedSketches(_df, list(input_by), input_column, precision)
+
+def sketch_nunique(input_df, activity, precision):
+    counts = grouped_nunique(input_df.drop(columns=sketch_columns), 'action_data')
+    for column in sketch_columns:
+        sketches = load_sketches(df, dataset_version, ('activity_id', 'action_data'), column, precision)
+        counts[column] = [sketches.count(activity, action) for action in counts.index]
+    return counts[[c for c in input_df.columns if c != 'action_data']]
+
+# Distinct counts per group, cached per selection for this session
+def cached_nunique(input_df, input_by, activity=None, action=None, wand=None, precision=None):
+    key = (input_by, data_version, activity, action, wand, precision)
+    if precision is not None:
+        return aggregate_cache.get_or_compute(key, lambda: sketch_nunique(input_df, activity, precision))
+    return aggregate_cache.get_or_compute(key, lambda: grouped_nunique(input_df, input_by))
+
+# Cap the points sent to the browser, with a full-resolution toggle
+def chart_points(input_df, input_key, input_y=None):
+    total = len(input_df)
+    if total <= downsample.DEFAULT_MAX_POINTS:
+        return input_df
+    if st.toggle(f'Full resolution ({total} points)', key=input_key):
+        return input_df
+    sample = downsample.downsample(input_df, y=input_y)
+    if len(sample) < total:
+        st.caption(f'Showing {len(sample)} of {total} points')
+    return sample
+
+# Linked scatter + bar chart of a wand's action data, built once per frame
+@st.cache_resource(max_entries=32)
+def make_action_chart(input_df):
+    scale = alt.Scale(
+        domain=["activity_id", "action_data", "event_id", "session_id", "headphone_state"],
+        range=["#e7ba52", "#a7a7a7", "#aec7e8", "#1f77b4", "#9467bd"],
+    )
+    color = alt.Color("activity_id:N", scale=scale)
+    
+    # We create two selections:
+    # - a brush that is active on the top panel
+    # - a multi-click that is active on the bottom panel
+    brush = alt.selection_interval(encodings=["x"])
+    click = alt.selection_multi(encodings=["color"])
+    
+    # Top panel is scatter plot of temperature vs time
+    points = (
+        alt.Chart()
+        .mark_point()
+        .encode(
+            alt.X("action_data:T", title="action_)data"),
+            alt.Y(
+                "activity_id:Q",
+                title="Activity ID",
+                #scale=alt.Scale(domain=[-5, 40]),
+            ),
+            color=alt.condition(brush, color, alt.value("lightgray")),
+            size=alt.Size("activity_id:Q") #scale=alt.Scale(range=[5, 200])),
+        )
+        .properties(width=550, height=300)
+        .add_selection(brush)
+        .transform_filter(click)
+    )
+    
+    # Bottom panel is a bar chart of weather type
+    bars = (
+        alt.Chart()
+        .mark_bar()
+        .encode(
+            x="count()",
+            y="activity_id",
+            color=alt.condition(click, color, alt.value("lightgray")),
+        )
+        .transform_filter(brush)
+        .properties(
+            width=550,
+        )
+        .add_selection(click)
+    )
+    
+    return alt.vconcat(points, bars, data=input_df, title="Action Data")
+
+# SVG pages pre-rendered by svg_assets.py are linked from the static
+# directory; a page without a current pre-render is rendered in memory,
+# once per version of the page and of the label data
+@st.cache_data
+def load_svg_manifest(version):
+    return svg_assets.load_manifest()
+
+@st.cache_resource(max_entries=2)
+def load_label_index(path, version):
+    return svg_assets.load_label_index(path)
+
+@st.cache_data
+def make_svg_payload(input_svg, input_theme, version, svg_version):
+    index = load_label_index(svg_assets.LABEL_DATA, version)
+    return base64.b64encode(svg_assets.render_themed(input_svg, input_theme, index)).decode('utf-8')
+
+def render_svg(b64):
+    """Renders the given base64 svg payload."""
+    html = r'<img src="data:image/svg+xml;base64,%s"/>' % b64
+    st.write(html, unsafe_allow_html=True)
+
+def render_svg_url(url):
+    """Renders the svg served at the given url."""
+    st.write(r'<img src="%s"/>' % url, unsafe_allow_html=True)
+
+# Ordered activity path of a wand, one line per session
+def make_journey_chart(input_steps, input_activity):
+    return alt.Chart(input_steps).mark_line(point=True).encode(
+        x=alt.X('step:Q', title='Step'),
+        y=alt.Y(f'{input_activity}:N', title='Activity ID'),
+        color=alt.Color('session_id:N', title='Session'),
+        tooltip=['session_id', 'step', input_activity, 'events', 'event_id'],
+    ).properties(height=400)
+
+# Duration percentiles, histograms and dwell times: topped up with the
+# store's new durations parts, or built once per export version
+@st.cache_resource
+def duration_counts(root):
+    return durations.DurationStats()
+
+@st.cache_resource(max_entries=2)
+def load_durations(path, version):
+    if path == store.root:
+        return duration_counts(path).snapshot(store)
+    return durations.DurationStats(data_loader.load_csv_cached(path))
+
 # Heatmap
 def make_heatmap(input_df, input_y, input_x, input_color, input_color_theme):
     heatmap = alt.Chart(input_df).mark_rect().encode(
@@ -155,209 +409,280 @@ def calculate_population_difference(input_df, input_year):
 #######################
 # Dashboard Main Panel
 
-tab1, tab2, tab3, tab4, tab5 = st.tabs(["Overall", "Wand Activities", "Wand Action", "SVG", "Others"])
+# Only the open tab runs; switching tabs reruns the script
+tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs(["Overall", "Wand Activities", "Wand Action", "SVG", "Others", "Durations", "Transitions", "Fleet Health", "Timeline"], key='main_tab', on_change='rerun')
 with tab1:
-
-    col = st.columns((1.2, 6), gap='medium')
-    with col[0]:
-        st.markdown('#### Activity Count')
+    if tab1.open:
+        profile.lap('Overall')
+        col = st.columns((1.2, 6), gap='medium')
+        with col[0]:
+            st.markdown('#### Activity Count')
     
-        total_event_count = df.shape[0]
-        # total_wand_count = df['Wand Count'].sum()
-        # selected_activity_count = df_selected_activity_sorted['Event Count'].sum()
-        # #activity_name = df_selected_activity_sorted.activity_id[0]
-        
-        activity_shape = df_selected_activity.shape
-        action_shape = df_selected_action.shape
-        wand_shape = df_selected_wand.shape
+            total_event_count = df.shape[0]
+            # total_wand_count = df['Wand Count'].sum()
+            # selected_activity_count = df_selected_activity_sorted['Event Count'].sum()
+            # #activity_name = df_selected_activity_sorted.activity_id[0]
         
-        print(activity_shape, action_shape, wand_shape)
+            activity_count = df_selected_activity.shape[0]
+            action_count = df_selected_action.shape[0]
+            wand_count = df_selected_wand.shape[0]
         
-        st.metric(label=selected_activity, value=activity_shape[0], delta=None)
-        st.metric(label=selected_action, value=action_shape[0], delta=None)
-        st.metric(label=selected_wand, value=wand_shape[0], delta=None)
+            st.metric(label=selected_activity, value=activity_count, delta=None)
+            st.metric(label=selected_action, value=action_count, delta=None)
+            st.metric(label=selected_wand, value=wand_count, delta=None)
+
+            st.markdown('#### Wand Count')
+            if approximate_counts:
+                activity_wands = load_sketches(df, dataset_version, ('activity_id',), 'wand_identifier', sketch_precision).count(selected_activity)
+                action_wands = load_sketches(df, dataset_version, ('activity_id', 'action_data'), 'wand_identifier', sketch_precision).count(selected_activity, selected_action)
+                st.caption(f'Approximate, ±{hll.standard_error(sketch_precision):.1%}')
+            else:
+                activity_wands = df_selected_activity['wand_identifier'].nunique()
+                action_wands = df_selected_action['wand_identifier'].nunique()
+            st.metric(label=selected_activity, value=activity_wands, delta=None)
+            st.metric(label=selected_action, value=action_wands, delta=None)
                                                                       
-        # st.markdown('#### Activity Percentage')
+            # st.markdown('#### Activity Percentage')
     
             
-        # df_activity = round(activity_shape[0]/total_event_count, 4)
-        # action_activity = round(action_shape[0]/total_event_count, 4)
-        # wand_activity = round(wand_shape[0]/total_event_count, 4)
-        # #states_migration_greater = round((len(df_greater_50000)/df_population_difference_sorted.states.nunique())*100)
-        # donut_chart_greater = make_donut(df_activity, 'Activity Percentage', 'green')
-        # donut_chart_less = make_donut(action_activity, 'Action Data Percentage', 'red')
+            # df_activity = round(activity_shape[0]/total_event_count, 4)
+            # action_activity = round(action_shape[0]/total_event_count, 4)
+            # wand_activity = round(wand_shape[0]/total_event_count, 4)
+            # #states_migration_greater = round((len(df_greater_50000)/df_population_difference_sorted.states.nunique())*100)
+            # donut_chart_greater = make_donut(df_activity, 'Activity Percentage', 'green')
+            # donut_chart_less = make_donut(action_activity, 'Action Data Percentage', 'red')
     
-        # migrations_col = st.columns((0.2, 1, 0.2))
-        # with migrations_col[1]:
-        #     st.write('Events')
-        #     st.altair_chart(donut_chart_greater)
-        #     st.write('Wands')
-        #     st.altair_chart(donut_chart_less)
-        #     st.write('Wands')
-        #     st.altair_chart(donut_chart_less)
+            # migrations_col = st.columns((0.2, 1, 0.2))
+            # with migrations_col[1]:
+            #     st.write('Events')
+            #     st.altair_chart(donut_chart_greater)
+            #     st.write('Wands')
+            #     st.altair_chart(donut_chart_less)
+            #     st.write('Wands')
+            #     st.altair_chart(donut_chart_less)
     
     
-    with col[1]:
-        st.markdown('#### Unique Activities, Actions, etc')
+        with col[1]:
+            st.markdown('#### Unique Activities, Actions, etc')
         
-        df1s = df_selected_activity_sorted.groupby(by='action_data').nunique()
-        activity_id = df1s['activity_id']
-        wand = df1s['wand_identifier']
-        action = df1s['action']
-        action_data = df1s.index #df1s['action_data']
-        session = df1s['session_id']
-        # fig, ax = plt.subplots()
-        # ax.figure(figsize=(15,10))
-        # ax.get_autoscale_on()
-        # ax.plot(activity_id, action, label='action')
-        # # #plt.plot(activity_id, action_data, label='action_data')
-        # ax.plt.bar(activity_id, action_data)
-        # ax.tick_params(axis='x', labelcolor='tab:blue', labelrotation=90, labelsize=6)
-        # # fig, ax = plt.subplots()
-        # st.pyplot(fig)
+            profile.lap('Overall: distinct counts')
+            df1s = cached_nunique(df_selected_activity_sorted, 'action_data', activity=selected_activity, precision=sketch_precision)
+            activity_id = df1s['activity_id']
+            wand = df1s['wand_identifier']
+            action = df1s['action']
+            action_data = df1s.index #df1s['action_data']
+            session = df1s['session_id']
+            # fig, ax = plt.subplots()
+            # ax.figure(figsize=(15,10))
+            # ax.get_autoscale_on()
+            # ax.plot(activity_id, action, label='action')
+            # # #plt.plot(activity_id, action_data, label='action_data')
+            # ax.plt.bar(activity_id, action_data)
+            # ax.tick_params(axis='x', labelcolor='tab:blue', labelrotation=90, labelsize=6)
+            # # fig, ax = plt.subplots()
+            # st.pyplot(fig)
         
-        #heatmap = make_heatmap(df, 'activity_id', 'Wand Count', 'Event Count', selected_color_theme)
-        #st.altair_chart(heatmap, use_container_width=True)
+            #heatmap = make_heatmap(df, 'activity_id', 'Wand Count', 'Event Count', selected_color_theme)
+            #st.altair_chart(heatmap, use_container_width=True)
     
-        chart_data = df1s #action_data, wand
+            profile.lap('Overall: chart')
+            chart_data = chart_points(df1s, 'tab1_full_resolution') #action_data, wand
         
-        #st.bar_chart(chart_data)
-        #st.scatter_chart(chart_data)
-        st.scatter_chart(data=chart_data, height=700, use_container_width=True)
+            #st.bar_chart(chart_data)
+            #st.scatter_chart(chart_data)
+            st.scatter_chart(data=chart_data, height=700, use_container_width=True)
 
 with tab2:
-    st.markdown('#### Individual Wand Journey Activities')
-    chart_data = df_selected_wand.groupby(by='activity_id').nunique()
-    st.scatter_chart(data=chart_data, y=['action_data', 'session_id', 'event_id'], height=700, use_container_width=True)
+    if tab2.open:
+        profile.lap('Wand Activities')
+        st.markdown('#### Individual Wand Journey Activities')
+        chart_data = chart_points(cached_nunique(df_selected_wand, 'activity_id', wand=selected_wand), 'tab2_full_resolution', 'event_id')
+        st.scatter_chart(data=chart_data, y=['action_data', 'session_id', 'event_id'], height=700, use_container_width=True)
+
+        profile.lap('Wand Activities: journey')
+        st.markdown('#### Journey Path')
+        journey_index = load_journeys(df, dataset_version)
+        journey_steps = journey_index.steps(selected_wand)
+        st.caption(f"{len(journey_steps)} steps over {journey_steps['session_id'].nunique()} sessions")
+        st.altair_chart(make_journey_chart(journey_steps, 'activity_id'), use_container_width=True)
+        st.dataframe(journey_index.transitions(selected_wand).sort_values('count', ascending=False), hide_index=True)
 
 with tab3:
-    st.markdown('#### Individual Wand Journey Action Data')
-    wdf = df_selected_wand.groupby(by='action_data').nunique()
-    #wdf['action_data'] = wdf.index
-    chart_data = wdf
-    st.bar_chart(data=chart_data, y='activity_id', width=5000, use_container_width=False)
-    st.write(wdf.index)
+    if tab3.open:
+        profile.lap('Wand Action')
+        st.markdown('#### Individual Wand Journey Action Data')
+        wdf = cached_nunique(df_selected_wand, 'action_data', wand=selected_wand)
+        #wdf['action_data'] = wdf.index
+        chart_data = wdf
+        st.bar_chart(data=chart_data, y='activity_id', width=5000, use_container_width=False)
+        st.write(wdf.index)
     
 with tab4:
-    import streamlit as st
-    import base64
-    import textwrap
-    import glob
-    
-    #st.write(selected_svg)
-    
-    st.markdown('#### SVG - Activity Frequency Data')
-    svg_list = glob.glob('data/SVGs_ObjectDetection/*.svg')
-    svgs = svg_list.sort()
-    selected_svg = st.selectbox('Select SVG file', svg_list)
-
-    import xml.etree.ElementTree as ET
-    from xml.etree import ElementTree, ElementInclude
-    treex = ET.parse(selected_svg)
-    rootx = treex.getroot()
-    
-    count = 0
-    for child in rootx:
-      print(count, ': ', child.attrib)
-      for grandchild in child:
-        #print(grandchild.attrib)
-        grandchild.attrib['class'] = 'color'
-        if(count % 2 == 0):
-          grandchild.attrib['style'] = "fill:blue"
+    if tab4.open:
+        profile.lap('SVG')
+        st.markdown('#### SVG - Activity Frequency Data')
+        svg_list = sorted(glob.glob('data/SVGs_ObjectDetection/*.svg'))
+        selected_svg = st.selectbox('Select SVG file', svg_list)
+
+        manifest_path = svg_assets.MANIFEST_PATH
+        manifest = load_svg_manifest(data_loader.file_version(manifest_path) if os.path.exists(manifest_path) else None)
+        label_version = data_loader.file_version(svg_assets.LABEL_DATA)
+        svg_url = svg_assets.asset_url(manifest, selected_svg, selected_color_theme, label_version)
+        profile.lap('SVG: render')
+        if svg_url is not None:
+            render_svg_url(svg_url)
         else:
-          grandchild.attrib['style'] = "fill:green"
-        print(grandchild.attrib)
-        count += 1
-
-    #svg_sl = treex.tostringlist()
-    #svg_str = ET.tostringlist(treex)
-    out = 'alz0405_blue_green.xml'
-    treex.write(out)
-    
-    def render_svg(svg):
-        """Renders the given svg string."""
-        b64 = base64.b64encode(svg.encode('utf-8')).decode("utf-8")
-        html = r'<img src="data:image/svg+xml;base64,%s"/>' % b64
-        st.write(html, unsafe_allow_html=True)
-    
-    def render_svg_example():
-        svg_file = selected_svg #'data/opg1_red_rgb_alz_p2425.svg'
-        import xml.dom.minidom
-        
-        #x = ElementInclude.include(rootx)
-        dom = xml.dom.minidom.parse(out) # or 
-        #dom = xml.dom.minidom.parseString(output)
-        svg = pretty_xml_as_string = dom.toprettyxml()
-        
-        # st.write('### SVG Input')
-        # st.code(textwrap.dedent(svg), 'svg')
-        
-        #st.write('### SVG Output')
-        render_svg(svg)
-    
-    if __name__ == '__main__':
-        render_svg_example()
+            render_svg(make_svg_payload(selected_svg, selected_color_theme, label_version,
+                                        data_loader.file_version(selected_svg)))
 
 with tab5:
-    #######################
-    source = wdf
-    
-    scale = alt.Scale(
-        domain=["activity_id", "action_data", "event_id", "session_id", "headphone_state"],
-        range=["#e7ba52", "#a7a7a7", "#aec7e8", "#1f77b4", "#9467bd"],
-    )
-    color = alt.Color("activity_id:N", scale=scale)
-    
-    # We create two selections:
-    # - a brush that is active on the top panel
-    # - a multi-click that is active on the bottom panel
-    brush = alt.selection_interval(encodings=["x"])
-    click = alt.selection_multi(encodings=["color"])
-    
-    # Top panel is scatter plot of temperature vs time
-    points = (
-        alt.Chart()
-        .mark_point()
-        .encode(
-            alt.X("action_data:T", title="action_)data"),
-            alt.Y(
-                "activity_id:Q",
-                title="Activity ID",
-                #scale=alt.Scale(domain=[-5, 40]),
-            ),
-            color=alt.condition(brush, color, alt.value("lightgray")),
-            size=alt.Size("activity_id:Q") #scale=alt.Scale(range=[5, 200])),
-        )
-        .properties(width=550, height=300)
-        .add_selection(brush)
-        .transform_filter(click)
-    )
-    
-    # Bottom panel is a bar chart of weather type
-    bars = (
-        alt.Chart()
-        .mark_bar()
-        .encode(
-            x="count()",
-            y="activity_id",
-            color=alt.condition(click, color, alt.value("lightgray")),
-        )
-        .transform_filter(brush)
-        .properties(
-            width=550,
-        )
-        .add_selection(click)
-    )
-    
-    chart = alt.vconcat(points, bars, data=source, title="Action Data")
+    if tab5.open:
+        profile.lap('Others')
+        #######################
+        wdf = cached_nunique(df_selected_wand, 'action_data', wand=selected_wand)
+        source = chart_points(wdf, 'tab5_full_resolution', 'activity_id')
     
-    tab1, tab2 = st.tabs(["Streamlit theme (default)", "Altair native theme"])
+        chart = make_action_chart(source)
     
-    with tab1:
-        st.altair_chart(chart, theme="streamlit", use_container_width=True)
-    with tab2:
-        st.altair_chart(chart, theme=None, use_container_width=True)
-    #from vega_datasets import data
+        theme_tab1, theme_tab2 = st.tabs(["Streamlit theme (default)", "Altair native theme"], key='chart_theme_tab', on_change='rerun')
     
-   
-   
+        with theme_tab1:
+            if theme_tab1.open:
+                st.altair_chart(chart, theme="streamlit", use_container_width=True)
+        with theme_tab2:
+            if theme_tab2.open:
+                st.altair_chart(chart, theme=None, use_container_width=True)
+        #from vega_datasets import data
+
+with tab6:
+    if tab6.open:
+        profile.lap('Durations')
+        durations_path = store.root if store.exists() and store.durations_parts() else durations.latest_export()
+        if durations_path is None:
+            st.info('No activity_durations export found in data/')
+        else:
+            if durations_path == store.root:
+                durations_version, durations_source = store.durations_version(), 'the ingest store'
+            else:
+                durations_version, durations_source = data_loader.file_version(durations_path), os.path.basename(durations_path)
+            duration_stats = load_durations(durations_path, durations_version)
+            st.markdown('#### Activity Session Durations')
+            st.caption(f'{duration_stats.rows} activity sessions in {durations_source}')
+            col = st.columns((3, 2), gap='medium')
+            with col[0]:
+                st.dataframe(duration_stats.activities.round(1))
+            with col[1]:
+                duration_activity = st.selectbox('Activity', list(duration_stats.activities.index), key='duration_activity')
+                st.bar_chart(duration_stats.histogram(duration_activity), x_label='seconds', y_label='Sessions')
+
+            st.markdown('#### Dwell Time per Wand')
+            wand_dwell = duration_stats.wands.sort_values('Total seconds', ascending=False)
+            chart_data = chart_points(wand_dwell, 'tab6_full_resolution', 'Total seconds')
+            st.scatter_chart(data=chart_data, x='Sessions', y=['p50', 'p90'], height=500, use_container_width=True)
+
+with tab7:
+    if tab7.open:
+        profile.lap('Transitions')
+        transition_matrix = load_transitions(df, 'inference_events', dataset_version)
+        st.markdown('#### Activity Transitions')
+        heatmap = make_heatmap(transition_matrix.to_frame(), 'from', 'to', 'count', selected_color_theme)
+        st.altair_chart(heatmap, use_container_width=True)
+
+        col = st.columns((1, 1), gap='medium')
+        with col[0]:
+            st.markdown('#### Funnel')
+            funnel_stages = st.multiselect('Funnel stages', transition_matrix.activities,
+                                           default=transition_matrix.common_path(), key='funnel_stages')
+            if funnel_stages:
+                funnel = transition_matrix.funnel(funnel_stages)
+                st.bar_chart(funnel, x='stage', y='Sessions', sort=False)
+                st.dataframe(funnel, hide_index=True)
+        with col[1]:
+            st.markdown('#### Drop-off')
+            st.dataframe(transition_matrix.drop_offs())
+
+with tab8:
+    if tab8.open:
+        profile.lap('Fleet Health')
+        telemetry_tiles = load_telemetry(df, dataset_version)
+        first_window, last_window = telemetry_tiles.span()
+        if first_window is None:
+            st.info('No device telemetry in the event log')
+        else:
+            first_day, last_day = first_window.date(), last_window.date()
+            health_range = st.slider('Days', min_value=first_day, max_value=max(last_day, first_day + pd.Timedelta(days=1)),
+                                     value=(first_day, last_day), key='health_range')
+            health_start, health_end = pd.Timestamp(health_range[0]), pd.Timestamp(health_range[1]) + pd.Timedelta(days=1)
+            fleet = telemetry_tiles.fleet(health_start, health_end)
+
+            st.markdown('#### Fleet Health')
+            col = st.columns(4)
+            col[0].metric(label='Download success', value=f"{fleet['dl_success_rate']:.1%}",
+                          help=f"{fleet['dl_complete']:.0f} completed, {fleet['dl_error']:.0f} errors")
+            col[1].metric(label='OTA failure rate', value=f"{fleet['ota_failure_rate']:.1%}",
+                          help=f"{fleet['ota_error']:.0f} errors in {fleet['ota_start']:.0f} updates")
+            col[2].metric(label='Wi-Fi flaps per wand', value=f"{fleet['wifi_flaps'] / max(fleet['wands'], 1):.1f}")
+            col[3].metric(label='Mean sleep', value=f"{fleet['mean_sleep_seconds'] / 60:.1f} min",
+                          help=f"{fleet['sleeps']:.0f} sleeps, {fleet['crash_boots']:.0f} of {fleet['boots']:.0f} boots after a crash")
+
+            daily = telemetry_tiles.over_time(health_start, health_end)
+            st.line_chart(daily[['dl_success_rate', 'ota_failure_rate']], y_label='rate')
+            st.bar_chart(daily[['dl_error', 'ota_error', 'kc_error', 'wifi_flaps']], y_label='events')
+
+            st.markdown('#### Wands')
+            wand_health = telemetry_tiles.by_wand(health_start, health_end).sort_values(['dl_error', 'wifi_flaps'], ascending=False)
+            st.dataframe(wand_health[['dl_success_rate', 'dl_error', 'ota_failure_rate', 'kc_error', 'wifi_flaps',
+                                      'crash_boots', 'mean_sleep_seconds']].round(3))
+
+with tab9:
+    if tab9.open:
+        profile.lap('Timeline')
+        rate_scopes = {
+            'Fleet': {},
+            'Activity': {'activity_id': selected_activity},
+            'Action Data': {'activity_id': selected_activity, 'action_data': selected_action},
+            'Wand': {'wand_identifier': selected_wand},
+        }
+        rate_scope = st.segmented_control('Events of', list(rate_scopes), default='Activity', key='rate_scope') or 'Fleet'
+        rate_filters = rate_scopes[rate_scope]
+        rates = load_rates(df, 'inference_events', dataset_version)
+        first_minute, last_minute = rates.span(**rate_filters)
+        if first_minute is None:
+            st.info('No timestamped events in this selection')
+        else:
+            rate_range = st.slider('Time range', min_value=first_minute.to_pydatetime(),
+                                   max_value=max(last_minute, first_minute + pd.Timedelta(minutes=1)).to_pydatetime(),
+                                   value=(first_minute.to_pydatetime(), last_minute.to_pydatetime()),
+                                   step=pd.Timedelta(minutes=1).to_pytimedelta(), format='YYYY-MM-DD HH:mm', key='rate_range')
+            rate_level, rate_series = rates.series(*rate_range, **rate_filters)
+            st.markdown(f'#### Events per {rate_level}')
+            st.caption(f'{len(rate_series)} buckets, {int(rate_series.to_numpy().sum())} events')
+            st.line_chart(rate_series, y_label='events')
+
+
+#######################
+# Debug panel
+profile.lap('Debug panel')
+with st.sidebar:
+    with st.expander('Debug'):
+        budget_mb = st.number_input('Aggregate cache budget (MB)', min_value=1, value=64, step=16)
+        aggregate_cache.resize(budget_mb * 1024 * 1024)
+        stats = aggregate_cache.stats()
+        st.metric(label='Cache hits', value=stats['hits'])
+        st.metric(label='Cache misses', value=stats['misses'])
+        st.write(f"{stats['entries']} entries, {stats['bytes'] / 1024:.1f} KB of {budget_mb} MB, "
+                 f"{stats['evictions']} evictions, hit rate {stats['hit_rate']:.0%}")
+
+        st.markdown('Shared datasets')
+        for entry in dataset_registry.REGISTRY.stats():
+            st.caption(f"{entry['name']}{' (current)' if entry['current'] else ''}: "
+                       f"{entry['refs']} sessions, {entry['bytes'] / 2**20:.1f} MB")
+
+    profile.finish()
+    with st.expander(f'Profile ({profile.total_ms():.0f} ms)'):
+        st.dataframe(profile.frame())
+        if profile.track_memory:
+            st.caption("Allocations are process-wide and include other sessions' reruns")
+        st.toggle('Track allocations', key='profile_memory', help='tracemalloc slows every stage while it runs')
+        if st.toggle('Write to log', key='profile_log', help=profiling.LOG_PATH):
+            profile.write_log()
@@ -0,0 +1,321 @@
+#######################
+# Incremental ingestion of wand event exports
+#
+# New CSV exports are dropped into data/incoming/. Each export is a full
+# snapshot, so only rows past the store's event_id watermark are appended,
+# as Parquet parts under data/store/<partition>/. Each batch also writes the
+# summary cube of its own rows (Event Count and a wand sketch per
+# activity_id/action/action_data, see summary_cube.py) under a name tagged
+# with the new sequence. The per-action summary is the rollup of those
+# cubes, merged into one every SUMMARY_DELTAS batches, so a batch never
+# rereads the history. The manifest switches to the new parts and summary
+# in one atomic write. An export with no new rows (or only a header)
+# commits no parts.
+#
+# activity_durations_*.csv exports dropped in the same directory are
+# snapshots too: the activity sessions after each wand's last stored
+# (session_id, activity_session_id) are appended under data/store/durations/.
+# Both kinds of export are skipped while their name, mtime and size match
+# the last ingested copy.
+#
+# A StoreLog keeps the loaded event log of a store in memory; a newer
+# version only reads the parts committed since and appends them, so the
+# frames of successive versions start with the same rows.
+#
+# Usage:
+#   python ingest.py                      # ingest once
+#   python ingest.py --watch --interval 30
+
+import argparse
+import json
+import os
+import threading
+import time
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+import compact
+import data_loader
+import summary_cube
+
+STORE_DIR = os.path.join('data', 'store')
+DROP_DIR = os.path.join('data', 'incoming')
+KEY_COLUMN = 'event_id'
+TIMESTAMP_COLUMN = 'created_at'
+SUMMARY_KEYS = ['activity_id', 'action', 'action_data']
+SUMMARY_DELTAS = 16
+DURATIONS_PREFIX = 'activity_durations'
+DURATION_KEYS = ['wand_identifier', 'session_id', 'activity_session_id']
+
+
+def partition_values(df, partition_by):
+    """Returns the partition name of every row: its day or its activity_id."""
+    if partition_by == 'day':
+        return pd.to_datetime(df[TIMESTAMP_COLUMN]).dt.strftime('%Y-%m-%d').fillna('unknown')
+    return df[partition_by].astype(str).where(df[partition_by].notna(), 'unknown')
+
+
+def _write_parquet(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _unchanged(seen, stat):
+    return seen is not None and seen['mtime_ns'] == stat.st_mtime_ns and seen['size'] == stat.st_size
+
+
+def _after_watermarks(df, watermarks):
+    """Tells for every row whether it comes after its wand's (session_id, activity_session_id) watermark."""
+    watermarks = watermarks.rename(columns={'session_id': 'mark_session', 'activity_session_id': 'mark_activity'})
+    marks = df[['wand_identifier']].merge(watermarks, on='wand_identifier', how='left')
+    session, mark_session = df['session_id'].to_numpy(), marks['mark_session'].to_numpy(dtype=np.float64)
+    activity, mark_activity = df['activity_session_id'].to_numpy(), marks['mark_activity'].to_numpy(dtype=np.float64)
+    return np.isnan(mark_session) | (session > mark_session) | ((session == mark_session) & (activity > mark_activity))
+
+
+def _plain(df):
+    """Returns df with categorical columns as plain values, ready to concat."""
+    return df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+
+
+def _append(df, rows):
+    """Returns df followed by rows, with the categories of both kept sorted rather than falling back to objects."""
+    df, rows = df.copy(deep=False), rows.copy(deep=False)
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype) and isinstance(rows[column].dtype, pd.CategoricalDtype):
+            categories = df[column].cat.categories.union(rows[column].cat.categories)
+            if not categories.equals(df[column].cat.categories):
+                df[column] = df[column].cat.set_categories(categories)
+            rows[column] = rows[column].cat.set_categories(categories)
+    return pd.concat([df, rows], ignore_index=True)
+
+
+class EventStore:
+    """Partitioned Parquet store of the event log with a running summary.
+
+    The manifest lists every part file; readers only open listed parts, so
+    an ingestion running in another process never exposes a partial write.
+    """
+
+    def __init__(self, root=STORE_DIR, partition_by='day'):
+        self.root = root
+        self.partition_by = partition_by
+        self._manifest_path = os.path.join(root, 'manifest.json')
+
+    @classmethod
+    def open(cls, root=STORE_DIR):
+        """Returns the store at root with the partitioning its manifest records."""
+        with open(os.path.join(root, 'manifest.json')) as f:
+            return cls(root, partition_by=json.load(f)['partition_by'])
+
+    def exists(self):
+        return os.path.exists(self._manifest_path)
+
+    def has_events(self):
+        """Tells whether any rows were committed; exports with only a header commit none."""
+        return self.exists() and bool(self._read_manifest()['parts'])
+
+    def version(self):
+        """Returns a key that changes whenever new rows are committed."""
+        return self._read_manifest()['sequence']
+
+    def durations_version(self):
+        """Returns a key that changes whenever new activity sessions are committed."""
+        return self._read_manifest()['durations']['sequence']
+
+    def durations_parts(self):
+        return list(self._read_manifest()['durations']['parts'])
+
+    def _read_manifest(self):
+        if not self.exists():
+            return {'partition_by': self.partition_by, 'sequence': 0, 'watermark': None, 'files': {}, 'parts': [], 'summary': [],
+                    'durations': {'sequence': 0, 'files': {}, 'parts': [], 'watermarks': None}}
+        with open(self._manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['partition_by'] != self.partition_by:
+            raise ValueError(f"store at {self.root} is partitioned by {manifest['partition_by']!r}, not {self.partition_by!r}")
+        return manifest
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, self._manifest_path)
+
+    def ingest_file(self, path):
+        """Appends the rows of an export that are new to the store; returns their count."""
+        manifest = self._read_manifest()
+        stat = os.stat(path)
+        name = os.path.basename(path)
+        if _unchanged(manifest['files'].get(name), stat):
+            return 0
+
+        df = pd.read_csv(path)
+        if manifest['watermark'] is not None:
+            df = df[df[KEY_COLUMN] > manifest['watermark']]
+        if len(df):
+            sequence = manifest['sequence'] + 1
+            for value, part in df.groupby(partition_values(df, self.partition_by), sort=True):
+                relative = os.path.join(f'{self.partition_by}={quote(value, safe="")}', f'part-{sequence:06d}.parquet')
+                _write_parquet(part, os.path.join(self.root, relative))
+                manifest['parts'].append(relative)
+            previous_summary = manifest['summary']
+            manifest['summary'] = self._update_summary(df, previous_summary, sequence)
+            manifest['sequence'] = sequence
+            manifest['watermark'] = int(df[KEY_COLUMN].max())
+        manifest['files'][name] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'rows': len(df)}
+        self._write_manifest(manifest)
+        if len(df):
+            self._remove_stale_summaries(previous_summary, manifest['summary'])
+        return len(df)
+
+    def ingest_durations(self, path):
+        """Appends the activity sessions of a durations export that are new to the store; returns their count."""
+        manifest = self._read_manifest()
+        durations = manifest['durations']
+        stat = os.stat(path)
+        name = os.path.basename(path)
+        if _unchanged(durations['files'].get(name), stat):
+            return 0
+
+        df = pd.read_csv(path)
+        previous = durations['watermarks']
+        if previous is not None:
+            watermarks = pd.read_parquet(os.path.join(self.root, previous))
+            df = df[_after_watermarks(df, watermarks)]
+        if len(df):
+            sequence = durations['sequence'] + 1
+            part = os.path.join('durations', f'part-{sequence:06d}.parquet')
+            _write_parquet(df, os.path.join(self.root, part))
+            durations['parts'].append(part)
+            latest = df[DURATION_KEYS] if previous is None else pd.concat([watermarks, df[DURATION_KEYS]])
+            latest = latest.sort_values(DURATION_KEYS).drop_duplicates('wand_identifier', keep='last')
+            durations['watermarks'] = os.path.join('durations', f'watermarks-{sequence:06d}.parquet')
+            _write_parquet(latest, os.path.join(self.root, durations['watermarks']))
+            durations['sequence'] = sequence
+        durations['files'][name] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'rows': len(df)}
+        self._write_manifest(manifest)
+        # Only ingestion reads the watermarks
+        if len(df) and previous is not None:
+            os.remove(os.path.join(self.root, previous))
+        return len(df)
+
+    def ingest_dir(self, drop_dir=DROP_DIR):
+        """Ingests every CSV in the drop directory in name order; returns the new row count."""
+        if not os.path.isdir(drop_dir):
+            return 0
+        rows = 0
+        for name in sorted(name for name in os.listdir(drop_dir) if name.endswith('.csv')):
+            ingest = self.ingest_durations if name.startswith(DURATIONS_PREFIX) else self.ingest_file
+            rows += ingest(os.path.join(drop_dir, name))
+        return rows
+
+    def watch(self, drop_dir=DROP_DIR, interval=30):
+        """Polls the drop directory forever."""
+        while True:
+            rows = self.ingest_dir(drop_dir)
+            if rows:
+                print(f'{rows} new rows, store version {self.version()}')
+            time.sleep(interval)
+
+    def _update_summary(self, new, previous, sequence):
+        """Writes the summary cube of the new rows; returns the summary files including it."""
+        keys = [k for k in SUMMARY_KEYS if k in new.columns]
+        delta = os.path.join('summary', f'delta-{sequence:06d}.parquet')
+        summary_cube.SummaryCube.from_events(new, keys).save(os.path.join(self.root, delta))
+        summary = previous + [delta]
+        if len(summary) >= SUMMARY_DELTAS:
+            merged = os.path.join('summary', f'merged-{sequence:06d}.parquet')
+            cube = summary_cube.SummaryCube.load([os.path.join(self.root, p) for p in summary])
+            cube.compacted().save(os.path.join(self.root, merged))
+            summary = [merged]
+        return summary
+
+    def _remove_stale_summaries(self, previous, current):
+        """Removes summary files older than the previous committed ones, which readers may still hold."""
+        keep = set(previous) | set(current)
+        summary_dir = os.path.join(self.root, 'summary')
+        for name in os.listdir(summary_dir):
+            if os.path.join('summary', name) not in keep and not name.endswith('.tmp'):
+                os.remove(os.path.join(summary_dir, name))
+
+    def parts(self):
+        return list(self._read_manifest()['parts'])
+
+    def load(self, parts=None):
+        """Returns the rows of the given parts (default: the full event log from the committed parts)."""
+        parts = self.parts() if parts is None else parts
+        parts = [pd.read_parquet(os.path.join(self.root, p)) for p in parts]
+        if parts:
+            df = pd.concat([_plain(p) for p in parts], ignore_index=True)
+        else:
+            df = pd.DataFrame(columns=list(compact.SCHEMAS['nwu_inference']))
+        return data_loader.as_categories(compact.compact(df, compact.SCHEMAS['nwu_inference']))
+
+    def load_durations(self, parts=None):
+        """Returns the activity sessions of the given durations parts (default: every committed one)."""
+        parts = self.durations_parts() if parts is None else parts
+        frames = [_plain(pd.read_parquet(os.path.join(self.root, p))) for p in parts]
+        if frames:
+            df = pd.concat(frames, ignore_index=True)
+        else:
+            df = pd.DataFrame(columns=list(compact.SCHEMAS['activity_durations']))
+        return data_loader.as_categories(compact.compact(df, compact.SCHEMAS['activity_durations']))
+
+    def summary(self):
+        """Returns the per-action summary in the action_inference.csv layout; Wand Count is a sketch estimate."""
+        paths = [os.path.join(self.root, p) for p in self._read_manifest()['summary']]
+        if paths:
+            cube = summary_cube.SummaryCube.load(paths)
+            df = _plain(cube.rollup(cube.dimensions, dropna=False))
+        else:
+            df = pd.DataFrame(columns=SUMMARY_KEYS + ['Wand Count', 'Event Count', 'Events/Wand'])
+        df = compact.compact(df, compact.SCHEMAS['action_inference'])
+        return data_loader.as_categories(df)
+
+
+class StoreLog:
+    """The event log of a store held in memory and topped up with newly committed parts."""
+
+    def __init__(self, store):
+        self.store = store
+        self.parts = []
+        self.frame = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Returns the full event log, reading only the parts committed since the last call."""
+        with self._lock:
+            parts = self.store.parts()
+            if self.frame is None or parts[:len(self.parts)] != self.parts:
+                self.frame = self.store.load(parts)
+            elif len(parts) > len(self.parts):
+                self.frame = _append(self.frame, self.store.load(parts[len(self.parts):]))
+            self.parts = parts
+            return self.frame
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Append new rows from dropped event exports to the partitioned store.')
+    parser.add_argument('--drop-dir', default=DROP_DIR, help='directory watched for new CSV exports')
+    parser.add_argument('--store', default=STORE_DIR, help='store directory')
+    parser.add_argument('--partition-by', default='day', help="'day' or an event column such as activity_id")
+    parser.add_argument('--watch', action='store_true', help='keep polling the drop directory')
+    parser.add_argument('--interval', type=float, default=30, help='seconds between polls with --watch')
+    args = parser.parse_args(argv)
+
+    store = EventStore(args.store, partition_by=args.partition_by)
+    if args.watch:
+        store.watch(args.drop_dir, args.interval)
+    else:
+        rows = store.ingest_dir(args.drop_dir)
+        print(f'{rows} new rows, store version {store.version()}')
+
+
+if __name__ == '__main__':
+    main()
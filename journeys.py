@@ -0,0 +1,174 @@
+#######################
+# Wand journeys
+#
+# The event log is sorted once by (wand_identifier, session_id, event_id).
+# Every wand's events are then a contiguous slice of that permutation,
+# found through per-wand and per-session offset arrays, so a journey costs
+# O(journey length) however large the fleet is. Runs of events in the same
+# activity are collapsed into steps, and consecutive steps within a session
+# give the activity-to-activity transitions. When a newer version of the
+# log only appends rows (as the ingest store does), extended() merges them
+# into the sorted permutation instead of sorting the whole log again.
+
+import numpy as np
+import pandas as pd
+
+from distinct_counts import factorize_groups
+
+
+def _offsets(codes, n):
+    """Returns CSR offsets (length n + 1) of sorted non-negative codes."""
+    return np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=n))))
+
+
+class JourneyIndex:
+    """Ordered events, activity steps and transitions of every wand.
+
+    Rows with a missing wand or session are left out.
+    """
+
+    def __init__(self, df, wand='wand_identifier', session='session_id', order_by='event_id', activity='activity_id'):
+        self.df = df
+        self.wand = wand
+        self.session = session
+        self.activity = activity
+        self.order_by = order_by
+        group_codes, groups = factorize_groups(df, [wand, session])
+        keep = np.flatnonzero(group_codes >= 0)
+
+        # Sort by one int64 key: (wand, session) group, then rank of order_by.
+        n = len(keep)
+        rank = np.empty(n, dtype=np.int64)
+        rank[np.argsort(df[order_by].to_numpy()[keep], kind='stable')] = np.arange(n)
+        key = group_codes[keep] * max(n, 1) + rank
+        self._index(keep[np.argsort(key)], group_codes, groups)
+
+    def extended(self, df):
+        """Returns the journeys of df, reusing this index when df is its frame with rows appended.
+
+        The first rows of df must be the ones this index was built on, as
+        told by their order_by values; otherwise df is indexed from scratch.
+        """
+        columns = dict(wand=self.wand, session=self.session, order_by=self.order_by, activity=self.activity)
+        rows = len(self.df)
+        values = df[self.order_by].to_numpy()
+        if len(df) < rows or values.dtype.kind not in 'iu' or not np.array_equal(values[:rows], self.df[self.order_by].to_numpy()):
+            return JourneyIndex(df, **columns)
+        group_codes, groups = factorize_groups(df, [self.wand, self.session])
+        # Groups follow the sorted keys, so the old permutation stays sorted
+        # by (group, order_by) and only the new rows need sorting.
+        lowest = int(values.min()) if len(values) else 0
+        span = int(values.max()) - lowest + 1 if len(values) else 1
+        if len(groups) * span >= 1 << 62:
+            return JourneyIndex(df, **columns)
+        key = group_codes * span + (values.astype(np.int64) - lowest)
+        new = np.arange(rows, len(df))
+        new = new[group_codes[new] >= 0]
+        new_order = new[np.argsort(key[new], kind='stable')]
+        positions = np.searchsorted(key[self._order], key[new_order], side='right')
+        extended = JourneyIndex.__new__(JourneyIndex)
+        extended.df = df
+        vars(extended).update(columns)
+        extended._index(np.insert(self._order, positions, new_order), group_codes, groups)
+        return extended
+
+    def _index(self, order, group_codes, groups):
+        """Sets the session offsets, steps and transitions from the rows sorted by (group, order_by)."""
+        df, activity = self.df, self.activity
+        order.flags.writeable = False
+        self._order = order
+
+        self._session_offsets = _offsets(group_codes[order], len(groups))
+        wand_codes, self._wands = pd.factorize(groups.get_level_values(0))
+        first_group = _offsets(wand_codes, len(self._wands))
+        self._wand_offsets = self._session_offsets[first_group]
+        self._wand_lookup = {value: i for i, value in enumerate(self._wands)}
+        self._sessions = groups.get_level_values(1)
+
+        # Steps: runs of one activity within a session, in sorted row order.
+        a_codes, activities = pd.factorize(df[activity].take(order))
+        self._activities = np.asarray(activities)
+        session_of = np.repeat(np.arange(len(groups)), np.diff(self._session_offsets))
+        valid = np.flatnonzero(a_codes >= 0)
+        a_valid, s_valid = a_codes[valid], session_of[valid]
+        new_step = np.ones(len(valid), dtype=bool)
+        new_step[1:] = (a_valid[1:] != a_valid[:-1]) | (s_valid[1:] != s_valid[:-1])
+        step_starts = np.flatnonzero(new_step)
+        self._step_rows = valid[step_starts]
+        self._step_events = np.diff(np.append(step_starts, len(valid)))
+        self._step_activity = a_valid[step_starts]
+        self._step_session = s_valid[step_starts]
+        self._step_offsets = np.searchsorted(self._step_session, np.arange(len(groups) + 1))
+
+        same_session = self._step_session[1:] == self._step_session[:-1]
+        self._transition_from = self._step_activity[:-1][same_session]
+        self._transition_to = self._step_activity[1:][same_session]
+
+    @property
+    def activities(self):
+        """Returns the activity values that step and transition codes refer to."""
+        return self._activities
+
+    def wands(self):
+        """Returns the wands in sorted order."""
+        return list(self._wands)
+
+    def wand_rows(self, wand):
+        """Returns a wand's row positions ordered by session and event."""
+        i = self._wand_lookup.get(wand)
+        if i is None:
+            return self._order[:0]
+        return self._order[self._wand_offsets[i]:self._wand_offsets[i + 1]]
+
+    def journey(self, wand):
+        """Returns a wand's events in journey order."""
+        return self.df.take(self.wand_rows(wand))
+
+    def _wand_steps(self, wand):
+        i = self._wand_lookup.get(wand)
+        if i is None:
+            return slice(0, 0)
+        first = np.searchsorted(self._session_offsets, self._wand_offsets[i])
+        last = np.searchsorted(self._session_offsets, self._wand_offsets[i + 1])
+        return slice(self._step_offsets[first], self._step_offsets[last])
+
+    def steps(self, wand):
+        """Returns a wand's path: one row per run of events in the same activity."""
+        steps = self._wand_steps(wand)
+        sessions = self._step_session[steps]
+        path = pd.DataFrame({
+            self.session: np.asarray(self._sessions)[sessions],
+            self.activity: self._activities[self._step_activity[steps]],
+            'events': self._step_events[steps],
+            self.order_by: self.df[self.order_by].to_numpy()[self._order[self._step_rows[steps]]],
+        })
+        path.insert(1, 'step', path.groupby(sessions, sort=False).cumcount().to_numpy())
+        return path
+
+    def fleet_steps(self):
+        """Returns every step of every wand in journey order (wand, session, activity, events)."""
+        wands = np.asarray(self._wands)[np.searchsorted(self._wand_offsets, self._session_offsets[self._step_session], side='right') - 1]
+        return pd.DataFrame({
+            self.wand: wands,
+            self.session: np.asarray(self._sessions)[self._step_session],
+            self.activity: self._activities[self._step_activity],
+            'events': self._step_events,
+        })
+
+    def transitions(self, wand=None):
+        """Returns (from, to, count) of activity transitions of one wand or of the fleet."""
+        if wand is None:
+            source, target = self._transition_from, self._transition_to
+        else:
+            steps = self._wand_steps(wand)
+            activity = self._step_activity[steps]
+            same_session = self._step_session[steps][1:] == self._step_session[steps][:-1]
+            source, target = activity[:-1][same_session], activity[1:][same_session]
+        n = len(self._activities)
+        counts = np.bincount(source.astype(np.int64) * n + target, minlength=n * n)
+        nonzero = np.flatnonzero(counts)
+        return pd.DataFrame({
+            'from': self._activities[nonzero // n],
+            'to': self._activities[nonzero % n],
+            'count': counts[nonzero],
+        })
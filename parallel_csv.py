@@ -0,0 +1,151 @@
+#######################
+# Parallel chunked CSV parsing
+#
+# A large export is split into byte ranges that start and end on line
+# boundaries, and a pool of worker processes parses one range each. Every
+# worker reads its own range from the file, so only parsed Arrow tables
+# travel back. When the dataset has a schema (see compact.SCHEMAS) the
+# columns are parsed with explicit Arrow types and no inference pass; the
+# chunks are then joined with unified dictionaries and compacted as a
+# whole. Quoted fields must not contain line breaks (the exports never do).
+#
+# Usage:
+#   python parallel_csv.py data/nwu_inference_slim.csv --workers 4
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+import compact
+
+CHUNK_BYTES = 64 << 20
+
+# Arrow types of the schema column kinds; integers get their compact dtype after joining
+ARROW_TYPES = {
+    'category': pa.dictionary(pa.int32(), pa.string()),
+    'int': pa.int64(),
+    'uint': pa.int64(),
+    'int32': pa.int64(),
+    'int64': pa.int64(),
+    'float32': pa.float32(),
+    'datetime': pa.timestamp('us'),
+}
+
+
+def read_header(path):
+    """Returns (column names, byte offset of the first data line); blank names as pandas names them."""
+    with open(path, 'rb') as f:
+        names = next(csv.reader([f.readline().decode('utf-8-sig')]))
+        return [name or f'Unnamed: {i}' for i, name in enumerate(names)], f.tell()
+
+
+def split_offsets(path, chunk_bytes=CHUNK_BYTES):
+    """Returns (start, stop) byte ranges of about chunk_bytes, each made of whole lines."""
+    _, start = read_header(path)
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            if f.tell() < size:
+                f.readline()
+            stop = f.tell()
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+def column_types(schema, names):
+    """Returns the Arrow type of every column in names that a schema lists."""
+    return {column: ARROW_TYPES[kind] for column, kind in (schema or {}).items() if column in names}
+
+
+def parse_range(path, start, stop, names, schema=None):
+    """Parses the lines in [start, stop) of a CSV export into an Arrow Table."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    read_options = pa_csv.ReadOptions(column_names=names, use_threads=False)
+    types = column_types(schema, names)
+    try:
+        return pa_csv.read_csv(pa.py_buffer(data), read_options=read_options,
+                               convert_options=pa_csv.ConvertOptions(column_types=types, strings_can_be_null=True))
+    except pa.ArrowInvalid:
+        # Timestamps Arrow cannot parse (e.g. with an offset) are left to pandas.
+        types = {column: pa.string() if pa.types.is_timestamp(t) else t for column, t in types.items()}
+        return pa_csv.read_csv(pa.py_buffer(data), read_options=read_options,
+                               convert_options=pa_csv.ConvertOptions(column_types=types, strings_can_be_null=True))
+
+
+def concat_chunks(tables):
+    """Joins parsed chunks into one frame, with sorted categories shared by every chunk."""
+    table = pa.concat_tables(tables, promote_options='permissive').unify_dictionaries()
+    df = table.to_pandas()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].cat.reorder_categories(sorted(df[column].cat.categories))
+    return df
+
+
+def read_csv_parallel(path, schema=None, workers=None, chunk_bytes=CHUNK_BYTES, progress=None):
+    """Parses a CSV export in worker processes and returns it in compact dtypes.
+
+    progress, when given, is called with (bytes parsed, total bytes) as
+    chunks finish.
+    """
+    names, _ = read_header(path)
+    ranges = split_offsets(path, chunk_bytes)
+    total = sum(stop - start for start, stop in ranges)
+    workers = min(workers or os.cpu_count() or 1, len(ranges))
+    chunks = [None] * len(ranges)
+    done = 0
+    if workers <= 1:
+        for i, (start, stop) in enumerate(ranges):
+            chunks[i] = parse_range(path, start, stop, names, schema)
+            done += stop - start
+            if progress:
+                progress(done, total)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(parse_range, path, start, stop, names, schema): i
+                       for i, (start, stop) in enumerate(ranges)}
+            for future in as_completed(futures):
+                i = futures[future]
+                chunks[i] = future.result()
+                done += ranges[i][1] - ranges[i][0]
+                if progress:
+                    progress(done, total)
+    if not chunks:
+        return compact.compact(pd.DataFrame({name: [] for name in names}), schema)
+    return compact.compact(concat_chunks(chunks), schema)
+
+
+def parse_progress(placeholder, path):
+    """Returns a progress callback for read_csv_parallel that fills a Streamlit progress placeholder."""
+    def progress(done, total):
+        placeholder.progress(done / max(total, 1), text=f'Parsing {os.path.basename(path)}: {done >> 20} of {total >> 20} MB')
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parse a CSV export in parallel and report the throughput.')
+    parser.add_argument('path', help='CSV export')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-mb', type=int, default=CHUNK_BYTES >> 20, help='chunk size in MB')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    df = read_csv_parallel(args.path, compact.schema_for(args.path), args.workers, args.chunk_mb << 20)
+    seconds = time.perf_counter() - start
+    size_mb = os.path.getsize(args.path) / 2**20
+    print(f'{len(df)} rows, {size_mb:.1f} MB in {seconds:.2f} s ({size_mb / seconds:.1f} MB/s)')
+
+
+if __name__ == '__main__':
+    main()
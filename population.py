@@ -0,0 +1,91 @@
+#######################
+# Year-over-year population engine
+#
+# The reshaped US population data (one row per state and year) is pivoted
+# once into a dense state x year matrix. Every year's change from the
+# previous year, the inbound/outbound migration flags (a change beyond
+# +/- MIGRATION_THRESHOLD) and the ranking of states by change are derived
+# for all years in single array operations, so a selected year is only a
+# column lookup. States are aligned by name, not by row position; a state
+# missing in the previous year (or a year without data for the year before)
+# counts its whole population as the change, as the dashboards always did.
+# The source frame is kept as df, so an app can share it with the matrix.
+
+import numpy as np
+import pandas as pd
+
+POPULATION_DATA = 'data/us-population-2010-2019-reshaped.csv'
+MIGRATION_THRESHOLD = 50000
+
+
+class PopulationMatrix:
+    """Populations, year-over-year changes and rankings of every state and year."""
+
+    def __init__(self, df, state='states', year='year', value='population', state_columns=('states_code', 'id')):
+        self.df = df
+        self.state = state
+        state_codes, states = pd.factorize(df[state])
+        year_codes, years = pd.factorize(df[year], sort=True)
+        self.states = np.asarray(states)
+        self.years = np.asarray(years)
+        self._year_lookup = {y: i for i, y in enumerate(self.years.tolist())}
+
+        self.population = np.zeros((len(states), len(years)), dtype=np.int64)
+        self.present = np.zeros((len(states), len(years)), dtype=bool)
+        self.population[state_codes, year_codes] = df[value].to_numpy()
+        self.present[state_codes, year_codes] = True
+
+        # The previous year is looked up by value, so a gap in the years
+        # leaves the year after it without a previous population.
+        previous_column = np.array([self._year_lookup.get(y - 1, -1) for y in self.years.tolist()], dtype=np.int64)
+        has_previous = previous_column >= 0
+        previous = np.zeros_like(self.population)
+        previous[:, has_previous] = self.population[:, previous_column[has_previous]]
+        self.difference = np.where(self.present, self.population - previous, 0)
+
+        # Per year, present states by change (largest gain first) and their rank.
+        key = np.where(self.present, -self.difference, np.iinfo(np.int64).max)
+        self.order = np.argsort(key, axis=0, kind='stable')
+        self.rank = np.empty_like(self.order)
+        np.put_along_axis(self.rank, self.order, np.arange(len(states))[:, None], axis=0)
+        self.state_counts = self.present.sum(axis=0)
+        self.inbound = self.present & (self.difference > MIGRATION_THRESHOLD)
+        self.outbound = self.present & (self.difference < -MIGRATION_THRESHOLD)
+
+        first_rows = np.unique(state_codes, return_index=True)[1]
+        self.state_info = df.iloc[first_rows][[c for c in state_columns if c in df.columns]].reset_index(drop=True)
+
+    def _column(self, year):
+        try:
+            return self._year_lookup[year]
+        except KeyError:
+            raise KeyError(f'no population data for {year}') from None
+
+    def difference_table(self, year):
+        """Returns the states of a year sorted by change from the previous year (largest gain first)."""
+        j = self._column(year)
+        rows = self.order[:self.state_counts[j], j]
+        table = pd.DataFrame({self.state: self.states[rows]})
+        for column in self.state_info.columns:
+            table[column] = self.state_info[column].to_numpy()[rows]
+        table['population'] = self.population[rows, j]
+        table['population_difference'] = self.difference[rows, j]
+        table['rank'] = self.rank[rows, j] + 1
+        return table
+
+    def migration_shares(self, year):
+        """Returns the percentages of a year's states with inbound and outbound migration."""
+        j = self._column(year)
+        states = max(int(self.state_counts[j]), 1)
+        return round(self.inbound[:, j].sum() / states * 100), round(self.outbound[:, j].sum() / states * 100)
+
+    def to_frame(self):
+        """Returns population, change and rank of every state and year in long form."""
+        states, years = np.nonzero(self.present)
+        return pd.DataFrame({
+            self.state: self.states[states],
+            'year': self.years[years],
+            'population': self.population[states, years],
+            'population_difference': self.difference[states, years],
+            'rank': self.rank[states, years] + 1,
+        })
@@ -0,0 +1,171 @@
+#######################
+# Per-rerun stage timings for the dashboards
+#
+# An app creates one RerunProfile at the top of the script and calls
+# lap(name) where each named stage begins; a lap ends the previous stage.
+# Every stage records its wall time and, when allocation tracking is on,
+# the memory tracemalloc saw allocated meanwhile (net and peak). tracemalloc
+# traces the whole process: it runs while at least one session holds a
+# MemoryTracking claim, and its figures include allocations made by other
+# sessions' reruns in the same interval. The finished
+# profile is shown in the sidebar and can be appended to a rotating JSONL
+# log, one line per stage, for offline analysis.
+#
+# Usage (summary of the log):
+#   python profiling.py
+
+import argparse
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+from datetime import datetime, timezone
+
+import pandas as pd
+
+LOG_PATH = os.path.join('logs', 'profile.jsonl')
+LOG_MAX_BYTES = 5 << 20
+LOG_BACKUPS = 3
+
+_logger = logging.getLogger('dashboard.profile')
+_logger.propagate = False
+
+_tracking_lock = threading.Lock()
+_tracking_sessions = 0
+
+
+def _acquire_tracking():
+    global _tracking_sessions
+    with _tracking_lock:
+        _tracking_sessions += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def _release_tracking():
+    global _tracking_sessions
+    with _tracking_lock:
+        _tracking_sessions -= 1
+        if _tracking_sessions == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class MemoryTracking:
+    """One session's claim on the process-wide tracemalloc tracing.
+
+    Keep one instance in st.session_state; tracing stops when no session
+    holds a claim, including when a session's state is garbage collected.
+    """
+
+    def __init__(self):
+        self._release = None
+
+    @property
+    def enabled(self):
+        return self._release is not None and self._release.alive
+
+    def set(self, enabled):
+        """Takes or gives up this session's claim; repeated calls are no-ops."""
+        if enabled and not self.enabled:
+            _acquire_tracking()
+            self._release = weakref.finalize(self, _release_tracking)
+        elif not enabled and self.enabled:
+            self._release()
+        return self
+
+
+class RerunProfile:
+    """Wall time and allocations of the named stages of one script run."""
+
+    def __init__(self, app, tracking=None):
+        self.app = app
+        self.track_memory = tracking is not None and tracking.enabled
+        self.started = datetime.now(timezone.utc)
+        self.stages = []
+        self._current = None
+
+    def _close(self):
+        if self._current is None:
+            return
+        name, start, memory = self._current
+        stage = {'stage': name, 'ms': (time.perf_counter() - start) * 1000}
+        if memory is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            stage['process_alloc_kb'] = (current - memory) / 1024
+            stage['process_peak_kb'] = (peak - memory) / 1024
+        self.stages.append(stage)
+        self._current = None
+
+    def lap(self, name):
+        """Ends the running stage and starts the one called name."""
+        self._close()
+        memory = None
+        if self.track_memory:
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        self._current = (name, time.perf_counter(), memory)
+
+    def finish(self):
+        """Ends the running stage; returns the stages as a frame."""
+        self._close()
+        return self.frame()
+
+    def frame(self):
+        columns = ['ms', 'process_alloc_kb', 'process_peak_kb'] if self.track_memory else ['ms']
+        if not self.stages:
+            return pd.DataFrame(columns=columns)
+        return pd.DataFrame(self.stages).set_index('stage').reindex(columns=columns).round(1)
+
+    def total_ms(self):
+        return sum(stage['ms'] for stage in self.stages)
+
+    def write_log(self, path=LOG_PATH):
+        """Appends the stages to a rotating JSONL log, one line per stage."""
+        _handler(path)
+        run = {'app': self.app, 'run': self.started.isoformat(timespec='milliseconds')}
+        for stage in self.stages:
+            _logger.info(json.dumps({**run, **stage}))
+
+
+def _handler(path):
+    """Attaches a rotating file handler for path to the profile logger once."""
+    path = os.path.abspath(path)
+    for handler in _logger.handlers:
+        if getattr(handler, 'baseFilename', None) == path:
+            return handler
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    _logger.addHandler(handler)
+    _logger.setLevel(logging.INFO)
+    return handler
+
+
+def summarize(path=LOG_PATH):
+    """Returns count, mean and p90 milliseconds per (app, stage) from a JSONL log and its backups."""
+    paths = [f'{path}.{i}' for i in range(LOG_BACKUPS, 0, -1)] + [path]
+    records = []
+    for log_path in paths:
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    if not records:
+        return pd.DataFrame(columns=['runs', 'mean ms', 'p90 ms'])
+    grouped = pd.DataFrame(records).groupby(['app', 'stage'])['ms']
+    return pd.DataFrame({'runs': grouped.size(), 'mean ms': grouped.mean(), 'p90 ms': grouped.quantile(0.9)}).round(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarize the stage timings in the dashboard profile log.')
+    parser.add_argument('--log', default=LOG_PATH, help='JSONL profile log')
+    args = parser.parse_args(argv)
+
+    print(summarize(args.log).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,14 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 import plotly.express as px
+import pyarrow as pa
+
+import data_loader
+import dataset_registry
+import ingest
+import parallel_csv
+import profiling
+import summary_cube
 
 #######################
 # Page configuration
@@ -16,13 +24,53 @@ st.set_page_config(
 alt.themes.enable("dark")
 
 
+# Timings of the named stages of this run, shown in the sidebar
+if 'memory_tracking' not in st.session_state:
+    st.session_state.memory_tracking = profiling.MemoryTracking()
+memory_tracking = st.session_state.memory_tracking.set(st.session_state.get('profile_memory', False))
+profile = profiling.RerunProfile('streamlit_app', memory_tracking)
+
 #######################
-# Load data
-df_reshaped = pd.read_csv('data/action_inference.csv')
+# Load data (from the summary cube, or the ingested store's running summary,
+# when there is one) as an Arrow table, shared by every session through the
+# dataset registry
+def load_data(path):
+    if path == summary_cube.CUBE_PATH:
+        summary = summary_cube.SummaryCube.load(path).rollup(['activity_id', 'action', 'action_data'], dropna=False)
+    elif path == ingest.STORE_DIR:
+        summary = ingest.EventStore(path).summary()
+    else:
+        progress_bar = st.empty()
+        table = data_loader.load_table_cached(path, progress=parallel_csv.parse_progress(progress_bar, path))
+        progress_bar.empty()
+        return table
+    return pa.Table.from_pandas(summary, preserve_index=False)
+
+profile.lap('Load data')
+# A cube is only used while it is current; one built from anything but the
+# store is ignored once the store has rows, so new partitions always show.
+store = ingest.EventStore()
+if summary_cube.is_current(summary_cube.CUBE_PATH, store.root if store.has_events() else None):
+    data_path = summary_cube.CUBE_PATH
+    data_version = data_loader.file_version(data_path)
+elif store.has_events():
+    data_path = store.root
+    data_version = store.version()
+else:
+    data_path = 'data/action_inference.csv'
+    data_version = data_loader.file_version(data_path)
+
+if 'dataset_leases' not in st.session_state:
+    st.session_state.dataset_leases = dataset_registry.SessionLeases()
+table = st.session_state.dataset_leases.get('action_inference', (data_path, data_version), lambda: load_data(data_path))
+# The frame over the table is built once per version and shared like the table
+df_reshaped = st.session_state.dataset_leases.get('action_inference_frame', (data_path, data_version),
+                                                  lambda: data_loader.table_to_frame(table))
 df = df_reshaped
 
 #######################
 # Sidebar
+profile.lap('Sidebar')
 with st.sidebar:
     st.title('Wand Activities')
     
@@ -31,7 +79,7 @@ with st.sidebar:
     activity_list = list(df_sorted.activity_id.unique()) #[::-1]
     
     selected_activity = st.selectbox('Select an activity', activity_list)
-    df_selected_activity = df_reshaped[df_reshaped.activity_id == selected_activity]
+    df_selected_activity = data_loader.filter_rows(table, activity_id=selected_activity)
     df_selected_activity_sorted = df_selected_activity.sort_values(by="Wand Count", ascending=False)
 
     color_theme_list = ['blues', 'cividis', 'greens', 'inferno', 'magma', 'plasma', 'reds', 'rainbow', 'turbo', 'viridis']
@@ -128,19 +176,13 @@ def format_number(num):
         return f'{round(num / 1000000, 1)} M'
     return f'{num // 1000} K'
 
-# Calculation year-over-year population migrations
-def calculate_population_difference(input_df, input_year):
-  selected_year_data = input_df[input_df['year'] == input_year].reset_index()
-  previous_year_data = input_df[input_df['year'] == input_year - 1].reset_index()
-  selected_year_data['population_difference'] = selected_year_data.population.sub(previous_year_data.population, fill_value=0)
-  return pd.concat([selected_year_data.states, selected_year_data.id, selected_year_data.population, selected_year_data.population_difference], axis=1).sort_values(by="population_difference", ascending=False)
-
 
 #######################
 # Dashboard Main Panel
 col = st.columns((1.5, 4.5, 2), gap='medium')
 
 with col[0]:
+    profile.lap('Activity Count')
     st.markdown('#### Activity Count')
 
     total_event_count = df['Event Count'].sum()
@@ -150,7 +192,7 @@ with col[0]:
 
     print(selected_activity_count, total_event_count) #, activity_name)
     
-    # df_population_difference_sorted = calculate_population_difference(df_reshaped, selected_year)
+    # df_population_difference_sorted = population_matrix.difference_table(selected_year)  (see population.py)
 
     # if selected_year > 2010:
     #     first_state_name = df_population_difference_sorted.states.iloc[0]
@@ -206,6 +248,7 @@ with col[0]:
         st.altair_chart(donut_chart_less)
 
 with col[1]:
+    profile.lap('Heatmap')
     st.markdown('#### Unique Wand vs Events')
     
     heatmap = make_heatmap(df_reshaped, 'activity_id', 'Wand Count', 'Event Count', selected_color_theme)
@@ -213,12 +256,13 @@ with col[1]:
     
 
 with col[2]:
+    profile.lap('Top Activities')
     st.markdown('#### Top Activities')
 
     st.dataframe(df_selected_activity_sorted,
                  column_order=("action_data", "Wand Count", "Event Count"),
                  hide_index=True,
-                 width=None,
+                 width='stretch',
                  column_config={
                     "Activity": st.column_config.TextColumn(
                         "activity_id",
@@ -232,3 +276,16 @@ with col[2]:
                  )
     
    
+
+
+#######################
+# Profile of this run
+with st.sidebar:
+    profile.finish()
+    with st.expander(f'Profile ({profile.total_ms():.0f} ms)'):
+        st.dataframe(profile.frame())
+        if profile.track_memory:
+            st.caption("Allocations are process-wide and include other sessions' reruns")
+        st.toggle('Track allocations', key='profile_memory', help='tracemalloc slows every stage while it runs')
+        if st.toggle('Write to log', key='profile_log', help=profiling.LOG_PATH):
+            profile.write_log()
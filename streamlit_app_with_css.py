@@ -5,6 +5,9 @@ import pandas as pd
 import altair as alt
 import plotly.express as px
 
+import data_loader
+import population
+
 #######################
 # Page configuration
 st.set_page_config(
@@ -66,8 +69,14 @@ st.markdown("""
 
 
 #######################
-# Load data
-df_reshaped = pd.read_csv('data/us-population-2010-2019-reshaped.csv')
+# Load data, with the year-over-year changes of every state and year, once
+# per data version
+@st.cache_resource(max_entries=2)
+def load_population(path, version):
+    return population.PopulationMatrix(pd.read_csv(path))
+
+population_matrix = load_population(population.POPULATION_DATA, data_loader.file_version(population.POPULATION_DATA))
+df_reshaped = population_matrix.df.copy(deep=False)
 
 
 #######################
@@ -175,13 +184,6 @@ def format_number(num):
         return f'{round(num / 1000000, 1)} M'
     return f'{num // 1000} K'
 
-# Calculation year-over-year population migrations
-def calculate_population_difference(input_df, input_year):
-  selected_year_data = input_df[input_df['year'] == input_year].reset_index()
-  previous_year_data = input_df[input_df['year'] == input_year - 1].reset_index()
-  selected_year_data['population_difference'] = selected_year_data.population.sub(previous_year_data.population, fill_value=0)
-  return pd.concat([selected_year_data.states, selected_year_data.id, selected_year_data.population, selected_year_data.population_difference], axis=1).sort_values(by="population_difference", ascending=False)
-
 
 #######################
 # Dashboard Main Panel
@@ -190,7 +192,7 @@ col = st.columns((1.5, 4.5, 2), gap='medium')
 with col[0]:
     st.markdown('#### Gains/Losses')
 
-    df_population_difference_sorted = calculate_population_difference(df_reshaped, selected_year)
+    df_population_difference_sorted = population_matrix.difference_table(selected_year)
 
     if selected_year > 2010:
         first_state_name = df_population_difference_sorted.states.iloc[0]
@@ -216,14 +218,8 @@ with col[0]:
     st.markdown('#### States Migration')
 
     if selected_year > 2010:
-        # Filter states with population difference > 50000
-        # df_greater_50000 = df_population_difference_sorted[df_population_difference_sorted.population_difference_absolute > 50000]
-        df_greater_50000 = df_population_difference_sorted[df_population_difference_sorted.population_difference > 50000]
-        df_less_50000 = df_population_difference_sorted[df_population_difference_sorted.population_difference < -50000]
-        
-        # % of States with population difference > 50000
-        states_migration_greater = round((len(df_greater_50000)/df_population_difference_sorted.states.nunique())*100)
-        states_migration_less = round((len(df_less_50000)/df_population_difference_sorted.states.nunique())*100)
+        # % of States with population difference > 50000 / < -50000
+        states_migration_greater, states_migration_less = population_matrix.migration_shares(selected_year)
         donut_chart_greater = make_donut(states_migration_greater, 'Inbound Migration', 'green')
         donut_chart_less = make_donut(states_migration_less, 'Outbound Migration', 'red')
     else:
@@ -255,7 +251,7 @@ with col[2]:
     st.dataframe(df_selected_year_sorted,
                  column_order=("states", "population"),
                  hide_index=True,
-                 width=None,
+                 width='stretch',
                  column_config={
                     "states": st.column_config.TextColumn(
                         "States",
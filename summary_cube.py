@@ -0,0 +1,259 @@
+#######################
+# Activity summary cube
+#
+# The raw event log is rolled up once into base cells of
+# activity_id x action x action_data x day with an event count and a
+# mergeable HyperLogLog sketch of the cell's wands (see hll.py). Wand Count
+# at any coarser level is the estimate of the merged sketches of the
+# matching cells, so every panel can be answered from the cube without
+# touching the raw events. Each dimension has a sorted index of the cells
+# per value, so a filtered rollup only visits the cells it needs. The cube
+# file records the source (CSV export or ingest store) and its version, so
+# a cube that fell behind its source can be told apart from a current one.
+# Cubes of separate batches of events can be read together and compacted
+# into one (the ingest store keeps its summary that way, see ingest.py).
+#
+# Usage:
+#   python summary_cube.py --data data/nwu_inference_slim.csv
+#   python summary_cube.py --data data/store
+
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import data_loader
+import hll
+import ingest
+
+CUBE_PATH = os.path.join('data', 'summary_cube.parquet')
+TIMESTAMP_COLUMN = 'created_at'
+DIMENSIONS = ['activity_id', 'action', 'action_data', 'day']
+WAND_COLUMN = 'wand_identifier'
+PRECISION = 14
+SOURCE_KEY = b'summary_cube_source'
+PRECISION_KEY = b'summary_cube_precision'
+SKETCH_COLUMNS = ['wand_entries', 'wand_registers']
+
+
+def source_version(source):
+    """Returns the JSON version of a cube source: the store sequence or the file (mtime, size)."""
+    if os.path.isdir(source):
+        return ingest.EventStore.open(source).version()
+    return list(data_loader.file_version(source))
+
+
+def read_source(source):
+    """Returns the events of a cube source, an ingest store or a CSV export."""
+    if os.path.isdir(source):
+        return ingest.EventStore.open(source).load()
+    return data_loader.load_csv_cached(source)
+
+
+def built_from(path=CUBE_PATH, key=SOURCE_KEY):
+    """Returns (source, version) recorded under key in a Parquet file's metadata, or None."""
+    if not os.path.exists(path):
+        return None
+    recorded = (pq.read_schema(path).metadata or {}).get(key)
+    if recorded is None:
+        return None
+    recorded = json.loads(recorded)
+    return recorded['source'], recorded['version']
+
+
+def is_current(path=CUBE_PATH, source=None, key=SOURCE_KEY):
+    """Tells whether a cube (or a file recording key) was built from the current version of its source (or of source)."""
+    built = built_from(path, key)
+    if built is None or (source is not None and os.path.normpath(built[0]) != os.path.normpath(source)):
+        return False
+    return os.path.exists(built[0]) and built[1] == source_version(built[0])
+
+
+def build_cells(events, dimensions=DIMENSIONS, precision=PRECISION):
+    """Returns the base cells (one row per dimension combination) of an event log and their wand sketches."""
+    events = events.copy(deep=False)
+    if 'day' in dimensions and TIMESTAMP_COLUMN in events.columns:
+        events['day'] = pd.to_datetime(events[TIMESTAMP_COLUMN]).dt.strftime('%Y-%m-%d')
+    dimensions = [d for d in dimensions if d in events.columns]
+    cell_codes = events.groupby(dimensions, observed=True, dropna=False).ngroup().to_numpy()
+    n_cells = int(cell_codes.max()) + 1 if len(cell_codes) else 0
+    first = np.full(n_cells, len(cell_codes), dtype=np.int64)
+    np.minimum.at(first, cell_codes, np.arange(len(cell_codes)))
+    cells = events[dimensions].take(first).reset_index(drop=True)
+    cells['Event Count'] = np.bincount(cell_codes, minlength=n_cells).astype(np.int64)
+    wands = pd.DataFrame({'cell': cell_codes, WAND_COLUMN: events[WAND_COLUMN].to_numpy()})
+    sketches = hll.GroupedSketches(wands, 'cell', WAND_COLUMN, precision)
+    return data_loader.as_categories(cells, dimensions), sketches
+
+
+class SummaryCube:
+    """Rollups of the base cells at any subset of the dimensions.
+
+    Results are memoized per (dimensions, filters), so repeated reruns of the
+    same panel are dictionary lookups. A cube may be shared between threads;
+    every caller gets its own copy of a result.
+    """
+
+    def __init__(self, cells, sketches, max_rollups=256):
+        self.cells = cells
+        self.sketches = sketches
+        self.dimensions = [c for c in cells.columns if c != 'Event Count']
+        self.max_rollups = max_rollups
+        self._rollups = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Per dimension: cell codes, and the cells of every value as a slice
+        # of the cells sorted by that dimension
+        self._event_counts = cells['Event Count'].to_numpy()
+        self._codes = {}
+        self._values = {}
+        self._cells_by = {}
+        for dimension in self.dimensions:
+            codes, values = pd.factorize(cells[dimension], sort=True)
+            order = np.argsort(codes, kind='stable')
+            order = order[codes[order] >= 0]
+            starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+            stops = np.append(starts[1:], len(order))
+            self._codes[dimension] = codes
+            self._values[dimension] = pd.Index(np.asarray(values))
+            labels = np.asarray(values, dtype=object)[codes[order[starts]]].tolist()
+            self._cells_by[dimension] = (order, dict(zip(labels, zip(starts.tolist(), stops.tolist()))))
+
+    @classmethod
+    def from_events(cls, events, dimensions=DIMENSIONS, precision=PRECISION):
+        return cls(*build_cells(events, dimensions, precision))
+
+    @classmethod
+    def load(cls, path=CUBE_PATH):
+        """Reads a cube file; a list of files (e.g. per-batch cubes) is read as one cube holding all their cells."""
+        paths = [path] if isinstance(path, str) else list(path)
+        tables = [pq.read_table(p) for p in paths]
+        precisions = {int((t.schema.metadata or {}).get(PRECISION_KEY, PRECISION)) for t in tables}
+        if len(precisions) != 1:
+            raise ValueError(f'cannot read cubes of different precisions {sorted(precisions)} together')
+        precision = precisions.pop()
+        table = pa.concat_tables(tables, promote_options='permissive').unify_dictionaries()
+        cells = table.drop_columns(SKETCH_COLUMNS).to_pandas()
+        sketches = hll.GroupedSketches.from_group_arrays(pd.RangeIndex(len(cells), name='cell'), 'cell', WAND_COLUMN,
+                                                         precision, table['wand_entries'], table['wand_registers'])
+        return cls(cells, sketches)
+
+    def save(self, path=CUBE_PATH, source=None, version=None):
+        """Writes the cells and their sketches, recording the source and version they were built from."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        table = pa.Table.from_pandas(self.cells, preserve_index=False)
+        for name, column in zip(SKETCH_COLUMNS, self.sketches.group_arrays()):
+            table = table.append_column(name, column)
+        metadata = {**(table.schema.metadata or {}), PRECISION_KEY: str(self.sketches.precision)}
+        if source is not None:
+            metadata[SOURCE_KEY] = json.dumps({'source': source, 'version': version})
+        tmp = path + '.tmp'
+        pq.write_table(table.replace_schema_metadata(metadata), tmp)
+        os.replace(tmp, path)
+
+    def _select(self, filters):
+        """Returns the sorted positions of the cells matching every (dimension, value), or None for all."""
+        if not filters:
+            return None
+        matches = []
+        for dimension, value in filters:
+            order, spans = self._cells_by[dimension]
+            start, stop = spans.get(value, (0, 0))
+            matches.append((order[start:stop], dimension, order[start] if stop > start else -1))
+        cells, _, _ = min(matches, key=lambda match: len(match[0]))
+        for _, dimension, first in matches:
+            code = self._codes[dimension][first] if first >= 0 else -2
+            cells = cells[self._codes[dimension][cells] == code]
+        return np.sort(cells)
+
+    def _group(self, cells, dimensions, dropna=True):
+        """Returns the group of every cell over dimensions and the groups' values, in sorted order.
+
+        Cells missing a value get group -1 with dropna, else a group of their
+        own, sorted last.
+        """
+        combined = np.zeros(len(cells), dtype=np.int64)
+        keep = np.ones(len(cells), dtype=bool)
+        for dimension in dimensions:
+            codes = self._codes[dimension][cells]
+            missing = len(self._values[dimension])
+            keep &= codes >= 0
+            combined = combined * (missing + 1) + np.where(codes >= 0, codes, missing)
+        if not dropna:
+            keep[:] = True
+        groups = np.full(len(cells), -1, dtype=np.int64)
+        groups[keep], keys = pd.factorize(combined[keep], sort=True)
+        keys = np.asarray(keys, dtype=np.int64)
+        values = {}
+        for dimension in reversed(dimensions):
+            missing = len(self._values[dimension])
+            codes = keys % (missing + 1)
+            keys = keys // (missing + 1)
+            values[dimension] = pd.Categorical.from_codes(np.where(codes == missing, -1, codes), self._values[dimension])
+        return groups, pd.DataFrame({dimension: values[dimension] for dimension in dimensions})
+
+    def compacted(self):
+        """Returns the cube with one cell per combination of values, merging repeated cells (e.g. of several files)."""
+        groups, cells = self._group(np.arange(len(self.cells)), self.dimensions, dropna=False)
+        cells['Event Count'] = np.bincount(groups, weights=self._event_counts, minlength=len(cells)).astype(np.int64)
+        sketches = self.sketches.merge_groups(groups, pd.RangeIndex(len(cells), name='cell'), ['cell'])
+        return SummaryCube(cells, sketches, self.max_rollups)
+
+    def rollup(self, dimensions=(), dropna=True, **filters):
+        """Returns Wand Count, Event Count and Events/Wand grouped by dimensions.
+
+        Keyword arguments filter on dimension values, e.g.
+        ``cube.rollup(['action_data'], activity_id='ALZ_P0405')``. With no
+        dimensions the result is a single row of fleet-wide totals. Cells
+        missing a dimension value are left out unless dropna is False.
+        """
+        dimensions = tuple(dimensions)
+        key = (dimensions, dropna, tuple(sorted(filters.items())))
+        with self._lock:
+            result = self._rollups.get(key)
+            if result is not None:
+                self._rollups.move_to_end(key)
+                return result.copy()
+
+        cells = self._select(key[2])
+        if cells is None:
+            cells = np.arange(len(self.cells))
+        if dimensions:
+            groups, result = self._group(cells, list(dimensions), dropna)
+        else:
+            groups, result = np.zeros(len(cells), dtype=np.int64), pd.DataFrame(index=pd.RangeIndex(1))
+        keep = groups >= 0
+        wands = self.sketches.merge_groups(groups, pd.RangeIndex(len(result)), list(dimensions), groups=cells).counts()
+        result['Wand Count'] = wands.to_numpy()
+        result['Event Count'] = np.bincount(groups[keep], weights=self._event_counts[cells[keep]],
+                                            minlength=len(result)).astype(np.int64)
+        result['Events/Wand'] = (result['Event Count'] / result['Wand Count']).round(3)
+
+        with self._lock:
+            self._rollups[key] = result
+            self._rollups.move_to_end(key)
+            if len(self._rollups) > self.max_rollups:
+                self._rollups.popitem(last=False)
+        return result.copy()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the activity summary cube from the raw event log.')
+    parser.add_argument('--data', default=os.path.join('data', 'nwu_inference_slim.csv'), help='raw event log or ingest store')
+    parser.add_argument('--out', default=CUBE_PATH, help='cube file')
+    args = parser.parse_args(argv)
+
+    version = source_version(args.data)
+    cube = SummaryCube.from_events(read_source(args.data))
+    cube.save(args.out, source=args.data, version=version)
+    print(f'{len(cube.cells)} cells over {", ".join(cube.dimensions)} written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#######################
+# Pre-rendered SVG pages served as static assets
+#
+# Every page in data/SVGs_ObjectDetection is rendered as a Wand Count heat
+# map once per colour theme by a pool of worker processes and written to
+# static/svg/ under a content-hashed name, so browsers can cache each file
+# for good and identical renders share one file. A manifest maps (page,
+# theme) to the file and records the page and label data versions it was
+# rendered from; the SVG tab links to the file through Streamlit's static
+# serving (app/static/) and only renders in-process when the manifest is
+# missing or stale.
+#
+# Usage:
+#   python svg_assets.py --workers 4
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import data_loader
+import svg_heatmap
+
+STATIC_DIR = 'static'
+ASSET_DIR = os.path.join(STATIC_DIR, 'svg')
+MANIFEST_PATH = os.path.join(ASSET_DIR, 'manifest.json')
+STATIC_URL = 'app/static'
+
+LABEL_DATA = os.path.join('data', 'action_inference.csv')
+
+COLOR_THEMES = ['blues', 'cividis', 'greens', 'inferno', 'magma', 'plasma', 'reds', 'rainbow', 'turbo', 'viridis']
+
+
+def load_label_index(path=LABEL_DATA):
+    return svg_heatmap.LabelIndex(svg_heatmap.label_counts(data_loader.load_csv_cached(path)))
+
+
+def render_themed(svg_path, theme, index):
+    """Returns the SVG bytes of a page as shown in the dashboard for a theme."""
+    root = svg_heatmap.load_template(svg_path)
+    svg_heatmap.recolour(root, index, theme)
+    return svg_heatmap.to_bytes(root)
+
+
+def asset_name(svg_path, data):
+    """Returns the content-hashed file name of a rendered page."""
+    stem = os.path.splitext(os.path.basename(svg_path))[0]
+    return f'{stem}-{hashlib.sha1(data).hexdigest()[:12]}.svg'
+
+
+_worker_index = None
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _write_asset(job):
+    svg_path, theme, out_dir = job
+    data = render_themed(svg_path, theme, _worker_index)
+    name = asset_name(svg_path, data)
+    path = os.path.join(out_dir, name)
+    if not os.path.exists(path):
+        tmp = path + f'.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return svg_path, theme, name
+
+
+def source_version(svg_path):
+    return os.stat(svg_path).st_mtime_ns
+
+
+def prerender(svg_paths, index, data_version, themes=COLOR_THEMES, out_dir=ASSET_DIR, workers=1):
+    """Renders every page for every theme into out_dir and writes the manifest.
+
+    data_version identifies the label counts behind index. Files no longer
+    referenced by the manifest are removed. Returns the manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(path, theme, out_dir) for path in svg_paths for theme in themes]
+    if workers <= 1:
+        _init_worker(index)
+        results = [_write_asset(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index,)) as pool:
+            results = list(pool.map(_write_asset, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+    manifest = {'pages': {}, 'sources': {path: source_version(path) for path in svg_paths},
+                'data': list(data_version)}
+    for svg_path, theme, name in results:
+        manifest['pages'].setdefault(svg_path, {})[theme] = name
+    manifest_path = os.path.join(out_dir, os.path.basename(MANIFEST_PATH))
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_path)
+
+    kept = {name for themes in manifest['pages'].values() for name in themes.values()}
+    for name in os.listdir(out_dir):
+        if name.endswith('.svg') and name not in kept:
+            os.remove(os.path.join(out_dir, name))
+    return manifest
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Returns the manifest written by prerender, or None when there is none."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def asset_url(manifest, svg_path, theme, data_version):
+    """Returns the static URL of a pre-rendered page, or None when it is missing or stale."""
+    if manifest is None or manifest.get('data') != list(data_version):
+        return None
+    name = manifest['pages'].get(svg_path, {}).get(theme)
+    if name is None or manifest['sources'].get(svg_path) != source_version(svg_path):
+        return None
+    return f'{STATIC_URL}/svg/{name}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-render the SVG pages for every colour theme into the static directory.')
+    parser.add_argument('--data', default=LABEL_DATA, help='aggregated action log with the label counts')
+    parser.add_argument('--svg-dir', default=svg_heatmap.SVG_DIR, help='directory with the source pages')
+    parser.add_argument('--pattern', default='*.svg', help='glob of source pages inside --svg-dir')
+    parser.add_argument('--out-dir', default=ASSET_DIR, help='static asset directory')
+    parser.add_argument('--themes', nargs='+', default=COLOR_THEMES, help='colour themes to render')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    args = parser.parse_args(argv)
+
+    svg_paths = sorted(glob.glob(os.path.join(args.svg_dir, args.pattern)))
+    index = load_label_index(args.data)
+    manifest = prerender(svg_paths, index, data_loader.file_version(args.data), args.themes, args.out_dir, args.workers)
+    files = {name for themes in manifest['pages'].values() for name in themes.values()}
+    print(f'{len(svg_paths)} pages x {len(args.themes)} themes, {len(files)} files in {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#######################
+# Heat maps for the object-detection SVG pages
+#
+# Each page in data/SVGs_ObjectDetection has a <g id="labels"> group whose
+# <rect> ids are the labels reported in the activity_inference action data.
+# The Wand Count per label is looked up in a LabelIndex built once from
+# the action log, and every page is recoloured in a single pass with a
+# colour scale normalized over the page's labels (see colour_scale.py).
+#
+# Usage:
+#   python svg_heatmap.py --workers 4 --scheme reds
+
+import argparse
+import base64
+import bisect
+import copy
+import functools
+import glob
+import os
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import colour_scale
+import data_loader
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+
+SVG_DIR = os.path.join('data', 'SVGs_ObjectDetection')
+OUTPUT_PREFIX = 'opg1_red_rgb_'
+DEFAULT_SCHEME = 'reds'
+
+# Labels are matched where a word starts inside the action data, e.g. after
+# the quote in {"l":"alz_p0405_txt_w01_aliens"}.
+_WORD_START = re.compile(r'(?<![A-Za-z0-9_])[A-Za-z0-9_]')
+
+
+def label_counts(actions, like='alz'):
+    """Returns Wand Count per activity_inference action_data containing like."""
+    inference = actions.loc[actions['action'] == 'activity_inference', ['action_data', 'Wand Count']]
+    counts = inference.groupby(by='action_data', observed=True)['Wand Count'].sum()
+    counts.index = counts.index.astype(str)
+    return counts[counts.index.str.contains(like, regex=False)]
+
+
+class LabelIndex:
+    """Maps SVG label ids to the count of the first action data containing them.
+
+    Every word-start suffix of every action data value is kept in one sorted
+    list, so a label resolves with a binary search instead of a scan over
+    all values. Ties go to the smallest action data, like
+    ``counts.filter(like=label).values[0]`` on a sorted index.
+    """
+
+    def __init__(self, counts):
+        counts = counts.sort_index()
+        self._values = counts.to_numpy()
+        entries = sorted(
+            (value[m.start():], rank)
+            for rank, value in enumerate(counts.index)
+            for m in _WORD_START.finditer(value)
+        )
+        self._suffixes = [suffix for suffix, _ in entries]
+        self._ranks = np.array([rank for _, rank in entries], dtype=np.intp)
+
+    def __len__(self):
+        return len(self._values)
+
+    def lookup(self, label):
+        """Returns the count for a label id, or None when no action data has it."""
+        lo = bisect.bisect_left(self._suffixes, label)
+        hi = bisect.bisect_left(self._suffixes, label + '\U0010ffff', lo)
+        if lo == hi:
+            return None
+        return self._values[self._ranks[lo:hi].min()].item()
+
+
+def label_rects(root):
+    """Yields the <rect> elements of the labels group of a parsed page."""
+    for child in root:
+        if child.attrib.get('id') == 'labels':
+            yield from child
+
+
+def recolour(root, index, scheme=DEFAULT_SCHEME, log=False):
+    """Applies the heat-map fill to every label of a parsed page in place.
+
+    Labels without a count keep their style.
+    """
+    rects = list(label_rects(root))
+    values = np.array([index.lookup(rect.attrib.get('id', '')) for rect in rects], dtype=np.float64)
+    for rect, style in zip(rects, colour_scale.fill_styles(values, scheme, log=log)):
+        rect.attrib['class'] = 'cls-2'
+        if style is not None:
+            rect.attrib['style'] = style
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_template(svg_path, mtime_ns):
+    return ET.parse(svg_path).getroot()
+
+
+def load_template(svg_path):
+    """Returns a private copy of a parsed page; each file version is parsed once."""
+    return copy.deepcopy(_parse_template(svg_path, os.stat(svg_path).st_mtime_ns))
+
+
+def to_bytes(root):
+    """Serializes a page to UTF-8 SVG bytes."""
+    return ET.tostring(root, encoding='utf-8')
+
+
+def to_base64(root):
+    """Serializes a page to the base64 payload of a data:image/svg+xml URI."""
+    return base64.b64encode(to_bytes(root)).decode('utf-8')
+
+
+def render_page(svg_path, out_path, index, scheme=DEFAULT_SCHEME):
+    tree = ET.parse(svg_path)
+    recolour(tree.getroot(), index, scheme)
+    tree.write(out_path)
+    return out_path
+
+
+_worker_index = None
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _render_worker(job):
+    return render_page(job[0], job[1], _worker_index, job[2])
+
+
+def render_pages(svg_paths, out_dir, index, prefix=OUTPUT_PREFIX, workers=1, scheme=DEFAULT_SCHEME):
+    """Renders every page to out_dir/<prefix><name> and returns the output paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(path, os.path.join(out_dir, prefix + os.path.basename(path)), scheme) for path in svg_paths]
+    if workers <= 1:
+        return [render_page(src, dst, index, scheme) for src, dst, scheme in jobs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index,)) as pool:
+        return list(pool.map(_render_worker, jobs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recolour the object-detection SVG pages by Wand Count.')
+    parser.add_argument('--data', default=os.path.join('data', 'action_inference.csv'), help='aggregated action log')
+    parser.add_argument('--svg-dir', default=SVG_DIR, help='directory with the source pages')
+    parser.add_argument('--pattern', default='alz_*.svg', help='glob of source pages inside --svg-dir')
+    parser.add_argument('--out-dir', default=None, help='output directory (default: --svg-dir)')
+    parser.add_argument('--prefix', default=OUTPUT_PREFIX, help='output file name prefix')
+    parser.add_argument('--like', default='alz', help='only use action data containing this text')
+    parser.add_argument('--scheme', default=DEFAULT_SCHEME, choices=sorted(colour_scale.COLORMAPS), help='colour scheme')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    args = parser.parse_args(argv)
+
+    index = LabelIndex(label_counts(data_loader.load_csv_cached(args.data), like=args.like))
+    svg_paths = sorted(glob.glob(os.path.join(args.svg_dir, args.pattern)))
+    outputs = render_pages(svg_paths, args.out_dir or args.svg_dir, index, prefix=args.prefix,
+                           workers=args.workers, scheme=args.scheme)
+    print(f'{len(outputs)} pages written, {len(index)} labelled action data values')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+#######################
+# Device-health telemetry tiles
+#
+# The kc_*, wifi_* and wand_sleep events are rolled up in one vectorized
+# pass into hourly tiles per wand: download completions and errors, OTA
+# starts, errors and completions, firmware errors, Wi-Fi connects and
+# disconnects, boots (and crash reboots), and sleep count and duration (the
+# time from a wand_sleep to that wand's next event; a wand_sleep that is the
+# wand's last event has no duration yet and is not counted). Any time range
+# is then answered by summing tiles instead of rescanning the raw events.
+# Like the summary cube, the tiles file records the source and version it
+# was built from, so the app only reads it while it is current.
+# TelemetryCounts keeps tiles up to date with appended events: each batch
+# adds its own tiles, and a sleep that ended the wand's earlier events is
+# counted once the wand's next event arrives.
+#
+# Usage:
+#   python telemetry.py --data data/nwu_inference_slim.csv
+#   python telemetry.py --data data/store
+
+import argparse
+import json
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import data_loader
+import summary_cube
+from distinct_counts import factorize_groups
+
+TILES_PATH = os.path.join('data', 'telemetry_tiles.parquet')
+KEY_COLUMN = 'event_id'
+SOURCE_KEY = b'telemetry_tiles_source'
+TIMESTAMP_COLUMN = 'created_at'
+WINDOW = 'h'
+
+COUNTERS = ['dl_complete', 'dl_error', 'ota_start', 'ota_error', 'ota_end', 'kc_error',
+            'wifi_connect', 'wifi_disconnect', 'boots', 'crash_boots', 'sleeps', 'sleep_seconds']
+CRASH_REASONS = ('panic', 'watchdog', 'brownout')
+# kc_file_dl_percent carries either the bare percentage or JSON with "pct"
+DOWNLOAD_COMPLETE = re.compile(r'^\s*100(\.0*)?\s*$|"pct":\s*100\b')
+
+
+def _action_data_flags(events, action, predicate):
+    """Returns rows of action whose action_data satisfies predicate, testing each distinct value once."""
+    is_action = (events['action'] == action).to_numpy()
+    values = events['action_data'].astype('category')
+    matches = np.array([bool(predicate(str(v))) for v in values.cat.categories], dtype=bool)
+    codes = values.cat.codes.to_numpy()
+    return is_action & (codes >= 0) & matches[np.maximum(codes, 0)]
+
+
+def _next_event_seconds(events, times):
+    """Returns, for every row, the seconds until the same wand's next event and whether there is one."""
+    wands, _ = factorize_groups(events, 'wand_identifier')
+    order = np.lexsort((times, wands))
+    sorted_times = times[order]
+    gap = np.zeros(len(order))
+    followed = np.zeros(len(order), dtype=bool)
+    followed[:-1] = (wands[order][1:] == wands[order][:-1]) & (wands[order][1:] >= 0) & ~np.isnat(sorted_times[1:])
+    gap[:-1] = np.where(followed[:-1], (sorted_times[1:] - sorted_times[:-1]) / np.timedelta64(1, 's'), 0)
+    seconds = np.zeros(len(order))
+    seconds[order] = gap
+    has_next = np.zeros(len(order), dtype=bool)
+    has_next[order] = followed
+    return seconds, has_next
+
+
+def _to_tiles(wands, times, counters, window=WINDOW):
+    """Returns the sums of per-row counters per (wand, window of the row's time)."""
+    keys = pd.DataFrame({'wand_identifier': wands, 'window': pd.DatetimeIndex(times).floor(window)})
+    codes, index = factorize_groups(keys, ['wand_identifier', 'window'])
+    keep = codes >= 0
+    tiles = pd.DataFrame({
+        name: np.bincount(codes[keep], weights=counters[name][keep], minlength=len(index))
+        for name in COUNTERS
+    }, index=index).reset_index()
+    tiles = tiles.astype({name: np.int64 for name in COUNTERS if name != 'sleep_seconds'})
+    return data_loader.as_categories(tiles, ['wand_identifier'])
+
+
+def build_tiles(events, window=WINDOW):
+    """Returns one row per (wand, window) with telemetry, holding every counter."""
+    return _build(events, window)[0]
+
+
+def _build(events, window):
+    """Returns the tiles of events and the time of every wand's last event when it is a wand_sleep."""
+    times = pd.to_datetime(events[TIMESTAMP_COLUMN]).to_numpy()
+    action = events['action']
+    counters = {
+        'dl_complete': _action_data_flags(events, 'kc_file_dl_percent', DOWNLOAD_COMPLETE.search),
+        'dl_error': (action == 'kc_file_dl_error').to_numpy(),
+        'ota_start': (action == 'kc_ota_start').to_numpy(),
+        'ota_error': (action == 'kc_ota_error').to_numpy(),
+        'ota_end': (action == 'kc_ota_end').to_numpy(),
+        'kc_error': (action == 'kc_error').to_numpy(),
+        'wifi_connect': (action == 'wifi_connect').to_numpy(),
+        'wifi_disconnect': (action == 'wifi_disconnect').to_numpy(),
+        'boots': (action == 'kc_boot').to_numpy(),
+        'crash_boots': _action_data_flags(events, 'kc_boot', lambda v: any(r in v.lower() for r in CRASH_REASONS)),
+    }
+    seconds, has_next = _next_event_seconds(events, times)
+    is_sleep = (action == 'wand_sleep').to_numpy()
+    counters['sleeps'] = is_sleep & has_next
+    counters['sleep_seconds'] = np.where(counters['sleeps'], seconds, 0)
+
+    wands = events['wand_identifier'].to_numpy()
+    telemetry = np.logical_or.reduce([counters[c] for c in COUNTERS if c != 'sleep_seconds']) & ~pd.isna(times)
+    rows = np.flatnonzero(telemetry)
+    tiles = _to_tiles(wands[rows], times[rows], {name: counters[name][rows] for name in COUNTERS}, window)
+    trailing = np.flatnonzero(is_sleep & ~has_next & ~pd.isna(times) & events['wand_identifier'].notna().to_numpy())
+    return tiles, pd.Series(times[trailing], index=pd.Index(wands[trailing], dtype=object))
+
+
+def health(totals):
+    """Adds the derived rates to summed counters (a frame or a Series)."""
+    totals = totals.copy()
+    totals['dl_success_rate'] = totals['dl_complete'] / (totals['dl_complete'] + totals['dl_error'])
+    totals['ota_failure_rate'] = totals['ota_error'] / totals['ota_start']
+    totals['wifi_flaps'] = totals['wifi_disconnect']
+    totals['mean_sleep_seconds'] = totals['sleep_seconds'] / totals['sleeps']
+    return totals.replace([np.inf, -np.inf], np.nan)
+
+
+class TelemetryTiles:
+    """Hourly per-wand telemetry tiles, summed over any time range."""
+
+    def __init__(self, tiles):
+        self.tiles = tiles.sort_values('window', kind='stable').reset_index(drop=True)
+        self._windows = self.tiles['window'].to_numpy()
+
+    @classmethod
+    def from_events(cls, events):
+        return cls(build_tiles(events))
+
+    @classmethod
+    def load(cls, path=TILES_PATH):
+        return cls(pd.read_parquet(path))
+
+    def save(self, path=TILES_PATH, source=None, version=None):
+        """Writes the tiles, recording the source and version they were built from."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        table = pa.Table.from_pandas(self.tiles, preserve_index=False)
+        if source is not None:
+            recorded = json.dumps({'source': source, 'version': version})
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), SOURCE_KEY: recorded})
+        tmp = path + '.tmp'
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+
+    def span(self):
+        """Returns the first and last window, or (None, None) without telemetry."""
+        if not len(self._windows):
+            return None, None
+        return pd.Timestamp(self._windows[0]), pd.Timestamp(self._windows[-1])
+
+    def _range(self, start, end):
+        lo = 0 if start is None else np.searchsorted(self._windows, np.datetime64(pd.Timestamp(start)), side='left')
+        hi = len(self._windows) if end is None else np.searchsorted(self._windows, np.datetime64(pd.Timestamp(end)), side='left')
+        return self.tiles.iloc[lo:hi]
+
+    def fleet(self, start=None, end=None):
+        """Returns the fleet-wide counters and rates of windows in [start, end)."""
+        tiles = self._range(start, end)
+        totals = tiles[COUNTERS].sum()
+        totals['wands'] = tiles['wand_identifier'].nunique()
+        return health(totals)
+
+    def by_wand(self, start=None, end=None):
+        """Returns per-wand counters and rates of windows in [start, end)."""
+        tiles = self._range(start, end)
+        return health(tiles.groupby('wand_identifier', observed=True)[COUNTERS].sum())
+
+    def over_time(self, start=None, end=None, freq='D'):
+        """Returns fleet counters and rates per freq period of windows in [start, end)."""
+        tiles = self._range(start, end)
+        return health(tiles.groupby(tiles['window'].dt.floor(freq))[COUNTERS].sum())
+
+
+class TelemetryCounts:
+    """Telemetry tiles of the whole fleet, topped up with the events past a watermark.
+
+    Readers take the same lock as updates; snapshot() hands out
+    TelemetryTiles that later updates leave alone.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.tiles = build_tiles(pd.DataFrame({TIMESTAMP_COLUMN: [], 'action': [], 'action_data': [], 'wand_identifier': []}))
+        self._open_sleeps = pd.Series([], index=pd.Index([], dtype=object), dtype='datetime64[ns]')
+        self.watermark = None
+
+    def update(self, events):
+        """Adds a batch of events that all follow the ones already counted."""
+        if not len(events):
+            return
+        tiles, open_sleeps = _build(events, self.window)
+        times = pd.Series(pd.to_datetime(events[TIMESTAMP_COLUMN]).to_numpy(),
+                          index=pd.Index(events['wand_identifier'].to_numpy(), dtype=object))
+        first = times[times.notna() & times.index.notna()].groupby(level=0).min()
+        with self._lock:
+            # Sleeps that ended the wand's earlier events last until its first event here
+            closed = self._open_sleeps.index.intersection(first.index)
+            if len(closed):
+                start = self._open_sleeps[closed].to_numpy()
+                counters = {name: np.zeros(len(closed)) for name in COUNTERS}
+                counters['sleeps'] = np.ones(len(closed))
+                counters['sleep_seconds'] = (first[closed].to_numpy() - start) / np.timedelta64(1, 's')
+                tiles = pd.concat([tiles, _to_tiles(closed.to_numpy(), start, counters, self.window)], ignore_index=True)
+            self._open_sleeps = pd.concat([self._open_sleeps.drop(first.index, errors='ignore'), open_sleeps])
+            tiles = pd.concat([self.tiles, tiles], ignore_index=True)
+            tiles = tiles.groupby(['wand_identifier', 'window'], observed=True)[COUNTERS].sum().reset_index()
+            self.tiles = data_loader.as_categories(tiles, ['wand_identifier'])
+            batch_max = int(events[KEY_COLUMN].max())
+            self.watermark = batch_max if self.watermark is None else max(self.watermark, batch_max)
+
+    def update_from(self, df):
+        """Counts the rows of df past the watermark; starts over when df no longer extends it."""
+        with self._lock:
+            if self.watermark is not None and len(df) and int(df[KEY_COLUMN].max()) < self.watermark:
+                self._reset()
+            if self.watermark is None:
+                self.update(df)
+            else:
+                self.update(df[df[KEY_COLUMN] > self.watermark])
+        return self
+
+    def snapshot(self, df):
+        """Counts the rows of df past the watermark and returns the tiles so far."""
+        with self._lock:
+            self.update_from(df)
+            return TelemetryTiles(self.tiles)
+
+
+def is_current(path=TILES_PATH, source=None):
+    """Tells whether a tiles file was built from the current version of its source (or of source)."""
+    return summary_cube.is_current(path, source, SOURCE_KEY)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the hourly device-health telemetry tiles from the raw event log.')
+    parser.add_argument('--data', default=os.path.join('data', 'nwu_inference_slim.csv'), help='raw event log or ingest store')
+    parser.add_argument('--out', default=TILES_PATH, help='tiles file')
+    args = parser.parse_args(argv)
+
+    version = summary_cube.source_version(args.data)
+    tiles = TelemetryTiles.from_events(summary_cube.read_source(args.data))
+    tiles.save(args.out, source=args.data, version=version)
+    start, end = tiles.span()
+    print(f'{len(tiles.tiles)} tiles from {start} to {end} written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+import distinct_counts
+
+
+def expected(df, by):
+    return df.groupby(by=by, observed=True).nunique().astype('int64')
+
+
+def events(rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    wands = np.array([f'W{i:03d}' for i in range(40)], dtype=object)
+    actions = np.array(['Start', 'Stop', 'Cast', 'Pause'], dtype=object)
+    return pd.DataFrame({
+        'activity_id': rng.choice(np.array(['A1', 'A2', 'A3', 'A4', 'A5'], dtype=object), rows),
+        'wand_identifier': rng.choice(wands, rows),
+        'action': rng.choice(actions, rows),
+        'event_id': rng.integers(0, 100_000, rows),
+    })
+
+
+def test_matches_pandas():
+    df = events()
+    tm.assert_frame_equal(distinct_counts.grouped_nunique(df, 'activity_id'), expected(df, 'activity_id'))
+
+
+def test_categorical_columns():
+    df = events(seed=1)
+    df = df.astype({'activity_id': 'category', 'wand_identifier': 'category', 'action': 'category'})
+    result = distinct_counts.grouped_nunique(df, 'activity_id')
+    tm.assert_frame_equal(result, expected(df, 'activity_id'), check_index_type=False)
+
+
+def test_missing_values():
+    df = events(seed=2)
+    rng = np.random.default_rng(3)
+    for column in df.columns:
+        df[column] = df[column].where(rng.random(len(df)) > 0.1)
+    result = distinct_counts.grouped_nunique(df, 'activity_id')
+    tm.assert_frame_equal(result, expected(df, 'activity_id'))
+
+
+def test_empty_groups():
+    df = pd.DataFrame({
+        'activity_id': pd.Categorical(['A1', 'A1', 'A3', 'A3'], categories=['A0', 'A1', 'A2', 'A3']),
+        'wand_identifier': pd.Categorical([None, None, 'W1', 'W2'], categories=['W0', 'W1', 'W2']),
+        'action': [np.nan, np.nan, 'Start', 'Start'],
+    })
+    result = distinct_counts.grouped_nunique(df, 'activity_id')
+    tm.assert_frame_equal(result, expected(df, 'activity_id'), check_index_type=False)
+    assert result.loc['A1'].tolist() == [0, 0]
+
+
+@pytest.mark.parametrize('bitmap_max_cells', [0, distinct_counts.BITMAP_MAX_CELLS])
+def test_sort_and_bitmap_paths(monkeypatch, bitmap_max_cells):
+    monkeypatch.setattr(distinct_counts, 'BITMAP_MAX_CELLS', bitmap_max_cells)
+    df = events(rows=5000, seed=4)
+    tm.assert_frame_equal(distinct_counts.grouped_nunique(df, 'wand_identifier'), expected(df, 'wand_identifier'))
+
+
+def test_empty_frame():
+    df = events().iloc[:0]
+    result = distinct_counts.grouped_nunique(df, 'activity_id')
+    assert result.empty
+    assert list(result.columns) == ['wand_identifier', 'action', 'event_id']
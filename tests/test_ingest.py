@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+
+import compact
+import ingest
+
+COLUMNS = ['event_id', 'wand_identifier', 'session_id', 'activity_id', 'action', 'action_data', 'headphone_state', 'created_at']
+
+
+def events(rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp('2024-03-01') + pd.to_timedelta(np.sort(rng.integers(0, 3 * 86400, rows)), unit='s')
+    return pd.DataFrame({
+        'event_id': np.arange(rows),
+        'wand_identifier': rng.choice(np.array([f'MW-{i:04d}' for i in range(30)], dtype=object), rows),
+        'session_id': rng.integers(0, 5, rows),
+        'activity_id': rng.choice(np.array(['AFG_P2223', 'ALZ_P0405', 'ALZ_C1'], dtype=object), rows),
+        'action': rng.choice(np.array(['wand_sleep', 'wand_cast', 'wand_activity_end'], dtype=object), rows),
+        'action_data': rng.choice(np.array(['alz_c1_one', 'alz_p0000_x', None], dtype=object), rows),
+        'headphone_state': rng.integers(0, 2, rows),
+        'created_at': times.strftime('%Y-%m-%d %H:%M:%S'),
+    })[COLUMNS]
+
+
+def durations(rows=300, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'wand_identifier': rng.choice(np.array(['MW-A', 'MW-B', 'MW-C'], dtype=object), rows),
+        'session_id': rng.integers(0, 4, rows),
+        'activity_session_id': rng.integers(0, 50, rows),
+        'activity_id': rng.choice(np.array(['ALZ_P0000', 'ALZ_Story_Activity'], dtype=object), rows),
+        'seconds': rng.integers(1, 600, rows),
+    })
+    return df.drop_duplicates(ingest.DURATION_KEYS).sort_values(ingest.DURATION_KEYS, ignore_index=True)
+
+
+def export(df, path):
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def plain(df, columns):
+    return df[columns].astype(str).reset_index(drop=True)
+
+
+def test_appends_only_new_rows(tmp_path):
+    df = events()
+    store = ingest.EventStore(str(tmp_path / 'store'))
+    assert store.ingest_file(export(df.iloc[:1200], tmp_path / 'events.csv')) == 1200
+    assert store.ingest_file(str(tmp_path / 'events.csv')) == 0
+    # A later export repeats the rows already ingested
+    assert store.ingest_file(export(df, tmp_path / 'events_2.csv')) == 800
+    loaded = store.load().sort_values('event_id', ignore_index=True)
+    tm.assert_frame_equal(plain(loaded, ['event_id', 'wand_identifier', 'action']),
+                          plain(df, ['event_id', 'wand_identifier', 'action']))
+    assert store.version() == 2
+
+
+def test_empty_export(tmp_path):
+    store = ingest.EventStore(str(tmp_path / 'store'))
+    assert store.ingest_file(export(events().iloc[:0], tmp_path / 'events.csv')) == 0
+    assert store.exists()
+    assert not store.has_events()
+    loaded = store.load()
+    assert loaded.empty
+    assert list(loaded.columns) == list(compact.SCHEMAS['nwu_inference'])
+    assert store.summary().empty
+
+
+def test_summary_matches_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'SUMMARY_DELTAS', 3)
+    df = events(seed=1)
+    store = ingest.EventStore(str(tmp_path / 'store'))
+    for i, stop in enumerate(range(250, len(df) + 1, 250)):
+        store.ingest_file(export(df.iloc[:stop], tmp_path / f'events_{i}.csv'))
+    summary = store.summary()
+    keys = ingest.SUMMARY_KEYS
+    expected = df.groupby(keys, dropna=False).size().rename('Event Count').reset_index()
+    tm.assert_frame_equal(plain(summary.sort_values(keys), keys + ['Event Count']),
+                          plain(expected.sort_values(keys), keys + ['Event Count']))
+    # Older deltas were merged and removed
+    assert len(list((tmp_path / 'store' / 'summary').iterdir())) <= 2 * ingest.SUMMARY_DELTAS
+
+
+def test_store_log_reads_new_parts(tmp_path):
+    df = events(seed=2)
+    store = ingest.EventStore(str(tmp_path / 'store'))
+    log = ingest.StoreLog(store)
+    for i, stop in enumerate([700, 1500, 2000]):
+        store.ingest_file(export(df.iloc[:stop], tmp_path / f'events_{i}.csv'))
+        first = log.load()
+        tm.assert_frame_equal(first, store.load())
+    assert log.load() is first
+
+
+def test_durations_after_watermarks(tmp_path):
+    df = durations()
+    store = ingest.EventStore(str(tmp_path / 'store'))
+    earlier = df.groupby('wand_identifier').head(20)
+    assert store.ingest_durations(export(earlier, tmp_path / 'activity_durations_1.csv')) == len(earlier)
+    # The next export holds every session; only the ones after each wand's last ingested one are new
+    last = earlier.groupby('wand_identifier').tail(1).set_index('wand_identifier')[ingest.DURATION_KEYS[1:]]
+    after = df.apply(lambda row: tuple(row[ingest.DURATION_KEYS[1:]]) > tuple(last.loc[row['wand_identifier']]), axis=1)
+    assert store.ingest_durations(export(df, tmp_path / 'activity_durations_2.csv')) == after.sum()
+    assert store.ingest_durations(str(tmp_path / 'activity_durations_2.csv')) == 0
+    assert len(store.durations_parts()) == 2
+    loaded = store.load_durations().sort_values(ingest.DURATION_KEYS, ignore_index=True)
+    expected = pd.concat([earlier, df[after]]).sort_values(ingest.DURATION_KEYS, ignore_index=True)
+    tm.assert_frame_equal(plain(loaded, list(df.columns)), plain(expected, list(df.columns)))
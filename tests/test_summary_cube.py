@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from summary_cube import SummaryCube
+
+DIMENSIONS = ['activity_id', 'action', 'action_data']
+
+
+def events(rows=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    action_data = rng.choice(np.array(['alz_c1', 'alz_c4', 'alz_p0000', None], dtype=object), rows)
+    return pd.DataFrame({
+        'event_id': np.arange(rows),
+        'activity_id': rng.choice(np.array(['A1', 'A2', 'A3'], dtype=object), rows),
+        'action': rng.choice(np.array(['wand_sleep', 'wand_cast', 'wand_activity_end'], dtype=object), rows),
+        'action_data': action_data,
+        'wand_identifier': rng.choice(np.array([f'W{i:03d}' for i in range(60)], dtype=object), rows),
+    })
+
+
+def expected(df, by, dropna=True):
+    grouped = df.groupby(by, dropna=dropna)
+    result = pd.DataFrame({'Wand Count': grouped['wand_identifier'].nunique(), 'Event Count': grouped.size()})
+    return result.reset_index().astype({c: str for c in by}).sort_values(by, ignore_index=True)
+
+
+def rolled(cube, by, **kwargs):
+    result = cube.rollup(by, **kwargs)[by + ['Wand Count', 'Event Count']]
+    return result.astype({c: str for c in by}).astype({'Event Count': 'int64'}).sort_values(by, ignore_index=True)
+
+
+@pytest.mark.parametrize('by', [['activity_id'], ['activity_id', 'action'], DIMENSIONS])
+def test_rollup_matches_pandas(by):
+    df = events()
+    # Sketch counts of a few dozen wands are exact
+    tm.assert_frame_equal(rolled(SummaryCube.from_events(df, DIMENSIONS), by), expected(df, by), check_dtype=False)
+
+
+def test_rollup_filters():
+    df = events(seed=1)
+    cube = SummaryCube.from_events(df, DIMENSIONS)
+    selected = df[(df['activity_id'] == 'A2') & (df['action'] == 'wand_cast')]
+    tm.assert_frame_equal(rolled(cube, ['action_data'], activity_id='A2', action='wand_cast'),
+                          expected(selected, ['action_data']), check_dtype=False)
+    assert cube.rollup(['action_data'], activity_id='A9').empty
+
+
+def test_rollup_keeps_missing_values():
+    df = events(seed=2)
+    cube = SummaryCube.from_events(df, DIMENSIONS)
+    result = rolled(cube, ['action_data'], dropna=False)
+    tm.assert_frame_equal(result, expected(df, ['action_data'], dropna=False), check_dtype=False)
+    assert result['Event Count'].sum() == len(df)
+    assert cube.rollup(['action_data'])['Event Count'].sum() == df['action_data'].notna().sum()
+
+
+def test_totals():
+    df = events(seed=3)
+    totals = SummaryCube.from_events(df, DIMENSIONS).rollup()
+    assert totals['Event Count'].tolist() == [len(df)]
+    assert totals['Wand Count'].tolist() == [df['wand_identifier'].nunique()]
+
+
+def test_batch_cubes_read_together(tmp_path):
+    df = events(seed=4)
+    paths = []
+    for i, start in enumerate(range(0, len(df), 800)):
+        paths.append(str(tmp_path / f'delta-{i}.parquet'))
+        SummaryCube.from_events(df.iloc[start:start + 800], DIMENSIONS).save(paths[-1])
+    cube = SummaryCube.load(paths)
+    compacted = cube.compacted()
+    assert len(compacted.cells) == len(SummaryCube.from_events(df, DIMENSIONS).cells)
+    for loaded in (cube, compacted):
+        tm.assert_frame_equal(rolled(loaded, DIMENSIONS, dropna=False), expected(df, DIMENSIONS, dropna=False),
+                              check_dtype=False)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from transitions import TransitionMatrix
+
+ACTIVITIES = ['A1', 'A2', 'A3', 'A4']
+
+
+def events(rows=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    actions = np.array(['wand_cast', 'wand_sleep', 'wand_activity_end', 'activity_back_button'], dtype=object)
+    return pd.DataFrame({
+        'event_id': np.arange(rows),
+        'wand_identifier': rng.choice(np.array([f'W{i:02d}' for i in range(20)], dtype=object), rows),
+        'session_id': rng.integers(0, 4, rows),
+        'activity_id': rng.choice(np.array(ACTIVITIES, dtype=object), rows),
+        'action': rng.choice(actions, rows, p=[0.7, 0.2, 0.05, 0.05]),
+    })
+
+
+def assert_same(incremental, full):
+    tm.assert_frame_equal(incremental.to_frame().sort_values(['from', 'to'], ignore_index=True),
+                          full.to_frame().sort_values(['from', 'to'], ignore_index=True))
+    tm.assert_frame_equal(incremental.drop_offs().sort_index(), full.drop_offs().sort_index())
+    tm.assert_frame_equal(incremental.funnel(ACTIVITIES[:3]), full.funnel(ACTIVITIES[:3]))
+    assert incremental.watermark == full.watermark
+
+
+@pytest.mark.parametrize('batches', [2, 7])
+def test_incremental_matches_full(batches):
+    df = events()
+    matrix = TransitionMatrix()
+    for stop in np.linspace(0, len(df), batches + 1).astype(int)[1:]:
+        matrix.update_from(df.iloc[:stop])
+    assert_same(matrix, TransitionMatrix().update_from(df))
+
+
+def test_batch_boundary_inside_a_step():
+    # The second batch continues the activity the first one ended on
+    df = pd.DataFrame({
+        'event_id': np.arange(6),
+        'wand_identifier': ['W1'] * 6,
+        'session_id': [1] * 6,
+        'activity_id': ['A1', 'A2', 'A2', 'A2', 'A3', 'A1'],
+        'action': ['wand_cast'] * 6,
+    })
+    matrix = TransitionMatrix()
+    matrix.update_from(df.iloc[:2])
+    matrix.update_from(df)
+    full = TransitionMatrix().update_from(df)
+    assert_same(matrix, full)
+    assert full.to_frame()['count'].sum() == 3
+
+
+def test_snapshot_is_not_updated():
+    df = events(seed=1)
+    matrix = TransitionMatrix()
+    snapshot = matrix.snapshot(df.iloc[:1000])
+    before = snapshot.to_frame()
+    matrix.update_from(df)
+    tm.assert_frame_equal(snapshot.to_frame(), before)
+    assert snapshot.watermark == 999
+
+
+def test_restarts_when_log_shrinks():
+    df = events(seed=2)
+    matrix = TransitionMatrix().update_from(df)
+    matrix.update_from(df.iloc[:500])
+    assert_same(matrix, TransitionMatrix().update_from(df.iloc[:500]))
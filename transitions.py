@@ -0,0 +1,167 @@
+#######################
+# Fleet-wide activity transitions and funnels
+#
+# Events are collapsed into activity steps per (wand, session) (see
+# journeys.py) and consecutive steps are counted in a sparse
+# activity x activity matrix. The matrix is updated incrementally: each new
+# batch only adds its own transitions, plus the one joining a session's
+# last known step to its first new step. The last step of every session
+# gives the drop-off counts, and the step history feeds the funnels.
+# Readers take the same lock as updates; snapshot() hands out a copy that
+# later updates leave alone.
+
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from journeys import JourneyIndex
+
+KEY_COLUMN = 'event_id'
+EXIT_ACTIONS = ['wand_activity_end', 'activity_back_button']
+
+
+class TransitionMatrix:
+    """Incrementally maintained activity transition counts of the whole fleet."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.activities = []
+        self._activity_codes = {}
+        self._session_ids = {}
+        self.counts = sparse.csr_matrix((0, 0), dtype=np.int64)
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.exits = pd.DataFrame(columns=EXIT_ACTIONS, dtype=np.int64)
+        self._last_activity = np.zeros(0, dtype=np.int64)
+        self._step_session = np.zeros(0, dtype=np.int64)
+        self._step_activity = np.zeros(0, dtype=np.int64)
+        self.watermark = None
+
+    @staticmethod
+    def _codes(values, table, labels=None):
+        """Maps values to stable integer ids, adding new ones to table."""
+        inverse, uniques = pd.factorize(values)
+        ids = np.empty(len(uniques), dtype=np.int64)
+        for i, value in enumerate(uniques):
+            ids[i] = table.setdefault(value, len(table))
+            if labels is not None and ids[i] == len(labels):
+                labels.append(value)
+        return ids[inverse]
+
+    def update(self, events):
+        """Adds a batch of events that all follow the ones already counted."""
+        if not len(events):
+            return
+        steps = JourneyIndex(events).fleet_steps()
+        with self._lock:
+            activity = self._codes(steps['activity_id'].astype(str), self._activity_codes, self.activities)
+            session = self._codes(pd.MultiIndex.from_arrays([steps['wand_identifier'], steps['session_id']]), self._session_ids)
+            n_activities, n_sessions = len(self.activities), len(self._session_ids)
+            known = len(self._last_activity)
+            self._last_activity = np.concatenate((self._last_activity, np.full(n_sessions - known, -1)))
+            self.starts = np.concatenate((self.starts, np.zeros(n_activities - len(self.starts), dtype=np.int64)))
+
+            # A session's first step in this batch either continues its last
+            # known step (same activity: merged) or follows it.
+            first = np.ones(len(steps), dtype=bool)
+            first[1:] = session[1:] != session[:-1]
+            previous = np.where(first, self._last_activity[session], np.roll(activity, 1))
+            merged = first & (previous == activity)
+            moved = (previous >= 0) & ~merged
+            np.add.at(self.starts, activity[first & (previous < 0)], 1)
+
+            new = sparse.coo_matrix((np.ones(np.count_nonzero(moved), dtype=np.int64), (previous[moved], activity[moved])),
+                                    shape=(n_activities, n_activities)).tocsr()
+            counts = self.counts.copy()
+            counts.resize((n_activities, n_activities))
+            self.counts = counts + new
+
+            last = np.ones(len(steps), dtype=bool)
+            last[:-1] = session[1:] != session[:-1]
+            self._last_activity[session[last]] = activity[last]
+            self._step_session = np.concatenate((self._step_session, session[~merged]))
+            self._step_activity = np.concatenate((self._step_activity, activity[~merged]))
+
+            exits = events[events['action'].isin(EXIT_ACTIONS) & events['activity_id'].notna()]
+            batch_exits = pd.crosstab(exits['activity_id'].astype(str), exits['action'].astype(str))
+            self.exits = self.exits.add(batch_exits.reindex(columns=EXIT_ACTIONS, fill_value=0), fill_value=0).astype(np.int64)
+            batch_max = int(events[KEY_COLUMN].max())
+            self.watermark = batch_max if self.watermark is None else max(self.watermark, batch_max)
+
+    def update_from(self, df):
+        """Counts the rows of df past the watermark; starts over when df no longer extends it."""
+        with self._lock:
+            if self.watermark is not None and len(df) and int(df[KEY_COLUMN].max()) < self.watermark:
+                self._reset()
+            if self.watermark is None:
+                self.update(df)
+            else:
+                self.update(df[df[KEY_COLUMN] > self.watermark])
+        return self
+
+    def snapshot(self, df):
+        """Counts the rows of df past the watermark and returns a copy of the result."""
+        with self._lock:
+            self.update_from(df)
+            clone = TransitionMatrix()
+            for name, value in vars(self).items():
+                if name != '_lock':
+                    setattr(clone, name, value.copy() if hasattr(value, 'copy') else value)
+            return clone
+
+    def to_frame(self):
+        """Returns the non-zero transitions as (from, to, count) rows."""
+        with self._lock:
+            coo = self.counts.tocoo()
+            labels = np.asarray(self.activities, dtype=object)
+            return pd.DataFrame({'from': labels[coo.row], 'to': labels[coo.col], 'count': coo.data})
+
+    def drop_offs(self):
+        """Returns per activity the sessions whose last step it is, and the exit events in it."""
+        with self._lock:
+            ended = self._last_activity[self._last_activity >= 0]
+            result = pd.DataFrame({
+                'Sessions started': self.starts,
+                'Sessions ended': np.bincount(ended, minlength=len(self.activities)),
+            }, index=pd.Index(self.activities, name='activity_id'))
+            return result.join(self.exits).fillna(0).astype(np.int64)
+
+    def common_path(self, length=3):
+        """Returns the most frequent start activity followed by its most frequent successors."""
+        with self._lock:
+            if not len(self.activities):
+                return []
+            path = [int(np.argmax(self.starts))]
+            rows = self.counts.tocsr()
+            while len(path) < length:
+                row = rows.getrow(path[-1]).toarray().ravel()
+                row[path] = 0
+                if not row.any():
+                    break
+                path.append(int(np.argmax(row)))
+            return [self.activities[i] for i in path]
+
+    def funnel(self, stages):
+        """Returns how many sessions reach each stage after reaching the previous ones in order."""
+        with self._lock:
+            n_sessions = len(self._session_ids)
+            position = np.arange(len(self._step_session))
+            reached = np.full(n_sessions, -1, dtype=np.int64)
+            sessions = []
+            for k, stage in enumerate(stages):
+                code = self._activity_codes.get(stage, -1)
+                mask = self._step_activity == code
+                if k:
+                    mask &= position > reached[self._step_session]
+                    mask &= reached[self._step_session] >= 0
+                first = np.full(n_sessions, np.iinfo(np.int64).max, dtype=np.int64)
+                np.minimum.at(first, self._step_session[mask], position[mask])
+                reached = np.where(first < np.iinfo(np.int64).max, first, -1)
+                sessions.append(int(np.count_nonzero(reached >= 0)))
+            result = pd.DataFrame({'stage': list(stages), 'Sessions': sessions})
+            result['Conversion'] = (result['Sessions'] / result['Sessions'].iloc[0]).round(3) if sessions and sessions[0] else 0.0
+            return result